@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from server import client, rebuild_daily_stats
+
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+async def backfill(restaurant_id, from_day, to_day):
+    match = {}
+    if restaurant_id:
+        match["restaurant_id"] = restaurant_id
+    if from_day or to_day:
+        match["created_at"] = {}
+        if from_day:
+            match["created_at"]["$gte"] = from_day
+        if to_day:
+            # --to is inclusive of the whole day
+            match["created_at"]["$lt"] = to_day + timedelta(days=1)
+
+    print(f"Rebuilding daily_stats from order history (filter: {match or 'all orders'})...")
+    await rebuild_daily_stats(match)
+    print("Daily stats rebuilt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily_stats rollups from order history")
+    parser.add_argument("--restaurant", help="Only rebuild this restaurant's rollups")
+    parser.add_argument("--from", dest="from_day", type=parse_day, help="First day to rebuild (YYYY-MM-DD, UTC)")
+    parser.add_argument("--to", dest="to_day", type=parse_day, help="Last day to rebuild (YYYY-MM-DD, UTC)")
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.restaurant, args.from_day, args.to_day))
+    client.close()
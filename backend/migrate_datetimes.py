@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime, timezone
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME']]
+
+# Timestamp fields that older code wrote as ISO strings, per collection.
+# "array.field" entries are timestamps inside arrays of sub-documents.
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "restaurants": ["created_at", "updated_at"],
+    "menu_items": ["created_at"],
+    "cart_items": ["added_at"],
+    "orders": ["created_at", "updated_at", "status_history.at"],
+    "checkouts": ["created_at", "updated_at"],
+}
+# Archived orders (monthly orders_archive_YYYYMM collections) are migrated along with "orders"
+ORDER_ARCHIVE_PATTERN = r"^orders_archive_\d{6}$"
+
+
+def parse_timestamp(value):
+    if not isinstance(value, str):
+        return value
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def build_update(doc, fields):
+    updates = {}
+    for field in fields:
+        if '.' in field:
+            array_field, sub_field = field.split('.', 1)
+            entries = doc.get(array_field)
+            if isinstance(entries, list) and any(isinstance(entry.get(sub_field), str) for entry in entries):
+                updates[array_field] = [
+                    {**entry, sub_field: parse_timestamp(entry.get(sub_field))} if sub_field in entry else entry
+                    for entry in entries
+                ]
+        elif isinstance(doc.get(field), str):
+            updates[field] = parse_timestamp(doc[field])
+    return updates
+
+
+async def migrate_collection(name, fields, batch_size, dry_run):
+    checkpoint_id = f"datetimes:{name}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get('completed'):
+        # A finished collection is rescanned from the start to pick up stragglers
+        checkpoint = {}
+
+    # Only documents still holding string timestamps are visited, so re-runs are cheap
+    string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    converted = checkpoint.get('converted', 0)
+    last_id = checkpoint.get('last_id')
+    total = converted + await db[name].count_documents(string_filter)
+    print(f"{name}: {total} documents to convert" + (f" (resuming after {last_id})" if last_id else ""))
+
+    while True:
+        query = dict(string_filter)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        projection = {field.split('.', 1)[0]: 1 for field in fields}
+        batch = await db[name].find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            updates = build_update(doc, fields)
+            if updates:
+                operations.append(UpdateOne({"_id": doc['_id']}, {"$set": updates}))
+
+        if operations and not dry_run:
+            await db[name].bulk_write(operations, ordered=False)
+
+        converted += len(operations)
+        last_id = batch[-1]['_id']
+        if not dry_run:
+            await db.migrations.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"last_id": last_id, "converted": converted, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        print(f"{name}: {converted}/{total} converted")
+
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"completed": True, "last_id": None, "converted": 0, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    print(f"{name}: done ({converted} documents)")
+
+
+async def migrate(collections, batch_size, dry_run):
+    print("Converting ISO string timestamps to native dates...")
+    for name in collections:
+        await migrate_collection(name, DATETIME_FIELDS[name], batch_size, dry_run)
+        if name == "orders":
+            archives = await db.list_collection_names(filter={"name": {"$regex": ORDER_ARCHIVE_PATTERN}})
+            for archive in sorted(archives):
+                await migrate_collection(archive, DATETIME_FIELDS["orders"], batch_size, dry_run)
+    print("Migration complete")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite ISO string timestamps as native BSON dates")
+    parser.add_argument("--collection", action="append", choices=sorted(DATETIME_FIELDS),
+                        help="Collection to migrate (repeatable, defaults to all; orders includes its archives)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.collection or list(DATETIME_FIELDS), args.batch_size, args.dry_run))
+    client.close()
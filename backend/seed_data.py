@@ -3,6 +3,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from datetime import datetime, timezone
 import bcrypt
 
 ROOT_DIR = Path(__file__).parent
@@ -37,7 +38,7 @@ async def seed_saas_platform():
             "phone": "9999999999",
             "role": "super_admin",
             "addresses": [],
-            "created_at": "2024-01-01T00:00:00"
+            "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc)
         },
         {
             "id": "user-owner-1",
@@ -48,7 +49,7 @@ async def seed_saas_platform():
             "role": "restaurant_owner",
             "restaurant_id": "restaurant-1",
             "addresses": [],
-            "created_at": "2024-01-05T00:00:00"
+            "created_at": datetime(2024, 1, 5, tzinfo=timezone.utc)
         },
         {
             "id": "user-owner-2",
@@ -59,7 +60,7 @@ async def seed_saas_platform():
             "role": "restaurant_owner",
             "restaurant_id": "restaurant-2",
             "addresses": [],
-            "created_at": "2024-01-10T00:00:00"
+            "created_at": datetime(2024, 1, 10, tzinfo=timezone.utc)
         },
         {
             "id": "user-customer-1",
@@ -69,7 +70,7 @@ async def seed_saas_platform():
             "phone": "9988776655",
             "role": "customer",
             "addresses": ["123 Main Street, Mumbai, Maharashtra"],
-            "created_at": "2024-02-01T00:00:00"
+            "created_at": datetime(2024, 2, 1, tzinfo=timezone.utc)
         }
     ]
     
@@ -93,8 +94,8 @@ async def seed_saas_platform():
             "status": "active",
             "subscription_plan": "premium",
             "commission_rate": 10.0,
-            "created_at": "2024-01-05T00:00:00",
-            "updated_at": "2024-01-05T00:00:00"
+            "created_at": datetime(2024, 1, 5, tzinfo=timezone.utc),
+            "updated_at": datetime(2024, 1, 5, tzinfo=timezone.utc)
         },
         {
             "id": "restaurant-2",
@@ -111,8 +112,8 @@ async def seed_saas_platform():
             "status": "active",
             "subscription_plan": "basic",
             "commission_rate": 12.0,
-            "created_at": "2024-01-10T00:00:00",
-            "updated_at": "2024-01-10T00:00:00"
+            "created_at": datetime(2024, 1, 10, tzinfo=timezone.utc),
+            "updated_at": datetime(2024, 1, 10, tzinfo=timezone.utc)
         }
     ]
     
@@ -191,7 +192,7 @@ async def seed_saas_platform():
             "is_available": True,
             "rating": 4.7,
             "prep_time": 30,
-            "created_at": "2024-01-06T00:00:00"
+            "created_at": datetime(2024, 1, 6, tzinfo=timezone.utc)
         },
         {
             "id": "item-r1-2",
@@ -210,7 +211,7 @@ async def seed_saas_platform():
             "is_available": True,
             "rating": 4.8,
             "prep_time": 20,
-            "created_at": "2024-01-06T00:00:00"
+            "created_at": datetime(2024, 1, 6, tzinfo=timezone.utc)
         },
         {
             "id": "item-r1-3",
@@ -230,7 +231,7 @@ async def seed_saas_platform():
             "is_available": True,
             "rating": 4.9,
             "prep_time": 25,
-            "created_at": "2024-01-06T00:00:00"
+            "created_at": datetime(2024, 1, 6, tzinfo=timezone.utc)
         }
     ]
     
@@ -253,7 +254,7 @@ async def seed_saas_platform():
             "is_available": True,
             "rating": 4.6,
             "prep_time": 15,
-            "created_at": "2024-01-11T00:00:00"
+            "created_at": datetime(2024, 1, 11, tzinfo=timezone.utc)
         },
         {
             "id": "item-r2-2",
@@ -272,7 +273,7 @@ async def seed_saas_platform():
             "is_available": True,
             "rating": 4.8,
             "prep_time": 25,
-            "created_at": "2024-01-11T00:00:00"
+            "created_at": datetime(2024, 1, 11, tzinfo=timezone.utc)
         }
     ]
     
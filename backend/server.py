@@ -1,17 +1,36 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Header, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Header, Depends, Query
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, ReadPreference, UpdateOne
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import asyncio
+import json
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict
 import uuid
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+from collections import deque
+import time
 import bcrypt
 import jwt
-import razorpay
+import hmac
+import hashlib
+import random
+import heapq
+import secrets
+import httpx
+import numpy as np
+import pandas as pd
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -19,7 +38,10 @@ load_dotenv(ROOT_DIR / '.env')
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+
+# Timestamps are stored as native BSON dates and read back as timezone-aware UTC datetimes
+STORAGE_CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+db = client.get_database(os.environ['DB_NAME'], codec_options=STORAGE_CODEC_OPTIONS)
 
 # JWT Secret
 JWT_SECRET = os.environ.get('JWT_SECRET', 'restaurant-saas-secret-2024')
@@ -28,7 +50,7 @@ JWT_ALGORITHM = "HS256"
 # Razorpay configuration
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', 'rzp_test_key')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', 'rzp_test_secret')
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+RAZORPAY_API_URL = os.environ.get('RAZORPAY_API_URL', 'https://api.razorpay.com/v1')
 
 # Create the main app
 app = FastAPI(title="Restaurant SaaS Platform API")
@@ -42,6 +64,58 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# httpx logs every gateway request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+# ==================== IDENTIFIERS ====================
+
+# UUIDv7 ids: 48-bit unix milliseconds, a 12-bit sequence for ordering within a millisecond, then random bits.
+# They sort by creation time, so new documents append to the right edge of the _id index.
+_id_last_ms = 0
+_id_sequence = 0
+
+def new_id() -> str:
+    global _id_last_ms, _id_sequence
+    now_ms = time.time_ns() // 1_000_000
+    if now_ms <= _id_last_ms:
+        now_ms = _id_last_ms
+        _id_sequence += 1
+        if _id_sequence > 0xFFF:
+            now_ms += 1
+            _id_sequence = 0
+    else:
+        _id_sequence = 0
+    _id_last_ms = now_ms
+    
+    random_bits = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    value = (now_ms << 80) | (0x7 << 76) | (_id_sequence << 64) | (0b10 << 62) | random_bits
+    return str(uuid.UUID(int=value))
+
+def id_timestamp(entity_id: str) -> Optional[datetime]:
+    # Creation time embedded in a UUIDv7 id, or None for legacy uuid4 ids
+    try:
+        value = uuid.UUID(entity_id)
+    except (ValueError, AttributeError, TypeError):
+        return None
+    if value.version != 7:
+        return None
+    return datetime.fromtimestamp((value.int >> 80) / 1000, tz=timezone.utc)
+
+# Orders keep their id in _id. Orders written before that have a separate "id" field and still resolve.
+def order_id_query(order_id: str) -> dict:
+    return {"$or": [{"_id": order_id}, {"id": order_id}]}
+
+def order_storage_doc(order: BaseModel) -> dict:
+    order_doc = order.model_dump()
+    order_doc['_id'] = order_doc.pop('id')
+    return order_doc
+
+def order_out(order_doc: dict) -> dict:
+    order = dict(order_doc)
+    object_id = order.pop('_id', None)
+    order.setdefault('id', object_id)
+    return order
 
 
 # ==================== MODELS ====================
@@ -60,7 +134,7 @@ class UserLogin(BaseModel):
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     email: str
     name: str
     phone: str
@@ -83,7 +157,7 @@ class RestaurantCreate(BaseModel):
 
 class Restaurant(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     owner_id: str
     name: str
     slug: str
@@ -98,14 +172,23 @@ class Restaurant(BaseModel):
     subscription_plan: str = "free"
     razorpay_account_id: Optional[str] = None
     commission_rate: float = 10.0  # Platform commission percentage
+    max_active_orders: Optional[int] = None  # Kitchen capacity; None means unlimited
+    max_queue_prep_minutes: Optional[int] = None
+    kitchen_stations: Optional[int] = None  # Orders' lines cooked in parallel; None uses KITCHEN_STATIONS
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class RestaurantCapacityUpdate(BaseModel):
+    max_active_orders: Optional[int] = None
+    max_queue_prep_minutes: Optional[int] = None
+    kitchen_stations: Optional[int] = None
+
 # Menu Item Variant Model
 class MenuItemVariant(BaseModel):
     name: str  # Half, Full, Mini, Family Pack
     price: float
     available: bool = True
+    stock: Optional[int] = None  # None means stock is not tracked for this variant
 
 # Menu Item Models
 class MenuItemCreate(BaseModel):
@@ -120,7 +203,7 @@ class MenuItemCreate(BaseModel):
 
 class MenuItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     restaurant_id: str
     name: str
     description: str
@@ -143,7 +226,7 @@ class CategoryCreate(BaseModel):
 
 class Category(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     restaurant_id: str
     name: str
     description: str
@@ -158,7 +241,7 @@ class CartItemAdd(BaseModel):
 
 class CartItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     user_id: str
     restaurant_id: str
     menu_item_id: str
@@ -173,34 +256,100 @@ class OrderItem(BaseModel):
     variant_name: str
     quantity: int
     price: float
+    prep_time: Optional[int] = None  # Minutes, copied from the menu item when the order is placed
 
 class OrderCreate(BaseModel):
     restaurant_id: str
     delivery_address: str
-    items: List[OrderItem]
-    total_amount: float
+    items: List[OrderItem]  # Only menu_item_id, variant_name and quantity are used; prices come from the menu
+    total_amount: Optional[float] = None  # Ignored; kept so existing clients keep validating
+
+class CheckoutCreate(BaseModel):
+    delivery_address: str
 
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     user_id: str
     restaurant_id: str
     items: List[OrderItem]
     total_amount: float
     commission_amount: float
     restaurant_amount: float
+    # Exact amounts in paise; settlement and rollups use these, the float fields are for display
+    total_paise: Optional[int] = None
+    commission_paise: Optional[int] = None
+    restaurant_paise: Optional[int] = None
     status: str = "pending"
     delivery_address: str
     razorpay_order_id: Optional[str] = None
     razorpay_payment_id: Optional[str] = None
     payment_status: str = "pending"
+    status_history: List[dict] = []
+    checkout_id: Optional[str] = None  # Set when created as part of a multi-restaurant checkout
+    reserved_stock: List[dict] = []  # Stock taken at checkout: menu_item_id, variant_name, quantity
+    prep_minutes: int = 0  # Kitchen time: the sum of its lines' prep times
+    created_at: Optional[datetime] = None
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    
+    def model_post_init(self, __context):
+        # created_at matches the time embedded in the id, so an order id doubles as a history cursor
+        if self.created_at is None:
+            self.created_at = id_timestamp(self.id) or datetime.now(timezone.utc)
+
+# A checkout groups the per-restaurant orders of one cart under a single payment
+class Checkout(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=new_id)
+    user_id: str
+    order_ids: List[str]
+    total_amount: float
+    total_paise: Optional[int] = None
+    razorpay_order_id: Optional[str] = None
+    razorpay_payment_id: Optional[str] = None
+    payment_status: str = "pending"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Outbound delivery: a restaurant's POS/printer webhook, or an SMS/email recipient
+class DeliveryEndpointCreate(BaseModel):
+    kind: str = "webhook"  # webhook, sms, email
+    url: Optional[str] = None  # webhook only
+    recipient: Optional[str] = None  # phone number or email address
+    events: List[str] = ["order.created", "order.paid"]
+
+class DeliveryEndpoint(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=new_id)
+    restaurant_id: str
+    kind: str
+    url: Optional[str] = None
+    recipient: Optional[str] = None
+    events: List[str]
+    secret: str = Field(default_factory=lambda: secrets.token_hex(32))
+    active: bool = True
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Order status state machine: each status lists the statuses it may move to
+ORDER_STATUS_TRANSITIONS = {
+    "pending": ["confirmed", "cancelled"],
+    "confirmed": ["preparing", "cancelled"],
+    "preparing": ["out_for_delivery", "cancelled"],
+    "out_for_delivery": ["delivered"],
+    "delivered": [],
+    "cancelled": []
+}
+
+# Statuses an order must currently be in to move to a given status
+ORDER_STATUS_PREDECESSORS = {
+    status: [previous for previous, targets in ORDER_STATUS_TRANSITIONS.items() if status in targets]
+    for status in ORDER_STATUS_TRANSITIONS
+}
+
 # Subscription Plan Models
 class SubscriptionPlan(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     name: str
     price: float
     duration_days: int
@@ -246,221 +395,2276 @@ async def require_role(required_roles: List[str], user_data: dict = Depends(get_
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     return user_data
 
+# Restaurants change rarely, so hot paths like checkout read them through a short-lived cache
+RESTAURANT_CACHE_TTL = int(os.environ.get('RESTAURANT_CACHE_TTL', '60'))
+_restaurant_cache: Dict[str, tuple] = {}
 
-# ==================== AUTH ROUTES ====================
-
-@api_router.post("/auth/register")
-async def register(user_data: UserRegister):
-    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 0})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    hashed_password = bcrypt.hashpw(user_data.password.encode('utf-8'), bcrypt.gensalt())
-    
-    user = User(
-        email=user_data.email,
-        name=user_data.name,
-        phone=user_data.phone,
-        role=user_data.role
-    )
+async def get_cached_restaurants(restaurant_ids: List[str]) -> Dict[str, dict]:
+    now = time.monotonic()
+    restaurants = {}
+    missing = []
+    for restaurant_id in restaurant_ids:
+        cached = _restaurant_cache.get(restaurant_id)
+        if cached and cached[0] > now:
+            restaurants[restaurant_id] = cached[1]
+        else:
+            missing.append(restaurant_id)
     
-    user_doc = user.model_dump()
-    user_doc['password'] = hashed_password.decode('utf-8')
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
+    if missing:
+        docs = await db.restaurants.find({"id": {"$in": missing}}, {"_id": 0}).to_list(len(missing))
+        for restaurant in docs:
+            _restaurant_cache[restaurant['id']] = (now + RESTAURANT_CACHE_TTL, restaurant)
+            restaurants[restaurant['id']] = restaurant
     
-    await db.users.insert_one(user_doc)
+    return restaurants
+
+async def get_cached_restaurant(restaurant_id: str) -> Optional[dict]:
+    restaurants = await get_cached_restaurants([restaurant_id])
+    return restaurants.get(restaurant_id)
+
+def invalidate_restaurant_cache(restaurant_id: str):
+    _restaurant_cache.pop(restaurant_id, None)
+
+async def price_cart_items(cart_items: List[dict]) -> tuple:
+    # Price every line from the current variant prices with a single batched lookup.
+    # Returns the order items and the (menu_item_id, variant_name) pairs whose stock is tracked.
+    menu_item_ids = list({cart_item['menu_item_id'] for cart_item in cart_items})
+    menu_items = await db.menu_items.find(
+        {"id": {"$in": menu_item_ids}},
+        {"_id": 0, "id": 1, "restaurant_id": 1, "name": 1, "variants": 1, "is_available": 1, "prep_time": 1}
+    ).to_list(len(menu_item_ids))
+    menu_items_by_id = {menu_item['id']: menu_item for menu_item in menu_items}
     
-    token = create_jwt_token(user.id, user.email, user.role, user.restaurant_id)
+    order_items = []
+    tracked = set()
+    for cart_item in cart_items:
+        menu_item = menu_items_by_id.get(cart_item['menu_item_id'])
+        if not menu_item or not menu_item.get('is_available', True):
+            raise HTTPException(status_code=400, detail="Some items in your cart are no longer available")
+        if menu_item['restaurant_id'] != cart_item['restaurant_id']:
+            raise HTTPException(status_code=400, detail=f"{menu_item['name']} is not on this restaurant's menu")
+        
+        variant = next((v for v in menu_item['variants'] if v['name'] == cart_item['variant_name']), None)
+        if not variant or not variant.get('available', True):
+            raise HTTPException(status_code=400, detail=f"{menu_item['name']} ({cart_item['variant_name']}) is no longer available")
+        if variant.get('stock') is not None:
+            tracked.add((menu_item['id'], variant['name']))
+        
+        order_items.append(OrderItem(
+            menu_item_id=menu_item['id'],
+            menu_item_name=menu_item['name'],
+            variant_name=variant['name'],
+            quantity=cart_item['quantity'],
+            price=variant['price'],
+            prep_time=menu_item.get('prep_time', DEFAULT_PREP_MINUTES)
+        ))
     
+    return order_items, tracked
+
+def split_order_amount(total_amount: float, commission_rate: float) -> dict:
+    # Commission is computed in integer paise (rate in basis points, rounded half up) so the split is exact
+    total_paise = to_paise(total_amount)
+    commission_paise = (total_paise * int(round(commission_rate * 100)) + 5000) // 10000
+    restaurant_paise = total_paise - commission_paise
     return {
-        "token": token,
-        "user": {
-            "id": user.id,
-            "email": user.email,
-            "name": user.name,
-            "phone": user.phone,
-            "role": user.role
-        }
+        "total_amount": total_paise / 100,
+        "commission_amount": commission_paise / 100,
+        "restaurant_amount": restaurant_paise / 100,
+        "total_paise": total_paise,
+        "commission_paise": commission_paise,
+        "restaurant_paise": restaurant_paise
     }
 
-@api_router.post("/auth/login")
-async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+# Order history is paged on (created_at, _id); the cursor is simply the last order id of the page
+ORDER_PAGE_DEFAULT_LIMIT = 50
+ORDER_PAGE_MAX_LIMIT = 200
+
+def storage_time(value: datetime) -> datetime:
+    # Naive datetimes from query parameters are taken to be UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+async def resolve_order_cursor(cursor: str) -> tuple:
+    # The stored created_at, not the id's timestamp: seeded, migrated and backdated orders differ
+    # from their id, and paging on the id's time would hand back the same page forever
+    order = await find_order(order_id_query(cursor), cursor, {"created_at": 1})
+    if not order:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return order['created_at'], order['_id']
+
+def build_order_filters(
+    base_query: dict,
+    status: Optional[str],
+    payment_status: Optional[str],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime]
+) -> dict:
+    query = dict(base_query)
+    if status:
+        query["status"] = status
+    if payment_status:
+        query["payment_status"] = payment_status
+    if from_date or to_date:
+        query["created_at"] = {}
+        if from_date:
+            query["created_at"]["$gte"] = storage_time(from_date)
+        if to_date:
+            query["created_at"]["$lt"] = storage_time(to_date)
+    return query
+
+async def find_orders_page(query: dict, owner: str, cursor: Optional[str], limit: int, response: Response) -> List[dict]:
+    cursor_created_at = None
+    if cursor:
+        cursor_created_at, last_id = await resolve_order_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": cursor_created_at}},
+            {"created_at": cursor_created_at, "_id": {"$lt": last_id}}
+        ]}]}
     
-    if not bcrypt.checkpw(credentials.password.encode('utf-8'), user['password'].encode('utf-8')):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    # Fetch one extra order to know whether another page exists
+    sort = [("created_at", -1), ("_id", -1)]
+    orders = await db.orders.find(query).sort(sort).limit(limit + 1).to_list(limit + 1)
     
-    token = create_jwt_token(user['id'], user['email'], user['role'], user.get('restaurant_id'))
+    # Archived months are merged in only while they could still contribute to this page, and
+    # only months the archive index lists for this user or restaurant
+    owner_months = None
+    for name in await list_archive_collections():
+        month_start, month_end = archive_month_bounds(name)
+        if cursor_created_at and month_start > cursor_created_at:
+            continue
+        if len(orders) > limit and orders[limit]['created_at'] >= month_end:
+            break
+        if owner_months is None:
+            owner_months = await archived_order_months(owner)
+        if name in await list_indexed_archives() and name not in owner_months:
+            continue
+        orders += await db[name].find(query).sort(sort).limit(limit + 1).to_list(limit + 1)
+        orders.sort(key=lambda order: (order['created_at'], str(order['_id'])), reverse=True)
+        orders = orders[:limit + 1]
     
-    return {
-        "token": token,
-        "user": {
-            "id": user['id'],
-            "email": user['email'],
-            "name": user['name'],
-            "phone": user['phone'],
-            "role": user['role'],
-            "restaurant_id": user.get('restaurant_id')
-        }
-    }
+    orders = [order_out(order) for order in orders]
+    if len(orders) > limit:
+        orders = orders[:limit]
+        response.headers["X-Next-Cursor"] = orders[-1]['id']
+    
+    return orders
 
-@api_router.get("/auth/me")
-async def get_current_user_info(user_data: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": user_data['user_id']}, {"_id": 0, "password": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
 
+# ==================== INVENTORY ====================
 
-# ==================== RESTAURANT ROUTES ====================
+# Variants with a stock count are decremented at checkout with a conditional update that only
+# matches while enough stock is left, so concurrent checkouts can never take more than exists.
+# A variant that reaches zero is marked unavailable (and sold_out, so releasing stock can bring
+# it back without overriding an owner who switched it off by hand).
+MENU_CACHE_TTL = int(os.environ.get('MENU_CACHE_TTL', '30'))
+_menu_cache: Dict[str, tuple] = {}
 
-@api_router.post("/restaurants/create")
-async def create_restaurant(restaurant_data: RestaurantCreate, user_data: dict = Depends(get_current_user)):
-    if user_data['role'] != 'restaurant_owner':
-        raise HTTPException(status_code=403, detail="Only restaurant owners can create restaurants")
+async def get_cached_menu(restaurant_id: str) -> List[dict]:
+    cached = _menu_cache.get(restaurant_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
     
-    # Check if slug already exists
-    existing = await db.restaurants.find_one({"slug": restaurant_data.slug}, {"_id": 0})
-    if existing:
-        raise HTTPException(status_code=400, detail="Restaurant slug already exists")
+    items = await db.menu_items.find({"restaurant_id": restaurant_id, "is_available": True}, {"_id": 0}).to_list(1000)
+    _menu_cache[restaurant_id] = (time.monotonic() + MENU_CACHE_TTL, items)
+    return items
+
+def invalidate_menu_cache(restaurant_id: str):
+    _menu_cache.pop(restaurant_id, None)
+
+def stock_lines(order_items: List[OrderItem], tracked: set) -> List[dict]:
+    quantities: Dict[tuple, int] = {}
+    names: Dict[tuple, str] = {}
+    for item in order_items:
+        key = (item.menu_item_id, item.variant_name)
+        if key in tracked:
+            quantities[key] = quantities.get(key, 0) + item.quantity
+            names[key] = item.menu_item_name
+    return [
+        {"menu_item_id": menu_item_id, "menu_item_name": names[(menu_item_id, variant_name)], "variant_name": variant_name, "quantity": quantity}
+        for (menu_item_id, variant_name), quantity in sorted(quantities.items())
+    ]
+
+def adjust_variant_stock(variant_name: str, delta: int) -> list:
+    # Pipeline update touching one variant: adds delta to its stock and keeps availability in step
+    new_stock = {"$add": ["$$variant.stock", delta]}
+    if delta < 0:
+        availability = {"$cond": [
+            {"$gt": [new_stock, 0]},
+            {},
+            {"available": False, "sold_out": True}
+        ]}
+    else:
+        availability = {"$cond": [
+            {"$and": [{"$eq": ["$$variant.sold_out", True]}, {"$gt": [new_stock, 0]}]},
+            {"available": True, "sold_out": False},
+            {}
+        ]}
+    return [{"$set": {"variants": {"$map": {
+        "input": "$variants",
+        "as": "variant",
+        "in": {"$cond": [
+            {"$and": [{"$eq": ["$$variant.name", variant_name]}, {"$ne": [{"$type": "$$variant.stock"}, "missing"]}, {"$ne": ["$$variant.stock", None]}]},
+            {"$mergeObjects": ["$$variant", {"stock": new_stock}, availability]},
+            "$$variant"
+        ]}
+    }}}}]
+
+async def reserve_stock(lines: List[dict], session=None):
+    # One conditional write per variant; run last in the checkout transaction so the hot menu
+    # document is held for as short a time as possible before commit
+    for line in lines:
+        result = await db.menu_items.update_one(
+            {
+                "id": line['menu_item_id'],
+                "variants": {"$elemMatch": {"name": line['variant_name'], "stock": {"$gte": line['quantity']}}}
+            },
+            adjust_variant_stock(line['variant_name'], -line['quantity']),
+            session=session
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=409,
+                detail=f"{line['menu_item_name']} ({line['variant_name']}) has sold out or has fewer left than in your cart"
+            )
+
+async def release_order_stock(order_ids: list):
+    # Gives back the stock of cancelled orders; stock_released makes a repeat call a no-op
+    async def apply(session):
+        orders = await db.orders.find(
+            {"_id": {"$in": order_ids}, "reserved_stock.0": {"$exists": True}, "stock_released": {"$ne": True}},
+            {"restaurant_id": 1, "reserved_stock": 1},
+            session=session
+        ).to_list(len(order_ids))
+        if not orders:
+            return []
+        
+        await db.orders.update_many(
+            {"_id": {"$in": [order['_id'] for order in orders]}},
+            {"$set": {"stock_released": True}},
+            session=session
+        )
+        for order in orders:
+            for line in order['reserved_stock']:
+                await db.menu_items.update_one(
+                    {"id": line['menu_item_id']},
+                    adjust_variant_stock(line['variant_name'], line['quantity']),
+                    session=session
+                )
+        return list({order['restaurant_id'] for order in orders})
     
-    restaurant = Restaurant(
-        owner_id=user_data['user_id'],
-        **restaurant_data.model_dump()
-    )
+    async with await client.start_session() as session:
+        restaurant_ids = await session.with_transaction(apply)
+    for restaurant_id in restaurant_ids:
+        invalidate_menu_cache(restaurant_id)
+
+
+# ==================== KITCHEN CAPACITY ====================
+
+# Each worker keeps an in-memory queue of the orders every kitchen is working on (confirmed or
+# preparing). Status changes this worker performs update the queue directly; the queue is re-read
+# from Mongo when it is older than KITCHEN_LOAD_RECONCILE_SECONDS, which also folds in changes
+# made by other workers. The queue drives both the capacity check and the order ETAs.
+# Orders admitted but not yet paid also hold capacity for KITCHEN_PENDING_HOLD_MINUTES, so a
+# rush of unpaid checkouts cannot all slip past the limit before any of them is confirmed.
+KITCHEN_ACTIVE_STATUSES = ["confirmed", "preparing"]
+KITCHEN_LOAD_RECONCILE_SECONDS = int(os.environ.get('KITCHEN_LOAD_RECONCILE_SECONDS', '30'))
+KITCHEN_PENDING_HOLD_MINUTES = int(os.environ.get('KITCHEN_PENDING_HOLD_MINUTES', '15'))
+KITCHEN_STATIONS = int(os.environ.get('KITCHEN_STATIONS', '2'))
+KITCHEN_ETA_REFRESH_SECONDS = 60
+DEFAULT_PREP_MINUTES = 20
+
+def order_prep_minutes(items: List[OrderItem]) -> int:
+    # Portions of one line are cooked together, so quantity does not multiply the time
+    return sum(item.prep_time if item.prep_time is not None else DEFAULT_PREP_MINUTES for item in items)
+
+def status_entered_at(order: dict, status: str) -> Optional[datetime]:
+    for entry in reversed(order.get('status_history') or []):
+        if entry.get('status') == status:
+            return entry.get('at')
+    return None
+
+class KitchenQueue:
+    def __init__(self):
+        self._kitchens: Dict[str, dict] = {}
     
-    restaurant_doc = restaurant.model_dump()
-    restaurant_doc['created_at'] = restaurant_doc['created_at'].isoformat()
-    restaurant_doc['updated_at'] = restaurant_doc['updated_at'].isoformat()
+    def _entry(self, order: dict, status: str, at: Optional[datetime] = None) -> dict:
+        # Each line is one job for a station; orders without line details count as one job
+        prep_times = [
+            item['prep_time'] if item.get('prep_time') is not None else DEFAULT_PREP_MINUTES
+            for item in order.get('items') or []
+        ] or [order.get('prep_minutes') or DEFAULT_PREP_MINUTES]
+        return {
+            "prep_times": sorted(prep_times, reverse=True),
+            "queued_at": status_entered_at(order, "confirmed") or at or order.get('created_at') or datetime.now(timezone.utc),
+            "started_at": (status_entered_at(order, "preparing") or at) if status == "preparing" else None
+        }
     
-    await db.restaurants.insert_one(restaurant_doc)
+    async def refresh(self, restaurant_ids: List[str]):
+        now = time.monotonic()
+        stale = [
+            restaurant_id for restaurant_id in set(restaurant_ids)
+            if restaurant_id not in self._kitchens or self._kitchens[restaurant_id]['reconciled_at'] < now - KITCHEN_LOAD_RECONCILE_SECONDS
+        ]
+        if not stale:
+            return
+        
+        held_since = datetime.now(timezone.utc) - timedelta(minutes=KITCHEN_PENDING_HOLD_MINUTES)
+        orders = await db.orders.find(
+            {"restaurant_id": {"$in": stale}, "$or": [
+                {"status": {"$in": KITCHEN_ACTIVE_STATUSES}},
+                {"status": "pending", "payment_status": {"$in": ["pending", "failed"]}, "created_at": {"$gte": held_since}}
+            ]},
+            {"id": 1, "restaurant_id": 1, "status": 1, "items.prep_time": 1, "prep_minutes": 1, "status_history": 1, "created_at": 1}
+        ).to_list(None)
+        kitchens = {restaurant_id: {"orders": {}, "held": {}, "reconciled_at": now, "schedule": None} for restaurant_id in stale}
+        for order in orders:
+            order = order_out(order)
+            if order['status'] == "pending":
+                kitchens[order['restaurant_id']]['held'][order['id']] = self._hold(order)
+            else:
+                kitchens[order['restaurant_id']]['orders'][order['id']] = self._entry(order, order['status'])
+        self._kitchens.update(kitchens)
     
-    # Update user's restaurant_id
-    await db.users.update_one(
-        {"id": user_data['user_id']},
-        {"$set": {"restaurant_id": restaurant.id}}
-    )
+    def _hold(self, order: dict) -> dict:
+        return {
+            "prep_minutes": order.get('prep_minutes') or DEFAULT_PREP_MINUTES,
+            "until": (order.get('created_at') or datetime.now(timezone.utc)) + timedelta(minutes=KITCHEN_PENDING_HOLD_MINUTES)
+        }
     
-    return {"restaurant_id": restaurant.id, "message": "Restaurant created successfully. Pending approval."}
-
-@api_router.get("/restaurants")
-async def get_restaurants(status: Optional[str] = None, authorization: str = Header(None)):
-    # Check if super admin
-    try:
-        user_data = await get_current_user(authorization)
-        is_admin = user_data['role'] == 'super_admin'
-    except:
-        is_admin = False
+    def hold(self, order: dict):
+        # A freshly admitted order counts against capacity until it is paid or the hold lapses
+        kitchen = self._kitchens.get(order['restaurant_id'])
+        if kitchen is not None:
+            kitchen['held'][order_out(order)['id']] = self._hold(order)
     
-    query = {}
-    if status:
-        query["status"] = status
-    elif not is_admin:
-        # For non-admin users, only show active restaurants
-        query["status"] = "active"
-    # If admin and no status filter, show all
+    def apply(self, order: dict, old_status: str, new_status: str, at: datetime):
+        kitchen = self._kitchens.get(order['restaurant_id'])
+        if kitchen is None:
+            # Untracked restaurants pick the change up on their first refresh
+            return
+        order_id = order_out(order)['id']
+        kitchen['held'].pop(order_id, None)
+        if new_status in KITCHEN_ACTIVE_STATUSES:
+            entry = kitchen['orders'].get(order_id) or self._entry(order, new_status, at)
+            if new_status == "preparing" and entry['started_at'] is None:
+                entry['started_at'] = at
+            kitchen['orders'][order_id] = entry
+        elif old_status in KITCHEN_ACTIVE_STATUSES or order_id in kitchen['orders']:
+            kitchen['orders'].pop(order_id, None)
+        else:
+            return
+        kitchen['schedule'] = None
     
-    restaurants = await db.restaurants.find(query, {"_id": 0}).to_list(1000)
+    def _schedule(self, restaurant: dict) -> dict:
+        kitchen = self._kitchens.get(restaurant['id'], {"orders": {}, "held": {}, "schedule": None})
+        stations = restaurant.get('kitchen_stations') or KITCHEN_STATIONS
+        now = datetime.now(timezone.utc)
+        schedule = kitchen['schedule']
+        if schedule and schedule['stations'] == stations and schedule['computed_at'] > now - timedelta(seconds=KITCHEN_ETA_REFRESH_SECONDS):
+            return schedule
+        
+        # List scheduling: orders already being prepared go first, then confirmed orders in the
+        # order they were confirmed. Every line of an order is handed to whichever station frees
+        # up first, and the order is ready when its last line is done.
+        queue = sorted(
+            kitchen['orders'].items(),
+            key=lambda item: (item[1]['started_at'] is None, item[1]['started_at'] or item[1]['queued_at'], item[0])
+        )
+        free_at = [now] * stations
+        etas = {}
+        for order_id, entry in queue:
+            # Lines of an order in preparation are assumed to have started together
+            elapsed = now - entry['started_at'] if entry['started_at'] else timedelta(0)
+            ready_at = now
+            for minutes in entry['prep_times']:
+                station_free_at = heapq.heappop(free_at)
+                finish = station_free_at + max(timedelta(minutes=minutes) - elapsed, timedelta(0))
+                heapq.heappush(free_at, finish)
+                ready_at = max(ready_at, finish)
+            etas[order_id] = ready_at
+        
+        schedule = {
+            "etas": etas,
+            "prep_minutes": sum(sum(entry['prep_times']) for entry in kitchen['orders'].values()),
+            "stations": stations,
+            "computed_at": now
+        }
+        if restaurant['id'] in self._kitchens:
+            kitchen['schedule'] = schedule
+        return schedule
+    
+    def eta(self, restaurant: dict, order: dict) -> Optional[datetime]:
+        # Read only: an order confirmed by another worker gets its ETA once the next refresh loads it
+        if order.get('status') not in KITCHEN_ACTIVE_STATUSES:
+            return None
+        return self._schedule(restaurant)['etas'].get(order['id'])
+    
+    def status(self, restaurant: dict, extra_prep_minutes: int = 0) -> dict:
+        schedule = self._schedule(restaurant)
+        now = schedule['computed_at']
+        held = self._kitchens.get(restaurant['id'], {}).get('held', {})
+        for order_id in [order_id for order_id, hold in held.items() if hold['until'] <= now]:
+            del held[order_id]
+        orders = len(schedule['etas']) + len(held)
+        prep_minutes = schedule['prep_minutes'] + sum(hold['prep_minutes'] for hold in held.values())
+        max_orders = restaurant.get('max_active_orders')
+        max_prep = restaurant.get('max_queue_prep_minutes')
+        
+        wait = 0
+        if max_orders and orders >= max_orders:
+            # A slot frees up when the next order in the queue is ready or an unpaid hold lapses
+            next_free = min(list(schedule['etas'].values()) + [hold['until'] for hold in held.values()])
+            wait = max(1, -(-int((next_free - now).total_seconds()) // 60))
+        # Without a specific order, busy means even a one-minute order would not fit
+        incoming = extra_prep_minutes or 1
+        if max_prep and prep_minutes + incoming > max_prep:
+            # The stations work through the excess in parallel
+            excess = prep_minutes + incoming - max_prep
+            wait = max(wait, -(-excess // schedule['stations']))
+        
+        return {
+            "busy": wait > 0,
+            "suggested_wait_minutes": wait,
+            "active_orders": len(schedule['etas']),
+            "pending_orders": len(held),
+            "queued_prep_minutes": prep_minutes
+        }
+
+kitchen_queue = KitchenQueue()
+
+async def with_kitchen_status(restaurants: List[dict]) -> List[dict]:
+    await kitchen_queue.refresh([restaurant['id'] for restaurant in restaurants])
+    for restaurant in restaurants:
+        status = kitchen_queue.status(restaurant)
+        restaurant['busy'] = status['busy']
+        restaurant['suggested_wait_minutes'] = status['suggested_wait_minutes']
     return restaurants
 
-@api_router.get("/restaurants/{restaurant_id}")
-async def get_restaurant(restaurant_id: str):
-    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="Restaurant not found")
-    return restaurant
+async def with_order_etas(orders: List[dict]) -> List[dict]:
+    # eta is when the kitchen expects the order to be ready; only set while it is in the kitchen
+    restaurant_ids = list({order['restaurant_id'] for order in orders if order.get('status') in KITCHEN_ACTIVE_STATUSES})
+    restaurants = await get_cached_restaurants(restaurant_ids) if restaurant_ids else {}
+    await kitchen_queue.refresh(list(restaurants))
+    for order in orders:
+        restaurant = restaurants.get(order['restaurant_id'])
+        order['eta'] = kitchen_queue.eta(restaurant, order) if restaurant else None
+    return orders
 
-@api_router.get("/restaurants/slug/{slug}")
-async def get_restaurant_by_slug(slug: str):
-    restaurant = await db.restaurants.find_one({"slug": slug}, {"_id": 0})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="Restaurant not found")
-    return restaurant
+async def admit_orders(restaurants: Dict[str, dict], prep_minutes: Dict[str, int]):
+    # Rejects the checkout when any of its kitchens is over capacity
+    await kitchen_queue.refresh(list(prep_minutes))
+    for restaurant_id, minutes in prep_minutes.items():
+        restaurant = restaurants[restaurant_id]
+        status = kitchen_queue.status(restaurant, minutes)
+        if status['busy']:
+            metrics.inc("orders_rejected_busy_total", "Orders turned away because the kitchen was at capacity", restaurant_id=restaurant_id)
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "code": "restaurant_busy",
+                    "message": f"{restaurant['name']} is very busy right now, please try again in about {status['suggested_wait_minutes']} minutes",
+                    "restaurant_id": restaurant_id,
+                    "suggested_wait_minutes": status['suggested_wait_minutes']
+                },
+                headers={"Retry-After": str(status['suggested_wait_minutes'] * 60)}
+            )
 
-@api_router.get("/restaurants/my/restaurant")
-async def get_my_restaurant(user_data: dict = Depends(get_current_user)):
-    if user_data['role'] != 'restaurant_owner':
-        raise HTTPException(status_code=403, detail="Only restaurant owners can access this")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": user_data['user_id']}, {"_id": 0})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="Restaurant not found")
-    return restaurant
 
-@api_router.put("/restaurants/{restaurant_id}/update")
-async def update_restaurant(
-    restaurant_id: str,
-    update_data: RestaurantCreate,
-    user_data: dict = Depends(get_current_user)
-):
-    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="Restaurant not found")
+# ==================== IDEMPOTENCY ====================
+
+# Responses to requests carrying an Idempotency-Key are replayed for retries of the same key
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_WAIT_SECONDS = int(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '15'))
+_idempotency_inflight: Dict[str, tuple] = {}
+
+def request_fingerprint(request) -> str:
+    body = json.dumps(jsonable_encoder(request), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def reject_reused_key():
+    raise HTTPException(status_code=422, detail="This Idempotency-Key was already used for a different request")
+
+async def run_idempotent(idempotency_key: Optional[str], user_id: str, scope: str, request, handler) -> dict:
+    if not idempotency_key:
+        return await handler()
     
-    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    record_id = f"{scope}:{user_id}:{idempotency_key}"
+    fingerprint = request_fingerprint(request)
     
-    update_dict = update_data.model_dump()
-    update_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
+    # Duplicates arriving on this worker wait on the in-flight request instead of polling Mongo
+    inflight = _idempotency_inflight.get(record_id)
+    if inflight:
+        if inflight[0] != fingerprint:
+            reject_reused_key()
+        return await asyncio.shield(inflight[1])
     
-    await db.restaurants.update_one(
-        {"id": restaurant_id},
-        {"$set": update_dict}
-    )
+    future = asyncio.get_running_loop().create_future()
+    _idempotency_inflight[record_id] = (fingerprint, future)
+    try:
+        response = await _run_idempotent_request(record_id, fingerprint, handler)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark as retrieved when nobody was waiting
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _idempotency_inflight.pop(record_id, None)
+
+async def _renew_idempotency_lock(record_id: str, owner: str):
+    # Keeps a slow handler's key from being taken over by a duplicate while it is still running
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        await db.idempotency_keys.update_one(
+            {"_id": record_id, "status": "in_progress", "owner": owner},
+            {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+        )
+
+async def _run_idempotent_request(record_id: str, fingerprint: str, handler) -> dict:
+    owner = new_id()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "status": "in_progress",
+                "fingerprint": fingerprint,
+                "owner": owner,
+                "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+                "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            })
+            break
+        except DuplicateKeyError:
+            pass
+        
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if record and record.get('fingerprint', fingerprint) != fingerprint:
+            reject_reused_key()
+        if record and record['status'] == 'completed':
+            return record['response']
+        
+        # Take over keys whose owner died mid-request
+        if record and record['locked_until'] < now:
+            result = await db.idempotency_keys.update_one(
+                {"_id": record_id, "status": "in_progress", "locked_until": record['locked_until']},
+                {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+            )
+            if result.modified_count:
+                break
+        
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+        await asyncio.sleep(0.2)
     
-    return {"message": "Restaurant updated successfully"}
+    renewal = asyncio.create_task(_renew_idempotency_lock(record_id, owner))
+    try:
+        response = await handler()
+    except Exception:
+        # Failed requests are not recorded so the client can retry them
+        await db.idempotency_keys.delete_one({"_id": record_id, "owner": owner})
+        raise
+    finally:
+        renewal.cancel()
+    
+    response = jsonable_encoder(response)
+    # Only the current owner records the response, so a request whose key was taken over cannot
+    # overwrite the response of the request that replaced it
+    result = await db.idempotency_keys.update_one(
+        {"_id": record_id, "status": "in_progress", "owner": owner},
+        {"$set": {"status": "completed", "response": response}}
+    )
+    if not result.matched_count:
+        logger.warning(f"Idempotency key {record_id} was taken over before its response was recorded")
+    return response
 
 
-# ==================== ADMIN ROUTES ====================
+# ==================== ORDER EVENTS ====================
 
-@api_router.put("/admin/restaurants/{restaurant_id}/approve")
-async def approve_restaurant(restaurant_id: str, user_data: dict = Depends(get_current_user)):
-    if user_data['role'] != 'super_admin':
-        raise HTTPException(status_code=403, detail="Only super admin can approve restaurants")
+# "memory" fans events out within this process; "mongo" shares them across workers via change streams
+ORDER_EVENTS_BACKEND = os.environ.get('ORDER_EVENTS_BACKEND', 'memory')
+ORDER_EVENTS_REPLAY_LIMIT = 1000
+ORDER_EVENTS_RETENTION_SECONDS = int(os.environ.get('ORDER_EVENTS_RETENTION_SECONDS', '3600'))
+ORDER_EVENTS_SUBSCRIBER_QUEUE = 256
+SSE_HEARTBEAT_SECONDS = 15
+
+class OrderEventSubscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ORDER_EVENTS_SUBSCRIBER_QUEUE)
+        self.overflowed = False
+
+class OrderEventBus:
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._subscribers: Dict[str, set] = {}
+        self._recent: deque = deque(maxlen=ORDER_EVENTS_REPLAY_LIMIT)
+        self._seq = 0
+        self._watch_task: Optional[asyncio.Task] = None
     
-    await db.restaurants.update_one(
-        {"id": restaurant_id},
-        {"$set": {"status": "active", "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    async def publish(self, event_type: str, order: dict):
+        order = order_out(order)
+        event = {
+            "type": event_type,
+            "order_id": order['id'],
+            "restaurant_id": order['restaurant_id'],
+            "status": order.get('status'),
+            "payment_status": order.get('payment_status'),
+            "at": datetime.now(timezone.utc).isoformat()
+        }
+        channels = [f"restaurant:{order['restaurant_id']}", f"order:{order['id']}"]
+        
+        # Events are best effort; a failed publish must never fail the request that caused it
+        try:
+            if self.backend == 'mongo':
+                # Local subscribers receive it back through the change stream like every other worker
+                await db.order_events.insert_one({
+                    "channels": channels,
+                    "event": event,
+                    "created_at": datetime.now(timezone.utc)
+                })
+            else:
+                self._seq += 1
+                self._recent.append((str(self._seq), channels, event))
+                self._dispatch(str(self._seq), channels, event)
+        except Exception as e:
+            logger.error(f"Publishing order event failed: {str(e)}")
     
-    return {"message": "Restaurant approved successfully"}
-
-@api_router.put("/admin/restaurants/{restaurant_id}/suspend")
-async def suspend_restaurant(restaurant_id: str, user_data: dict = Depends(get_current_user)):
-    if user_data['role'] != 'super_admin':
-        raise HTTPException(status_code=403, detail="Only super admin can suspend restaurants")
+    def _dispatch(self, event_id: str, channels: List[str], event: dict):
+        for channel in channels:
+            for subscriber in list(self._subscribers.get(channel, ())):
+                try:
+                    subscriber.queue.put_nowait((event_id, event))
+                except asyncio.QueueFull:
+                    # Slow consumers are disconnected and resume with Last-Event-ID
+                    subscriber.overflowed = True
     
-    await db.restaurants.update_one(
-        {"id": restaurant_id},
-        {"$set": {"status": "suspended", "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    def subscribe(self, channel: str) -> OrderEventSubscriber:
+        subscriber = OrderEventSubscriber()
+        self._subscribers.setdefault(channel, set()).add(subscriber)
+        return subscriber
     
-    return {"message": "Restaurant suspended successfully"}
-
-@api_router.get("/admin/analytics")
+    def unsubscribe(self, channel: str, subscriber: OrderEventSubscriber):
+        subscribers = self._subscribers.get(channel)
+        if subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[channel]
+    
+    async def replay(self, channel: str, last_event_id: str) -> List[tuple]:
+        if self.backend == 'mongo':
+            try:
+                after = ObjectId(last_event_id)
+            except InvalidId:
+                return []
+            docs = await db.order_events.find(
+                {"channels": channel, "_id": {"$gt": after}}
+            ).sort("_id", 1).to_list(ORDER_EVENTS_REPLAY_LIMIT)
+            return [(str(doc['_id']), doc['event']) for doc in docs]
+        
+        if not last_event_id.isdigit():
+            return []
+        return [
+            (event_id, event) for event_id, channels, event in self._recent
+            if channel in channels and int(event_id) > int(last_event_id)
+        ]
+    
+    async def start(self):
+        if self.backend == 'mongo':
+            self._watch_task = asyncio.create_task(self._watch())
+    
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+    
+    async def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                async with db.order_events.watch(
+                    [{"$match": {"operationType": "insert"}}],
+                    resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change['fullDocument']
+                        self._dispatch(str(doc['_id']), doc['channels'], doc['event'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Order event change stream failed: {str(e)}")
+                await asyncio.sleep(1)
+
+order_events = OrderEventBus(ORDER_EVENTS_BACKEND)
+
+async def get_stream_user(authorization: str = Header(None), token: Optional[str] = None) -> dict:
+    # EventSource cannot set headers, so streams also accept the JWT as a query parameter
+    if token:
+        return verify_jwt_token(token)
+    return await get_current_user(authorization)
+
+def order_event_stream(channel: str, last_event_id: Optional[str]) -> StreamingResponse:
+    subscriber = order_events.subscribe(channel)
+    
+    async def stream():
+        try:
+            replayed = set()
+            if last_event_id:
+                for event_id, event in await order_events.replay(channel, last_event_id):
+                    replayed.add(event_id)
+                    yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            
+            while not (subscriber.overflowed and subscriber.queue.empty()):
+                try:
+                    event_id, event = await asyncio.wait_for(subscriber.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event_id in replayed:
+                    continue
+                yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            order_events.unsubscribe(channel, subscriber)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== BACKGROUND JOBS ====================
+
+# Identifies this worker when several processes compete for the same periodic job
+WORKER_ID = new_id()
+background_tasks: List[asyncio.Task] = []
+
+async def acquire_job_lease(job: str, seconds: int) -> bool:
+    # Only one worker runs a periodic job at a time; the lease lapses if its holder dies
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.update_one(
+            {"_id": job, "$or": [{"expires_at": {"$lt": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_periodic_job(job: str, interval_seconds: int, handler):
+    while True:
+        try:
+            if await acquire_job_lease(job, interval_seconds * 2):
+                await handler()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background job {job} failed: {str(e)}")
+        await asyncio.sleep(interval_seconds)
+
+def start_background_job(job: str, interval_seconds: int, handler):
+    background_tasks.append(asyncio.create_task(run_periodic_job(job, interval_seconds, handler)))
+
+
+# ==================== OUTBOUND DELIVERY ====================
+
+# Order events are pushed to each restaurant's delivery endpoints. The outbox fans an event out
+# into outbound_deliveries (one per endpoint and order); a dispatcher batches them per destination,
+# signs each batch with the endpoint secret and retries failures with backoff. Deliveries that
+# keep failing stay in the collection with status "dead" as the dead-letter queue.
+# SMS and email go through one HTTP notification gateway instead of a per-restaurant URL.
+NOTIFICATION_GATEWAY_URL = os.environ.get('NOTIFICATION_GATEWAY_URL', '')
+NOTIFICATION_GATEWAY_SECRET = os.environ.get('NOTIFICATION_GATEWAY_SECRET', '')
+DELIVERY_KINDS = ["webhook", "sms", "email"]
+DELIVERY_EVENTS = ["order.created", "order.paid"]
+OUTBOUND_BATCH_SIZE = 500
+OUTBOUND_MAX_EVENTS_PER_REQUEST = 50
+OUTBOUND_PER_DESTINATION_CONCURRENCY = int(os.environ.get('OUTBOUND_PER_DESTINATION_CONCURRENCY', '2'))
+OUTBOUND_TIMEOUT_SECONDS = float(os.environ.get('OUTBOUND_TIMEOUT_SECONDS', '5'))
+OUTBOUND_MAX_ATTEMPTS = 8
+OUTBOUND_LOCK_SECONDS = 120
+OUTBOUND_POLL_SECONDS = float(os.environ.get('OUTBOUND_POLL_SECONDS', '1'))
+OUTBOUND_RETENTION_SECONDS = 3 * 24 * 3600
+_outbound_wakeup: Optional[asyncio.Event] = None
+_outbound_client: Optional[httpx.AsyncClient] = None
+_destination_slots: Dict[str, asyncio.Semaphore] = {}
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    # Receivers recompute HMAC-SHA256 over "<timestamp>.<body>" and reject stale timestamps
+    return hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+
+def notification_message(topic: str, order: dict) -> str:
+    short_id = order['id'][-6:].upper()
+    if topic == "order.paid":
+        return f"Order #{short_id} is paid: ₹{order['total_amount']:.2f}, {len(order['items'])} items"
+    return f"New order #{short_id}: ₹{order['total_amount']:.2f}, {len(order['items'])} items"
+
+async def enqueue_outbound_deliveries(event: dict):
+    orders = event['payload']['orders']
+    restaurant_ids = list({order['restaurant_id'] for order in orders})
+    endpoints = await db.delivery_endpoints.find(
+        {"restaurant_id": {"$in": restaurant_ids}, "active": True, "events": event['topic']},
+        {"_id": 0}
+    ).to_list(1000)
+    if not endpoints:
+        return
+    
+    order_ids = [order['id'] for order in orders]
+    order_docs = await db.orders.find(
+        {"$or": [{"_id": {"$in": order_ids}}, {"id": {"$in": order_ids}}]},
+        {"status_history": 0}
+    ).to_list(len(order_ids))
+    
+    now = datetime.now(timezone.utc)
+    deliveries = []
+    for order in (order_out(doc) for doc in order_docs):
+        for endpoint in endpoints:
+            if endpoint['restaurant_id'] != order['restaurant_id']:
+                continue
+            if endpoint['kind'] == "webhook":
+                body = {"type": event['topic'], "order": jsonable_encoder(order)}
+            else:
+                body = {"channel": endpoint['kind'], "to": endpoint['recipient'], "message": notification_message(event['topic'], order)}
+            deliveries.append({
+                # Deterministic id: a replayed outbox event cannot enqueue the same delivery twice
+                "_id": f"{event['_id']}:{endpoint['id']}:{order['id']}",
+                "endpoint_id": endpoint['id'],
+                "restaurant_id": endpoint['restaurant_id'],
+                "kind": endpoint['kind'],
+                "topic": event['topic'],
+                "body": body,
+                "status": "pending",
+                "attempts": 0,
+                "available_at": now,
+                "locked_until": None,
+                "created_at": now
+            })
+    if not deliveries:
+        return
+    
+    try:
+        await db.outbound_deliveries.insert_many(deliveries, ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+    if _outbound_wakeup is not None:
+        _outbound_wakeup.set()
+
+def outbound_client() -> httpx.AsyncClient:
+    global _outbound_client
+    if _outbound_client is None:
+        _outbound_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OUTBOUND_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+        )
+    return _outbound_client
+
+async def send_outbound_batch(destination: dict, deliveries: List[dict]) -> tuple:
+    # Returns (delivered, permanent failure, error)
+    if destination['kind'] == "webhook":
+        url, secret = destination['url'], destination['secret']
+        body = {"events": [delivery['body'] for delivery in deliveries]}
+    else:
+        if not NOTIFICATION_GATEWAY_URL:
+            return False, False, "NOTIFICATION_GATEWAY_URL is not configured"
+        url, secret = NOTIFICATION_GATEWAY_URL, NOTIFICATION_GATEWAY_SECRET
+        body = {"messages": [delivery['body'] for delivery in deliveries]}
+    
+    payload = json.dumps(body, separators=(",", ":")).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        "X-Delivery-Id": deliveries[0]['_id'],
+        "X-Signature-Timestamp": timestamp,
+        "X-Signature": f"sha256={sign_payload(secret, timestamp, payload)}"
+    }
+    
+    slots = _destination_slots.setdefault(url, asyncio.Semaphore(OUTBOUND_PER_DESTINATION_CONCURRENCY))
+    async with slots:
+        try:
+            response = await outbound_client().post(url, content=payload, headers=headers)
+        except httpx.HTTPError as e:
+            return False, False, f"{type(e).__name__}: {str(e)}"
+    if response.status_code < 300:
+        return True, False, None
+    # Other 4xx answers will not change on retry
+    permanent = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+    return False, permanent, f"HTTP {response.status_code}"
+
+async def deliver_outbound_group(destination: Optional[dict], deliveries: List[dict]):
+    now = datetime.now(timezone.utc)
+    if destination is None or not destination['active']:
+        await db.outbound_deliveries.update_many(
+            {"_id": {"$in": [delivery['_id'] for delivery in deliveries]}},
+            {"$set": {"status": "cancelled", "locked_until": None, "finished_at": now}}
+        )
+        return
+    
+    for start in range(0, len(deliveries), OUTBOUND_MAX_EVENTS_PER_REQUEST):
+        batch = deliveries[start:start + OUTBOUND_MAX_EVENTS_PER_REQUEST]
+        delivered, permanent, error = await send_outbound_batch(destination, batch)
+        metrics.inc("outbound_deliveries_total", "Outbound order event deliveries by outcome", len(batch),
+                    kind=destination['kind'], outcome="delivered" if delivered else "failed")
+        
+        if delivered:
+            await db.outbound_deliveries.update_many(
+                {"_id": {"$in": [delivery['_id'] for delivery in batch]}},
+                {"$set": {"status": "delivered", "locked_until": None, "finished_at": datetime.now(timezone.utc)}}
+            )
+            continue
+        
+        operations = []
+        for delivery in batch:
+            attempts = delivery['attempts'] + 1
+            update = {"attempts": attempts, "last_error": error, "locked_until": None}
+            if permanent or attempts >= OUTBOUND_MAX_ATTEMPTS:
+                update["status"] = "dead"
+                update["dead_at"] = now
+            else:
+                update["available_at"] = now + timedelta(seconds=min(10 * 2 ** attempts, 3600) * random.uniform(0.5, 1))
+            operations.append(UpdateOne({"_id": delivery['_id']}, {"$set": update}))
+        await db.outbound_deliveries.bulk_write(operations, ordered=False)
+        if permanent or any(delivery['attempts'] + 1 >= OUTBOUND_MAX_ATTEMPTS for delivery in batch):
+            logger.warning(f"Outbound deliveries to endpoint {destination['id']} moved to dead letters: {error}")
+
+async def dispatch_outbound() -> int:
+    now = datetime.now(timezone.utc)
+    ready = {
+        "status": "pending",
+        "available_at": {"$lte": now},
+        "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+    }
+    candidates = await db.outbound_deliveries.find(ready, {"_id": 1}).sort("available_at", 1).limit(OUTBOUND_BATCH_SIZE).to_list(OUTBOUND_BATCH_SIZE)
+    if not candidates:
+        return 0
+    
+    lock_until = now + timedelta(seconds=OUTBOUND_LOCK_SECONDS)
+    await db.outbound_deliveries.update_many(
+        {**ready, "_id": {"$in": [candidate['_id'] for candidate in candidates]}},
+        {"$set": {"locked_by": WORKER_ID, "locked_until": lock_until}}
+    )
+    deliveries = await db.outbound_deliveries.find(
+        {"locked_by": WORKER_ID, "locked_until": lock_until, "status": "pending"}
+    ).sort("created_at", 1).to_list(OUTBOUND_BATCH_SIZE)
+    
+    by_endpoint: Dict[str, List[dict]] = {}
+    for delivery in deliveries:
+        by_endpoint.setdefault(delivery['endpoint_id'], []).append(delivery)
+    endpoints = await db.delivery_endpoints.find({"id": {"$in": list(by_endpoint)}}, {"_id": 0}).to_list(len(by_endpoint))
+    endpoints = {endpoint['id']: endpoint for endpoint in endpoints}
+    
+    await asyncio.gather(*[
+        deliver_outbound_group(endpoints.get(endpoint_id), group) for endpoint_id, group in by_endpoint.items()
+    ])
+    return len(deliveries)
+
+async def run_outbound_dispatcher():
+    while True:
+        try:
+            dispatched = await dispatch_outbound()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbound dispatch failed: {str(e)}")
+            dispatched = 0
+        if dispatched < OUTBOUND_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_outbound_wakeup.wait(), OUTBOUND_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _outbound_wakeup.clear()
+
+def start_outbound_dispatcher():
+    global _outbound_wakeup
+    _outbound_wakeup = asyncio.Event()
+    background_tasks.append(asyncio.create_task(run_outbound_dispatcher()))
+
+async def stop_outbound_dispatcher():
+    global _outbound_client
+    if _outbound_client is not None:
+        await _outbound_client.aclose()
+        _outbound_client = None
+
+
+# ==================== OUTBOX ====================
+
+# Side effects of a state change are written to the outbox in the same transaction as the change
+# and carried out afterwards by a dispatcher. Delivery is at least once, so handlers are idempotent;
+# each handler of an event is retried with backoff on its own.
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_LOCK_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_RETENTION_SECONDS = 7 * 24 * 3600
+_outbox_wakeup: Optional[asyncio.Event] = None
+
+def outbox_order(order: dict) -> dict:
+    order = order_out(order)
+    return {
+        "id": order['id'],
+        "user_id": order.get('user_id'),
+        "restaurant_id": order['restaurant_id'],
+        "status": order.get('status'),
+        "payment_status": order.get('payment_status')
+    }
+
+async def write_outbox(topic: str, payload: dict, session=None):
+    now = datetime.now(timezone.utc)
+    await db.outbox.insert_one({
+        "_id": new_id(),
+        "topic": topic,
+        "payload": payload,
+        "status": "pending",
+        "handlers": {name: {"status": "pending", "attempts": 0} for name in OUTBOX_HANDLERS[topic]},
+        "available_at": now,
+        "locked_until": None,
+        "created_at": now
+    }, session=session)
+
+def wake_outbox_dispatcher():
+    # Called after the writing transaction commits so the event is picked up without waiting for a poll
+    if _outbox_wakeup is not None:
+        _outbox_wakeup.set()
+
+async def publish_outbox_orders(event: dict):
+    for order in event['payload']['orders']:
+        await order_events.publish(event['topic'], order)
+
+OUTBOX_HANDLERS = {
+    "order.created": {"publish_events": publish_outbox_orders, "deliver_outbound": enqueue_outbound_deliveries},
+    # The cart is not touched here: checkout already consumed the lines it turned into orders
+    "order.paid": {"publish_events": publish_outbox_orders, "deliver_outbound": enqueue_outbound_deliveries}
+}
+
+async def deliver_outbox_event(event: dict):
+    now = datetime.now(timezone.utc)
+    handlers = event['handlers']
+    for name, state in handlers.items():
+        if state['status'] != "pending" or state.get('next_attempt_at', now) > now:
+            continue
+        if name not in OUTBOX_HANDLERS[event['topic']]:
+            # Handler retired after the event was written
+            state['status'] = "done"
+            continue
+        try:
+            await OUTBOX_HANDLERS[event['topic']][name](event)
+            state['status'] = "done"
+            outcome = "done"
+        except Exception as e:
+            state['attempts'] += 1
+            state['last_error'] = str(e)
+            if state['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                state['status'] = "dead"
+                outcome = "dead"
+                logger.error(f"Outbox handler {event['topic']}/{name} gave up on {event['_id']}: {str(e)}")
+            else:
+                state['next_attempt_at'] = now + timedelta(seconds=min(2 ** state['attempts'], 600) * random.uniform(0.5, 1))
+                outcome = "retry"
+        metrics.inc("outbox_deliveries_total", "Outbox handler runs by outcome", topic=event['topic'], handler=name, outcome=outcome)
+    
+    waiting = [state['next_attempt_at'] for state in handlers.values() if state['status'] == "pending"]
+    update = {"handlers": handlers, "locked_until": None}
+    if waiting:
+        update["available_at"] = min(waiting)
+    else:
+        update["status"] = "done"
+        update["completed_at"] = datetime.now(timezone.utc)
+    await db.outbox.update_one({"_id": event['_id'], "locked_by": WORKER_ID}, {"$set": update})
+
+async def dispatch_outbox() -> int:
+    now = datetime.now(timezone.utc)
+    ready = {
+        "status": "pending",
+        "available_at": {"$lte": now},
+        "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+    }
+    candidates = await db.outbox.find(ready, {"_id": 1}).sort("available_at", 1).limit(OUTBOX_BATCH_SIZE).to_list(OUTBOX_BATCH_SIZE)
+    if not candidates:
+        return 0
+    
+    # Claim the batch in one write; other workers skip whatever this one locked
+    lock_until = now + timedelta(seconds=OUTBOX_LOCK_SECONDS)
+    await db.outbox.update_many(
+        {**ready, "_id": {"$in": [candidate['_id'] for candidate in candidates]}},
+        {"$set": {"locked_by": WORKER_ID, "locked_until": lock_until}}
+    )
+    events = await db.outbox.find({"locked_by": WORKER_ID, "locked_until": lock_until, "status": "pending"}).to_list(OUTBOX_BATCH_SIZE)
+    
+    await asyncio.gather(*[deliver_outbox_event(event) for event in events])
+    if events:
+        metrics.set("outbox_lag_seconds", "Age of the oldest event in the last dispatched batch",
+                    (datetime.now(timezone.utc) - min(event['created_at'] for event in events)).total_seconds())
+    return len(events)
+
+async def run_outbox_dispatcher():
+    while True:
+        try:
+            dispatched = await dispatch_outbox()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox dispatch failed: {str(e)}")
+            dispatched = 0
+        if dispatched < OUTBOX_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_outbox_wakeup.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _outbox_wakeup.clear()
+
+def start_outbox_dispatcher():
+    global _outbox_wakeup
+    _outbox_wakeup = asyncio.Event()
+    background_tasks.append(asyncio.create_task(run_outbox_dispatcher()))
+
+
+# ==================== METRICS ====================
+
+# Minimal in-process registry rendered in the Prometheus text format at /api/metrics
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, dict] = {}
+    
+    def _series(self, name: str, kind: str, help_text: str) -> dict:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = {"type": kind, "help": help_text, "samples": {}}
+        return metric['samples']
+    
+    def inc(self, name: str, help_text: str, value: float = 1, **labels):
+        samples = self._series(name, "counter", help_text)
+        key = tuple(sorted(labels.items()))
+        samples[key] = samples.get(key, 0) + value
+    
+    def set(self, name: str, help_text: str, value: float, **labels):
+        self._series(name, "gauge", help_text)[tuple(sorted(labels.items()))] = value
+    
+    def observe(self, name: str, help_text: str, value: float, **labels):
+        samples = self._series(name, "summary", help_text)
+        key = tuple(sorted(labels.items()))
+        count, total = samples.get(key, (0, 0.0))
+        samples[key] = (count + 1, total + value)
+    
+    def render(self) -> str:
+        def label_text(key: tuple) -> str:
+            return "{" + ",".join(f'{label}="{value}"' for label, value in key) + "}" if key else ""
+        
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in metric['samples'].items():
+                if metric['type'] == "summary":
+                    lines.append(f"{name}_count{label_text(key)} {value[0]}")
+                    lines.append(f"{name}_sum{label_text(key)} {value[1]}")
+                else:
+                    lines.append(f"{name}{label_text(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+
+# ==================== PAYMENT GATEWAY ====================
+
+RAZORPAY_CONNECT_TIMEOUT = float(os.environ.get('RAZORPAY_CONNECT_TIMEOUT', '3'))
+RAZORPAY_READ_TIMEOUT = float(os.environ.get('RAZORPAY_READ_TIMEOUT', '10'))
+RAZORPAY_MAX_CONNECTIONS = int(os.environ.get('RAZORPAY_MAX_CONNECTIONS', '50'))
+RAZORPAY_MAX_RETRIES = int(os.environ.get('RAZORPAY_MAX_RETRIES', '3'))
+RAZORPAY_RETRY_BASE_DELAY = 0.2
+RAZORPAY_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Circuit breaker: trips when, over the rolling window, too many calls fail or are slow
+GATEWAY_CIRCUIT_WINDOW_SECONDS = int(os.environ.get('GATEWAY_CIRCUIT_WINDOW_SECONDS', '30'))
+GATEWAY_CIRCUIT_MIN_CALLS = int(os.environ.get('GATEWAY_CIRCUIT_MIN_CALLS', '20'))
+GATEWAY_CIRCUIT_ERROR_RATE = float(os.environ.get('GATEWAY_CIRCUIT_ERROR_RATE', '0.5'))
+GATEWAY_CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get('GATEWAY_CIRCUIT_SLOW_CALL_SECONDS', '3'))
+GATEWAY_CIRCUIT_SLOW_CALL_RATE = float(os.environ.get('GATEWAY_CIRCUIT_SLOW_CALL_RATE', '0.5'))
+GATEWAY_CIRCUIT_OPEN_SECONDS = int(os.environ.get('GATEWAY_CIRCUIT_OPEN_SECONDS', '30'))
+GATEWAY_CIRCUIT_HALF_OPEN_CALLS = 3
+# Bulkhead: gateway calls in flight per worker, and how long a call may wait for a slot
+GATEWAY_MAX_CONCURRENT_CALLS = int(os.environ.get('GATEWAY_MAX_CONCURRENT_CALLS', '20'))
+GATEWAY_BULKHEAD_WAIT_SECONDS = float(os.environ.get('GATEWAY_BULKHEAD_WAIT_SECONDS', '1'))
+
+class PaymentGatewayError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class GatewayUnavailableError(PaymentGatewayError):
+    # Raised without calling the gateway, when the breaker is open or the bulkhead is full
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, 503)
+        self.retry_after = retry_after
+
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._calls: deque = deque()  # (finished_at, failed, slow)
+        self._trial_calls = 0
+        self._trial_successes = 0
+        self._slots = asyncio.Semaphore(GATEWAY_MAX_CONCURRENT_CALLS)
+        self._in_flight = 0
+        self._set_state("closed")
+    
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit {self.name} {self.state} -> {state}")
+            metrics.inc("payment_gateway_circuit_transitions_total", "Circuit breaker state changes", circuit=self.name, to=state)
+        self.state = state
+        metrics.set("payment_gateway_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                    CIRCUIT_STATE_VALUES[state], circuit=self.name)
+    
+    def retry_after(self) -> int:
+        return max(1, int(self.opened_at + GATEWAY_CIRCUIT_OPEN_SECONDS - time.monotonic()) + 1)
+    
+    def _reject(self, reason: str, retry_after: int):
+        metrics.inc("payment_gateway_rejected_total", "Gateway calls rejected without being sent", circuit=self.name, reason=reason)
+        raise GatewayUnavailableError(f"Payment gateway call rejected: {reason}", retry_after)
+    
+    def _admit(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < GATEWAY_CIRCUIT_OPEN_SECONDS:
+                self._reject("circuit_open", self.retry_after())
+            self._trial_calls = 0
+            self._trial_successes = 0
+            self._set_state("half_open")
+        if self.state == "half_open":
+            # Only a few probe calls go through until the gateway proves healthy again
+            if self._trial_calls >= GATEWAY_CIRCUIT_HALF_OPEN_CALLS:
+                self._reject("circuit_open", 1)
+            self._trial_calls += 1
+    
+    def _record(self, failed: bool, elapsed: float):
+        now = time.monotonic()
+        slow = elapsed >= GATEWAY_CIRCUIT_SLOW_CALL_SECONDS
+        
+        if self.state == "half_open":
+            if failed or slow:
+                self._trip(now)
+            else:
+                self._trial_successes += 1
+                if self._trial_successes >= GATEWAY_CIRCUIT_HALF_OPEN_CALLS:
+                    self._calls.clear()
+                    self._set_state("closed")
+            return
+        if self.state != "closed":
+            return
+        
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - GATEWAY_CIRCUIT_WINDOW_SECONDS:
+            self._calls.popleft()
+        if len(self._calls) < GATEWAY_CIRCUIT_MIN_CALLS:
+            return
+        failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+        slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+        if failures / len(self._calls) >= GATEWAY_CIRCUIT_ERROR_RATE or slow_calls / len(self._calls) >= GATEWAY_CIRCUIT_SLOW_CALL_RATE:
+            self._trip(now)
+    
+    def _trip(self, now: float):
+        self.opened_at = now
+        self._calls.clear()
+        self._set_state("open")
+    
+    async def call(self, operation: str, request):
+        self._admit()
+        
+        # Bulkhead: a slow gateway can hold at most this many requests on the worker
+        try:
+            await asyncio.wait_for(self._slots.acquire(), GATEWAY_BULKHEAD_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            if self.state == "half_open":
+                self._trial_calls -= 1
+            self._reject("bulkhead_full", 1)
+        
+        self._in_flight += 1
+        metrics.set("payment_gateway_in_flight", "Gateway calls currently in flight", self._in_flight, circuit=self.name)
+        started = time.monotonic()
+        failed = True
+        try:
+            result = await request()
+            failed = False
+            return result
+        except PaymentGatewayError as e:
+            # Client errors mean the gateway answered; only outages count against the circuit
+            failed = e.status_code is None or e.status_code == 429 or e.status_code >= 500
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self._slots.release()
+            self._in_flight -= 1
+            metrics.set("payment_gateway_in_flight", "Gateway calls currently in flight", self._in_flight, circuit=self.name)
+            metrics.inc("payment_gateway_requests_total", "Gateway calls by outcome",
+                        operation=operation, outcome="error" if failed else "ok")
+            metrics.observe("payment_gateway_request_seconds", "Gateway call latency including retries", elapsed, operation=operation)
+            self._record(failed, elapsed)
+
+class RazorpayGateway:
+    # Async Razorpay API client sharing one pool of keep-alive connections per worker
+    def __init__(self, key_id: str, key_secret: str, base_url: str):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.base_url = base_url
+        self.breaker = CircuitBreaker("razorpay")
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.key_id, self.key_secret),
+                timeout=httpx.Timeout(RAZORPAY_READ_TIMEOUT, connect=RAZORPAY_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=RAZORPAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=RAZORPAY_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _request(self, operation: str, method: str, path: str, idempotent: bool, **kwargs) -> dict:
+        return await self.breaker.call(operation, lambda: self._send(method, path, idempotent, **kwargs))
+    
+    async def _send(self, method: str, path: str, idempotent: bool, **kwargs) -> dict:
+        # Reads are retried on timeouts and retryable statuses. Writes are only retried when the
+        # connection was never established, since the gateway cannot have seen the request.
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, path, **kwargs)
+                if response.status_code < 400:
+                    return response.json()
+                error = PaymentGatewayError(
+                    f"{method} {path} returned {response.status_code}: {response.text[:200]}",
+                    response.status_code
+                )
+                retryable = idempotent and response.status_code in RAZORPAY_RETRY_STATUSES
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = PaymentGatewayError(f"{method} {path} could not connect: {str(e)}")
+                retryable = True
+            except httpx.HTTPError as e:
+                error = PaymentGatewayError(f"{method} {path} failed: {str(e)}")
+                retryable = idempotent
+            
+            attempt += 1
+            if not retryable or attempt > RAZORPAY_MAX_RETRIES:
+                raise error
+            # Full jitter keeps retries from many workers from arriving in lockstep
+            await asyncio.sleep(random.uniform(0, RAZORPAY_RETRY_BASE_DELAY * 2 ** attempt))
+    
+    async def create_order(self, amount: int, currency: str = "INR", receipt: Optional[str] = None) -> dict:
+        payload = {"amount": amount, "currency": currency, "payment_capture": 1}
+        if receipt:
+            payload["receipt"] = receipt
+        return await self._request("create_order", "POST", "/orders", idempotent=False, json=payload)
+    
+    async def fetch_order(self, razorpay_order_id: str) -> dict:
+        return await self._request("fetch_order", "GET", f"/orders/{razorpay_order_id}", idempotent=True)
+    
+    async def fetch_order_payments(self, razorpay_order_id: str) -> List[dict]:
+        result = await self._request("fetch_order_payments", "GET", f"/orders/{razorpay_order_id}/payments", idempotent=True)
+        return result.get('items', [])
+    
+    def verify_payment_signature(self, razorpay_order_id: str, razorpay_payment_id: str, signature: str) -> bool:
+        expected = hmac.new(
+            self.key_secret.encode(),
+            f"{razorpay_order_id}|{razorpay_payment_id}".encode(),
+            hashlib.sha256
+        ).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+razorpay_gateway = RazorpayGateway(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET, RAZORPAY_API_URL)
+
+
+# ==================== ORDER ARCHIVE ====================
+
+# Finished orders move from the hot "orders" collection into monthly orders_archive_YYYYMM collections
+ORDER_ARCHIVE_ENABLED = os.environ.get('ORDER_ARCHIVE_ENABLED', 'true').lower() == 'true'
+ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '90'))
+ORDER_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ORDER_ARCHIVE_INTERVAL_SECONDS', '3600'))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', '500'))
+ORDER_ARCHIVE_STATUSES = ["delivered", "cancelled"]
+ORDER_ARCHIVE_PREFIX = "orders_archive_"
+ARCHIVE_LIST_CACHE_TTL = 300
+_archive_collections_cache: Dict[str, tuple] = {}
+
+def archive_collection_name(created_at: datetime) -> str:
+    return f"{ORDER_ARCHIVE_PREFIX}{created_at.year:04d}{created_at.month:02d}"
+
+def archive_month_bounds(name: str) -> tuple:
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=timezone.utc) if month == 12 else datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+async def list_archive_collections() -> List[str]:
+    # Newest month first
+    cached = _archive_collections_cache.get('names')
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    names = await db.list_collection_names(filter={"name": {"$regex": f"^{ORDER_ARCHIVE_PREFIX}\\d{{6}}$"}})
+    names = sorted(names, reverse=True)
+    _archive_collections_cache['names'] = (time.monotonic() + ARCHIVE_LIST_CACHE_TTL, names)
+    return names
+
+async def ensure_archive_collection(name: str):
+    if name in await list_archive_collections():
+        return
+    # Archives are read by the same history and lookup queries as the hot collection
+    await db[name].create_index([("restaurant_id", 1), ("status", 1), ("created_at", -1), ("_id", -1)])
+    await db[name].create_index([("restaurant_id", 1), ("created_at", -1), ("_id", -1)])
+    await db[name].create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+    await db[name].create_index("id", partialFilterExpression={"id": {"$exists": True}})
+    await db[name].create_index([("restaurant_id", 1), ("paid_at", 1), ("_id", 1)], sparse=True)
+    await db[name].create_index("razorpay_payment_id", sparse=True)
+    # A new month is indexed batch by batch as orders are moved into it
+    await db.migrations.update_one({"_id": "order_archive_index"}, {"$addToSet": {"collections": name}}, upsert=True)
+    _archive_collections_cache.pop('names', None)
+    _archive_collections_cache.pop('indexed', None)
+
+# order_archive_months lists, per user and per restaurant, the archive months holding their orders,
+# so order history skips the months they have nothing in. Months archived before the index existed
+# are indexed by the archiver, one per run, and searched unconditionally until then.
+def archive_owner(kind: str, owner_id: str) -> str:
+    return f"{kind}:{owner_id}"
+
+async def list_indexed_archives() -> set:
+    cached = _archive_collections_cache.get('indexed')
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    marker = await db.migrations.find_one({"_id": "order_archive_index"}) or {}
+    indexed = set(marker.get('collections', []))
+    _archive_collections_cache['indexed'] = (time.monotonic() + ARCHIVE_LIST_CACHE_TTL, indexed)
+    return indexed
+
+async def archived_order_months(owner: str) -> set:
+    doc = await db.order_archive_months.find_one({"_id": owner})
+    return set(doc['months']) if doc else set()
+
+def archive_index_updates(name: str, owners) -> List[UpdateOne]:
+    return [UpdateOne({"_id": owner}, {"$addToSet": {"months": name}}, upsert=True) for owner in owners]
+
+async def index_legacy_archive() -> Optional[str]:
+    indexed = await list_indexed_archives()
+    pending = [name for name in await list_archive_collections() if name not in indexed]
+    if not pending:
+        return None
+    
+    name = pending[0]
+    # Months archived before refunds searched the archives lack the payment id index too
+    await db[name].create_index("razorpay_payment_id", sparse=True)
+    for kind in ("user", "restaurant"):
+        updates = []
+        async for owner in db[name].aggregate([{"$group": {"_id": f"${kind}_id"}}]):
+            updates.append(UpdateOne({"_id": archive_owner(kind, owner['_id'])}, {"$addToSet": {"months": name}}, upsert=True))
+            if len(updates) == 1000:
+                await db.order_archive_months.bulk_write(updates, ordered=False)
+                updates = []
+        if updates:
+            await db.order_archive_months.bulk_write(updates, ordered=False)
+    await db.migrations.update_one({"_id": "order_archive_index"}, {"$addToSet": {"collections": name}}, upsert=True)
+    _archive_collections_cache.pop('indexed', None)
+    logger.info(f"Indexed archived orders in {name}")
+    return name
+
+async def order_collections() -> list:
+    return [db.orders] + [db[name] for name in await list_archive_collections()]
+
+async def find_order(query: dict, order_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+    order = await db.orders.find_one(query, projection)
+    if order:
+        return order
+    
+    # Fall through to the archive; UUIDv7 ids name their month directly
+    created_at = id_timestamp(order_id)
+    names = [archive_collection_name(created_at)] if created_at else await list_archive_collections()
+    for name in names:
+        order = await db[name].find_one(query, projection)
+        if order:
+            return order
+    return None
+
+async def archive_orders() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ORDER_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    
+    while True:
+        batch = await db.orders.find(
+            {"status": {"$in": ORDER_ARCHIVE_STATUSES}, "updated_at": {"$lt": cutoff}}
+        ).limit(ORDER_ARCHIVE_BATCH_SIZE).to_list(ORDER_ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        
+        batch_by_month: Dict[str, List[dict]] = {}
+        for order in batch:
+            batch_by_month.setdefault(archive_collection_name(order['created_at']), []).append(order)
+        for name in batch_by_month:
+            await ensure_archive_collection(name)
+        
+        order_ids = [order['_id'] for order in batch]
+        
+        async def move_batch(session):
+            for name, orders in batch_by_month.items():
+                await db[name].insert_many(orders, session=session)
+                owners = {archive_owner("user", order['user_id']) for order in orders}
+                owners |= {archive_owner("restaurant", order['restaurant_id']) for order in orders}
+                await db.order_archive_months.bulk_write(archive_index_updates(name, owners), ordered=False, session=session)
+            await db.orders.delete_many(
+                {"_id": {"$in": order_ids}, "status": {"$in": ORDER_ARCHIVE_STATUSES}},
+                session=session
+            )
+        
+        async with await client.start_session() as session:
+            await session.with_transaction(move_batch)
+        
+        archived += len(batch)
+    
+    if archived:
+        logger.info(f"Archived {archived} orders older than {ORDER_ARCHIVE_AFTER_DAYS} days")
+    await index_legacy_archive()
+    return archived
+
+
+# ==================== DAILY STATS ====================
+
+# daily_stats holds one document per (restaurant_id, date), kept current with $inc upserts.
+# Money is counted in integer paise so the running sums never drift. Refunds are counted
+# separately (refunded_paise and the commission and restaurant shares of it), so net sales
+# are the revenue fields minus their refunded counterparts.
+PAID_PAYMENT_STATUSES = ["paid", "partially_refunded", "refunded"]
+
+def to_paise(amount: float) -> int:
+    return int(round(amount * 100))
+
+def stats_day(at: datetime) -> datetime:
+    return datetime(at.year, at.month, at.day, tzinfo=timezone.utc)
+
+def daily_stats_update(order: dict, **increments) -> UpdateOne:
+    # Activity is attributed to the day the order was placed
+    return UpdateOne(
+        {"restaurant_id": order['restaurant_id'], "date": stats_day(order['created_at'])},
+        {"$inc": increments},
+        upsert=True
+    )
+
+def order_paise(order: dict) -> tuple:
+    # (total, commission, restaurant share); orders from before the paise fields fall back to the floats
+    total_paise = order.get('total_paise')
+    if total_paise is None:
+        total_paise = to_paise(order['total_amount'])
+        commission_paise = to_paise(order['commission_amount'])
+        return total_paise, commission_paise, total_paise - commission_paise
+    return total_paise, order['commission_paise'], order['restaurant_paise']
+
+def paid_order_stats_update(order: dict) -> UpdateOne:
+    total_paise, commission_paise, restaurant_paise = order_paise(order)
+    return daily_stats_update(
+        order,
+        paid_orders=1,
+        revenue_paise=total_paise,
+        restaurant_revenue_paise=restaurant_paise,
+        commission_paise=commission_paise
+    )
+
+def refunded_split(order: dict, refunded_paise: int) -> tuple:
+    # (refunded, commission given back); commission is given back in proportion to the amount refunded
+    total_paise, commission_paise, _ = order_paise(order)
+    refunded_paise = min(refunded_paise, total_paise)
+    if not refunded_paise:
+        return 0, 0
+    kept_paise = total_paise - refunded_paise
+    return refunded_paise, commission_paise - (commission_paise * kept_paise * 2 + total_paise) // (total_paise * 2)
+
+def refund_stats_update(order: dict, previous_refunded_paise: int, refunded_paise: int) -> UpdateOne:
+    previous_refund, previous_commission = refunded_split(order, previous_refunded_paise)
+    refund, commission = refunded_split(order, refunded_paise)
+    return daily_stats_update(
+        order,
+        refunded_paise=refund - previous_refund,
+        restaurant_refunded_paise=(refund - commission) - (previous_refund - previous_commission),
+        commission_refunded_paise=commission - previous_commission
+    )
+
+async def record_daily_stats(updates: List[UpdateOne], session=None):
+    if updates:
+        await db.daily_stats.bulk_write(updates, ordered=False, session=session)
+
+async def rebuild_daily_stats(match: Optional[dict] = None):
+    # Recompute rollups from hot and archived orders; used to backfill or repair daily_stats
+    def as_paise(field: str) -> dict:
+        paise_field = field.replace("_amount", "_paise")
+        return {"$ifNull": [f"${paise_field}", {"$toLong": {"$round": [{"$multiply": [f"${field}", 100]}, 0]}}]}
+    
+    is_paid = {"$in": ["$payment_status", PAID_PAYMENT_STATUSES]}
+    total = as_paise("total_amount")
+    refunded = {"$min": [{"$ifNull": ["$refunded_paise", 0]}, total]}
+    # Mirrors refunded_split: commission kept is rounded half up on the amount kept
+    commission_refunded = {"$cond": [
+        {"$gt": [refunded, 0]},
+        {"$subtract": [as_paise("commission_amount"), {"$toLong": {"$floor": {"$divide": [
+            {"$add": [{"$multiply": [as_paise("commission_amount"), {"$subtract": [total, refunded]}, 2]}, total]},
+            {"$multiply": [total, 2]}
+        ]}}}]},
+        0
+    ]}
+    order_stages = [{"$match": match or {}}]
+    
+    pipeline = list(order_stages)
+    for name in await list_archive_collections():
+        pipeline.append({"$unionWith": {"coll": name, "pipeline": order_stages}})
+    pipeline += [
+        {"$group": {
+            "_id": {
+                "restaurant_id": "$restaurant_id",
+                "date": {"$dateTrunc": {"date": "$created_at", "unit": "day", "timezone": "UTC"}}
+            },
+            "orders": {"$sum": 1},
+            "paid_orders": {"$sum": {"$cond": [is_paid, 1, 0]}},
+            "revenue_paise": {"$sum": {"$cond": [is_paid, as_paise("total_amount"), 0]}},
+            "restaurant_revenue_paise": {"$sum": {"$cond": [is_paid, as_paise("restaurant_amount"), 0]}},
+            "commission_paise": {"$sum": {"$cond": [is_paid, as_paise("commission_amount"), 0]}},
+            "refunded_paise": {"$sum": {"$cond": [is_paid, refunded, 0]}},
+            "restaurant_refunded_paise": {"$sum": {"$cond": [is_paid, {"$subtract": [refunded, commission_refunded]}, 0]}},
+            "commission_refunded_paise": {"$sum": {"$cond": [is_paid, commission_refunded, 0]}},
+            "cancellations": {"$sum": {"$cond": [{"$eq": ["$status", "cancelled"]}, 1, 0]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "restaurant_id": "$_id.restaurant_id",
+            "date": "$_id.date",
+            "orders": 1,
+            "paid_orders": 1,
+            "revenue_paise": 1,
+            "restaurant_revenue_paise": 1,
+            "commission_paise": 1,
+            "refunded_paise": 1,
+            "restaurant_refunded_paise": 1,
+            "commission_refunded_paise": 1,
+            "cancellations": 1
+        }},
+        {"$merge": {
+            "into": "daily_stats",
+            "on": ["restaurant_id", "date"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    await db.orders.aggregate(pipeline).to_list(None)
+
+
+# ==================== SETTLEMENTS ====================
+
+# A settlement run totals each restaurant's orders paid in a period into settlement_ledger.
+# Orders are selected by when they were paid, so an order placed late in one month and paid
+# in the next is settled by the next month's run. Ledger entries are keyed by (run, restaurant)
+# and carry a checkpoint, so re-running a run resumes unfinished restaurants and leaves settled
+# ones untouched.
+SETTLEMENT_CONCURRENCY = int(os.environ.get('SETTLEMENT_CONCURRENCY', '8'))
+SETTLEMENT_CHECKPOINT_EVERY = 1000
+# Partially refunded orders are settled at their net amount; fully refunded ones not at all
+SETTLEMENT_PAYMENT_STATUSES = ["paid", "partially_refunded"]
+# Unpaid orders expire within days, so an order paid in a period was placed at most this long before it
+SETTLEMENT_PAYMENT_LAG = timedelta(days=31)
+
+def settlement_run_id(period_start: datetime, period_end: datetime) -> str:
+    return f"{period_start:%Y-%m-%d}:{period_end:%Y-%m-%d}"
+
+def settled_paise(order: dict) -> tuple:
+    # (gross, commission) after refunds
+    total_paise, commission_paise, _ = order_paise(order)
+    refunded_paise, commission_refunded_paise = refunded_split(order, order.get('refunded_paise') or 0)
+    return total_paise - refunded_paise, commission_paise - commission_refunded_paise
+
+async def settle_restaurant(run_id: str, restaurant_id: str, period_start: datetime, period_end: datetime) -> dict:
+    entry_id = f"{run_id}:{restaurant_id}"
+    entry = await db.settlement_ledger.find_one({"_id": entry_id})
+    if entry and entry['status'] == 'settled':
+        return entry
+    
+    entry = entry or {
+        "_id": entry_id,
+        "run_id": run_id,
+        "restaurant_id": restaurant_id,
+        "period_start": period_start,
+        "period_end": period_end,
+        "status": "in_progress",
+        "orders": 0,
+        "gross_paise": 0,
+        "refunded_paise": 0,
+        "commission_paise": 0,
+        "payable_paise": 0,
+        "checkpoint": None
+    }
+    if entry['checkpoint'] and 'field' not in entry['checkpoint']:
+        # Started before runs selected orders by paid_at; its partial totals do not carry over
+        entry.update(orders=0, gross_paise=0, commission_paise=0, payable_paise=0, checkpoint=None)
+    entry.setdefault('refunded_paise', 0)
+    
+    async def save(status: str):
+        entry['status'] = status
+        entry['updated_at'] = datetime.now(timezone.utc)
+        await db.settlement_ledger.replace_one({"_id": entry_id}, entry, upsert=True)
+    
+    # Hot orders first, then archive months that can hold orders paid in the period. Each
+    # collection is read by paid_at, then once more by created_at for orders paid before
+    # paid_at was recorded. The checkpoint names the collection, the field and the last
+    # (time, _id) counted.
+    collections = [db.orders]
+    for name in await list_archive_collections():
+        month_start, month_end = archive_month_bounds(name)
+        if month_start < period_end and month_end > period_start - SETTLEMENT_PAYMENT_LAG:
+            collections.append(db[name])
+    passes = [(collection, field) for collection in collections for field in ("paid_at", "created_at")]
+    checkpoint = entry['checkpoint']
+    if checkpoint:
+        keys = [(collection.name, field) for collection, field in passes]
+        position = (checkpoint['collection'], checkpoint['field'])
+        passes = passes[keys.index(position):] if position in keys else passes
+    
+    projection = {
+        "paid_at": 1, "created_at": 1, "total_amount": 1, "commission_amount": 1,
+        "total_paise": 1, "commission_paise": 1, "restaurant_paise": 1, "refunded_paise": 1
+    }
+    for collection, field in passes:
+        query = {
+            "restaurant_id": restaurant_id,
+            "payment_status": {"$in": SETTLEMENT_PAYMENT_STATUSES},
+            field: {"$gte": period_start, "$lt": period_end}
+        }
+        if field == "created_at":
+            query["paid_at"] = {"$exists": False}
+        if checkpoint and (checkpoint['collection'], checkpoint['field']) == (collection.name, field):
+            query["$or"] = [
+                {field: {"$gt": checkpoint['at']}},
+                {field: checkpoint['at'], "_id": {"$gt": checkpoint['order_id']}}
+            ]
+        
+        # Streamed through a cursor so memory stays flat however many orders the period holds
+        counted = 0
+        cursor = collection.find(query, projection).sort([(field, 1), ("_id", 1)]).batch_size(SETTLEMENT_CHECKPOINT_EVERY)
+        async for order in cursor:
+            gross_paise, commission_paise = settled_paise(order)
+            entry['orders'] += 1
+            entry['gross_paise'] += gross_paise
+            entry['refunded_paise'] += order_paise(order)[0] - gross_paise
+            entry['commission_paise'] += commission_paise
+            entry['checkpoint'] = {"collection": collection.name, "field": field, "at": order[field], "order_id": order['_id']}
+            counted += 1
+            if counted % SETTLEMENT_CHECKPOINT_EVERY == 0:
+                entry['payable_paise'] = entry['gross_paise'] - entry['commission_paise']
+                await save("in_progress")
+    
+    entry['payable_paise'] = entry['gross_paise'] - entry['commission_paise']
+    entry['settled_at'] = datetime.now(timezone.utc)
+    await save("settled")
+    return entry
+
+async def run_settlement(period_start: datetime, period_end: datetime, concurrency: int = SETTLEMENT_CONCURRENCY) -> dict:
+    period_start, period_end = storage_time(period_start), storage_time(period_end)
+    run_id = settlement_run_id(period_start, period_end)
+    run = await db.settlement_runs.find_one({"_id": run_id})
+    if run and run['status'] == 'completed':
+        return run
+    
+    await db.settlement_runs.update_one(
+        {"_id": run_id},
+        {
+            "$set": {"status": "running", "updated_at": datetime.now(timezone.utc)},
+            "$setOnInsert": {"period_start": period_start, "period_end": period_end, "started_at": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+    
+    restaurant_ids = [restaurant['id'] async for restaurant in db.restaurants.find({}, {"_id": 0, "id": 1})]
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def settle(restaurant_id: str) -> dict:
+        async with slots:
+            return await settle_restaurant(run_id, restaurant_id, period_start, period_end)
+    
+    entries = await asyncio.gather(*[settle(restaurant_id) for restaurant_id in restaurant_ids])
+    
+    totals = {
+        "restaurants": len(entries),
+        "orders": sum(entry['orders'] for entry in entries),
+        "gross_paise": sum(entry['gross_paise'] for entry in entries),
+        "refunded_paise": sum(entry['refunded_paise'] for entry in entries),
+        "commission_paise": sum(entry['commission_paise'] for entry in entries),
+        "payable_paise": sum(entry['payable_paise'] for entry in entries)
+    }
+    return await db.settlement_runs.find_one_and_update(
+        {"_id": run_id},
+        {"$set": {**totals, "status": "completed", "completed_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+# ==================== SALES ANALYTICS ====================
+
+# Bucket name -> (pandas frequency, bucket length, default window length)
+TIMESERIES_BUCKETS = {
+    "hour": ("h", timedelta(hours=1), timedelta(days=2)),
+    "day": ("D", timedelta(days=1), timedelta(days=30)),
+    "week": ("W-MON", timedelta(weeks=1), timedelta(weeks=26))
+}
+TIMESERIES_MAX_BUCKETS = 10000
+HEATMAP_DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# Buckets and the heatmap follow the marketplace's local clock, not UTC
+ANALYTICS_TIMEZONE = os.environ.get('ANALYTICS_TIMEZONE', 'Asia/Kolkata')
+analytics_tz = ZoneInfo(ANALYTICS_TIMEZONE)
+
+# Analytics reads prefer secondaries so dashboards stay off the primary that serves checkout
+analytics_db = db.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+# Endpoint -> (seconds a result is fresh, further seconds it may be served stale while refreshing)
+ANALYTICS_CACHE_POLICIES = {
+    "admin": (60, 600),
+    "restaurant": (30, 300),
+    "timeseries": (120, 1800)
+}
+ANALYTICS_CACHE_MAX_ENTRIES = 5000
+ANALYTICS_MAX_CONCURRENT_QUERIES = int(os.environ.get('ANALYTICS_MAX_CONCURRENT_QUERIES', '4'))
+
+class AnalyticsCache:
+    def __init__(self):
+        self._entries: Dict[tuple, dict] = {}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._query_slots: Optional[asyncio.Semaphore] = None
+    
+    async def get(self, key: tuple, endpoint: str, compute) -> dict:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry and now < entry['fresh_until']:
+            return entry
+        if entry and now < entry['stale_until']:
+            # Serve the stale result and refresh it in the background
+            self._refresh(key, endpoint, compute)
+            return entry
+        return await asyncio.shield(self._refresh(key, endpoint, compute))
+    
+    def _refresh(self, key: tuple, endpoint: str, compute) -> asyncio.Task:
+        # Single flight: concurrent misses for the same key share one computation
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, endpoint, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+    
+    def _finish(self, key: tuple, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Analytics refresh for {key} failed: {str(task.exception())}")
+    
+    async def _compute(self, key: tuple, endpoint: str, compute) -> dict:
+        if self._query_slots is None:
+            self._query_slots = asyncio.Semaphore(ANALYTICS_MAX_CONCURRENT_QUERIES)
+        async with self._query_slots:
+            value = await compute()
+        
+        ttl, stale_ttl = ANALYTICS_CACHE_POLICIES[endpoint]
+        now = time.monotonic()
+        entry = {
+            "value": value,
+            "as_of": datetime.now(timezone.utc),
+            "fresh_until": now + ttl,
+            "stale_until": now + ttl + stale_ttl
+        }
+        if len(self._entries) >= ANALYTICS_CACHE_MAX_ENTRIES:
+            for expired in [k for k, e in self._entries.items() if e['stale_until'] <= now]:
+                del self._entries[expired]
+        self._entries[key] = entry
+        return entry
+
+analytics_cache = AnalyticsCache()
+
+async def cached_analytics(key: tuple, endpoint: str, compute) -> dict:
+    entry = await analytics_cache.get(key, endpoint, compute)
+    return {**entry['value'], "as_of": entry['as_of']}
+
+def bucket_floor(at: datetime, bucket: str) -> datetime:
+    local = storage_time(at).astimezone(analytics_tz)
+    if bucket == "hour":
+        floor = local.replace(minute=0, second=0, microsecond=0)
+    else:
+        floor = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        if bucket == "week":
+            floor -= timedelta(days=floor.weekday())
+        # Re-resolve the offset in case the day started under a different one
+        floor = floor.replace(tzinfo=None).replace(tzinfo=analytics_tz)
+    return floor.astimezone(timezone.utc)
+
+async def aggregate_sales(restaurant_id: str, bucket: str, start: datetime, end: datetime, top: int) -> dict:
+    # A single pass over the window's paid orders feeds every facet
+    order_stages = [{"$match": {
+        "restaurant_id": restaurant_id,
+        "payment_status": {"$in": PAID_PAYMENT_STATUSES},
+        "created_at": {"$gte": start, "$lt": end}
+    }}]
+    pipeline = list(order_stages)
+    for name in await list_archive_collections():
+        month_start, month_end = archive_month_bounds(name)
+        if month_start < end and month_end > start:
+            pipeline.append({"$unionWith": {"coll": name, "pipeline": order_stages}})
+    
+    line_revenue = {"$toLong": {"$round": [{"$multiply": ["$items.price", "$items.quantity", 100]}, 0]}}
+    pipeline.append({"$facet": {
+        "series": [
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$created_at", "unit": bucket, "timezone": ANALYTICS_TIMEZONE, "startOfWeek": "monday"}},
+                "orders": {"$sum": 1},
+                # Net of refunds
+                "revenue_paise": {"$sum": {"$subtract": [
+                    {"$ifNull": ["$total_paise", {"$toLong": {"$round": [{"$multiply": ["$total_amount", 100]}, 0]}}]},
+                    {"$ifNull": ["$refunded_paise", 0]}
+                ]}}
+            }}
+        ],
+        "items": [
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": {"menu_item_id": "$items.menu_item_id", "variant_name": "$items.variant_name"},
+                "name": {"$last": "$items.menu_item_name"},
+                "quantity": {"$sum": "$items.quantity"},
+                "revenue_paise": {"$sum": line_revenue}
+            }}
+        ],
+        "heatmap": [
+            {"$group": {
+                "_id": {
+                    "day": {"$isoDayOfWeek": {"date": "$created_at", "timezone": ANALYTICS_TIMEZONE}},
+                    "hour": {"$hour": {"date": "$created_at", "timezone": ANALYTICS_TIMEZONE}}
+                },
+                "orders": {"$sum": 1}
+            }}
+        ]
+    }})
+    
+    results = await analytics_db.orders.aggregate(pipeline).to_list(1)
+    facets = results[0] if results else {"series": [], "items": [], "heatmap": []}
+    frequency = TIMESERIES_BUCKETS[bucket][0]
+    
+    # Fill empty buckets so charts get a continuous series
+    index = pd.date_range(
+        start.astimezone(analytics_tz), end.astimezone(analytics_tz), freq=frequency, inclusive="left"
+    ).tz_convert("UTC")
+    series = pd.DataFrame(
+        [(row['_id'], row['orders'], row['revenue_paise']) for row in facets['series']],
+        columns=["start", "orders", "revenue_paise"]
+    ).astype({"orders": "int64", "revenue_paise": "int64"})
+    series['start'] = pd.to_datetime(series['start'], utc=True)
+    series = series.set_index('start').reindex(index, fill_value=0)
+    
+    # Item x variant lines roll up into per-item totals and an overall variant mix
+    lines = pd.DataFrame(
+        [(row['_id']['menu_item_id'], row['name'], row['_id']['variant_name'], row['quantity'], row['revenue_paise'])
+         for row in facets['items']],
+        columns=["menu_item_id", "name", "variant_name", "quantity", "revenue_paise"]
+    ).astype({"quantity": "int64", "revenue_paise": "int64"})
+    top_items = lines.groupby("menu_item_id", sort=False).agg(
+        name=("name", "last"), quantity=("quantity", "sum"), revenue_paise=("revenue_paise", "sum")
+    ).nlargest(top, "quantity")
+    variant_mix = lines.groupby("variant_name")["quantity"].sum().sort_values(ascending=False)
+    total_quantity = variant_mix.sum()
+    
+    heatmap = np.zeros((7, 24), dtype=np.int64)
+    if facets['heatmap']:
+        cells = np.array([(row['_id']['day'], row['_id']['hour'], row['orders']) for row in facets['heatmap']])
+        heatmap[cells[:, 0] - 1, cells[:, 1]] = cells[:, 2]
+    
+    return {
+        "bucket": bucket,
+        "from": start,
+        "to": end,
+        "series": [
+            {"start": bucket_start.to_pydatetime(), "orders": int(orders), "revenue": int(revenue_paise) / 100}
+            for bucket_start, orders, revenue_paise in zip(series.index, series['orders'], series['revenue_paise'])
+        ],
+        "top_items": [
+            {"menu_item_id": menu_item_id, "name": row['name'], "quantity": int(row['quantity']), "revenue": int(row['revenue_paise']) / 100}
+            for menu_item_id, row in top_items.iterrows()
+        ],
+        "variant_mix": [
+            {"variant_name": variant_name, "quantity": int(quantity), "share": round(float(quantity / total_quantity), 4)}
+            for variant_name, quantity in variant_mix.items()
+        ],
+        "heatmap": {"days": HEATMAP_DAYS, "hours": list(range(24)), "orders": heatmap.tolist()}
+    }
+
+
+# ==================== AUTH ROUTES ====================
+
+@api_router.post("/auth/register")
+async def register(user_data: UserRegister):
+    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 0})
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    hashed_password = bcrypt.hashpw(user_data.password.encode('utf-8'), bcrypt.gensalt())
+    
+    user = User(
+        email=user_data.email,
+        name=user_data.name,
+        phone=user_data.phone,
+        role=user_data.role
+    )
+    
+    user_doc = user.model_dump()
+    user_doc['password'] = hashed_password.decode('utf-8')
+    
+    await db.users.insert_one(user_doc)
+    
+    token = create_jwt_token(user.id, user.email, user.role, user.restaurant_id)
+    
+    return {
+        "token": token,
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "phone": user.phone,
+            "role": user.role
+        }
+    }
+
+@api_router.post("/auth/login")
+async def login(credentials: UserLogin):
+    user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if not bcrypt.checkpw(credentials.password.encode('utf-8'), user['password'].encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    token = create_jwt_token(user['id'], user['email'], user['role'], user.get('restaurant_id'))
+    
+    return {
+        "token": token,
+        "user": {
+            "id": user['id'],
+            "email": user['email'],
+            "name": user['name'],
+            "phone": user['phone'],
+            "role": user['role'],
+            "restaurant_id": user.get('restaurant_id')
+        }
+    }
+
+@api_router.get("/auth/me")
+async def get_current_user_info(user_data: dict = Depends(get_current_user)):
+    user = await db.users.find_one({"id": user_data['user_id']}, {"_id": 0, "password": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+# ==================== RESTAURANT ROUTES ====================
+
+@api_router.post("/restaurants/create")
+async def create_restaurant(restaurant_data: RestaurantCreate, user_data: dict = Depends(get_current_user)):
+    if user_data['role'] != 'restaurant_owner':
+        raise HTTPException(status_code=403, detail="Only restaurant owners can create restaurants")
+    
+    # Check if slug already exists
+    existing = await db.restaurants.find_one({"slug": restaurant_data.slug}, {"_id": 0})
+    if existing:
+        raise HTTPException(status_code=400, detail="Restaurant slug already exists")
+    
+    restaurant = Restaurant(
+        owner_id=user_data['user_id'],
+        **restaurant_data.model_dump()
+    )
+    
+    restaurant_doc = restaurant.model_dump()
+    
+    await db.restaurants.insert_one(restaurant_doc)
+    
+    # Update user's restaurant_id
+    await db.users.update_one(
+        {"id": user_data['user_id']},
+        {"$set": {"restaurant_id": restaurant.id}}
+    )
+    
+    return {"restaurant_id": restaurant.id, "message": "Restaurant created successfully. Pending approval."}
+
+@api_router.get("/restaurants")
+async def get_restaurants(status: Optional[str] = None, authorization: str = Header(None)):
+    # Check if super admin
+    try:
+        user_data = await get_current_user(authorization)
+        is_admin = user_data['role'] == 'super_admin'
+    except:
+        is_admin = False
+    
+    query = {}
+    if status:
+        query["status"] = status
+    elif not is_admin:
+        # For non-admin users, only show active restaurants
+        query["status"] = "active"
+    # If admin and no status filter, show all
+    
+    restaurants = await db.restaurants.find(query, {"_id": 0}).to_list(1000)
+    return await with_kitchen_status(restaurants)
+
+@api_router.get("/restaurants/{restaurant_id}")
+async def get_restaurant(restaurant_id: str):
+    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    return (await with_kitchen_status([restaurant]))[0]
+
+@api_router.get("/restaurants/slug/{slug}")
+async def get_restaurant_by_slug(slug: str):
+    restaurant = await db.restaurants.find_one({"slug": slug}, {"_id": 0})
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    return (await with_kitchen_status([restaurant]))[0]
+
+@api_router.get("/restaurants/my/restaurant")
+async def get_my_restaurant(user_data: dict = Depends(get_current_user)):
+    if user_data['role'] != 'restaurant_owner':
+        raise HTTPException(status_code=403, detail="Only restaurant owners can access this")
+    
+    restaurant = await db.restaurants.find_one({"owner_id": user_data['user_id']}, {"_id": 0})
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    return restaurant
+
+@api_router.put("/restaurants/{restaurant_id}/update")
+async def update_restaurant(
+    restaurant_id: str,
+    update_data: RestaurantCreate,
+    user_data: dict = Depends(get_current_user)
+):
+    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    update_dict = update_data.model_dump()
+    update_dict['updated_at'] = datetime.now(timezone.utc)
+    
+    await db.restaurants.update_one(
+        {"id": restaurant_id},
+        {"$set": update_dict}
+    )
+    invalidate_restaurant_cache(restaurant_id)
+    
+    return {"message": "Restaurant updated successfully"}
+
+@api_router.put("/restaurants/{restaurant_id}/capacity")
+async def update_restaurant_capacity(
+    restaurant_id: str,
+    capacity: RestaurantCapacityUpdate,
+    user_data: dict = Depends(get_current_user)
+):
+    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    for value in capacity.model_dump().values():
+        if value is not None and value < 1:
+            raise HTTPException(status_code=400, detail="Capacity limits must be at least 1, or null for no limit")
+    
+    await db.restaurants.update_one(
+        {"id": restaurant_id},
+        {"$set": {**capacity.model_dump(), "updated_at": datetime.now(timezone.utc)}}
+    )
+    invalidate_restaurant_cache(restaurant_id)
+    
+    return {"message": "Restaurant capacity updated successfully"}
+
+
+# ==================== ADMIN ROUTES ====================
+
+@api_router.put("/admin/restaurants/{restaurant_id}/approve")
+async def approve_restaurant(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    if user_data['role'] != 'super_admin':
+        raise HTTPException(status_code=403, detail="Only super admin can approve restaurants")
+    
+    await db.restaurants.update_one(
+        {"id": restaurant_id},
+        {"$set": {"status": "active", "updated_at": datetime.now(timezone.utc)}}
+    )
+    invalidate_restaurant_cache(restaurant_id)
+    
+    return {"message": "Restaurant approved successfully"}
+
+@api_router.put("/admin/restaurants/{restaurant_id}/suspend")
+async def suspend_restaurant(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    if user_data['role'] != 'super_admin':
+        raise HTTPException(status_code=403, detail="Only super admin can suspend restaurants")
+    
+    await db.restaurants.update_one(
+        {"id": restaurant_id},
+        {"$set": {"status": "suspended", "updated_at": datetime.now(timezone.utc)}}
+    )
+    invalidate_restaurant_cache(restaurant_id)
+    
+    return {"message": "Restaurant suspended successfully"}
+
+@api_router.get("/admin/analytics")
 async def get_admin_analytics(user_data: dict = Depends(get_current_user)):
     if user_data['role'] != 'super_admin':
         raise HTTPException(status_code=403, detail="Only super admin can access analytics")
     
-    total_restaurants = await db.restaurants.count_documents({})
-    active_restaurants = await db.restaurants.count_documents({"status": "active"})
-    pending_restaurants = await db.restaurants.count_documents({"status": "pending"})
-    total_orders = await db.orders.count_documents({})
+    return await cached_analytics(("admin",), "admin", compute_admin_analytics)
+
+async def compute_admin_analytics() -> dict:
+    # One aggregation: restaurant counts plus the daily rollups, so cost scales with days rather than orders
+    is_restaurant = {"$eq": ["$kind", "restaurant"]}
+    pipeline = [
+        {"$project": {"_id": 0, "kind": {"$literal": "restaurant"}, "status": 1}},
+        {"$unionWith": {"coll": "daily_stats", "pipeline": [{"$project": {
+            "_id": 0,
+            "kind": {"$literal": "daily_stats"},
+            "orders": 1,
+            "revenue_paise": 1,
+            "commission_paise": 1,
+            "refunded_paise": 1,
+            "commission_refunded_paise": 1
+        }}]}},
+        {"$group": {
+            "_id": None,
+            "total_restaurants": {"$sum": {"$cond": [is_restaurant, 1, 0]}},
+            "active_restaurants": {"$sum": {"$cond": [{"$and": [is_restaurant, {"$eq": ["$status", "active"]}]}, 1, 0]}},
+            "pending_restaurants": {"$sum": {"$cond": [{"$and": [is_restaurant, {"$eq": ["$status", "pending"]}]}, 1, 0]}},
+            "total_orders": {"$sum": "$orders"},
+            "revenue_paise": {"$sum": {"$subtract": ["$revenue_paise", {"$ifNull": ["$refunded_paise", 0]}]}},
+            "commission_paise": {"$sum": {"$subtract": ["$commission_paise", {"$ifNull": ["$commission_refunded_paise", 0]}]}}
+        }}
+    ]
     
-    # Calculate total revenue and commissions
-    orders = await db.orders.find({"payment_status": "paid"}, {"_id": 0}).to_list(10000)
-    total_revenue = sum(order.get('total_amount', 0) for order in orders)
-    total_commission = sum(order.get('commission_amount', 0) for order in orders)
+    results = await analytics_db.restaurants.aggregate(pipeline).to_list(1)
+    totals = results[0] if results else {}
     
     return {
-        "total_restaurants": total_restaurants,
-        "active_restaurants": active_restaurants,
-        "pending_restaurants": pending_restaurants,
-        "total_orders": total_orders,
-        "total_revenue": total_revenue,
-        "total_commission": total_commission
+        "total_restaurants": totals.get('total_restaurants', 0),
+        "active_restaurants": totals.get('active_restaurants', 0),
+        "pending_restaurants": totals.get('pending_restaurants', 0),
+        "total_orders": totals.get('total_orders', 0),
+        "total_revenue": totals.get('revenue_paise', 0) / 100,
+        "total_commission": totals.get('commission_paise', 0) / 100
     }
 
 
@@ -502,6 +2706,16 @@ async def get_restaurant_menu_items(
     spice_level: Optional[int] = None,
     search: Optional[str] = None
 ):
+    if not search:
+        # The storefront's menu browsing is served from the per-restaurant cache
+        items = await get_cached_menu(restaurant_id)
+        return [
+            item for item in items
+            if (not category_id or item['category_id'] == category_id)
+            and (is_veg is None or item['is_veg'] == is_veg)
+            and (spice_level is None or item['spice_level'] <= spice_level)
+        ]
+    
     query = {"restaurant_id": restaurant_id, "is_available": True}
     
     if category_id:
@@ -510,11 +2724,10 @@ async def get_restaurant_menu_items(
         query["is_veg"] = is_veg
     if spice_level is not None:
         query["spice_level"] = {"$lte": spice_level}
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+    query["$or"] = [
+        {"name": {"$regex": search, "$options": "i"}},
+        {"description": {"$regex": search, "$options": "i"}}
+    ]
     
     items = await db.menu_items.find(query, {"_id": 0}).to_list(1000)
     return items
@@ -544,12 +2757,12 @@ async def create_menu_item(
     )
     
     menu_item_doc = menu_item.model_dump()
-    menu_item_doc['created_at'] = menu_item_doc['created_at'].isoformat()
     
     # Convert variants to dict
     menu_item_doc['variants'] = [v.model_dump() if hasattr(v, 'model_dump') else v for v in menu_item_doc['variants']]
     
     await db.menu_items.insert_one(menu_item_doc)
+    invalidate_menu_cache(restaurant_id)
     
     return {"item_id": menu_item.id, "message": "Menu item created successfully"}
 
@@ -619,7 +2832,6 @@ async def add_to_cart(item: CartItemAdd, user_data: dict = Depends(get_current_u
             quantity=item.quantity
         )
         cart_doc = cart_item.model_dump()
-        cart_doc['added_at'] = cart_doc['added_at'].isoformat()
         await db.cart_items.insert_one(cart_doc)
         return {"message": "Item added to cart", "cart_item_id": cart_item.id}
 
@@ -660,104 +2872,321 @@ async def clear_cart(user_data: dict = Depends(get_current_user)):
 
 # ==================== ORDER ROUTES ====================
 
-@api_router.post("/orders/create")
-async def create_order(order_data: OrderCreate, user_data: dict = Depends(get_current_user)):
-    user_id = user_data['user_id']
+@api_router.post("/orders/create")
+async def create_order(
+    order_data: OrderCreate,
+    user_data: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await run_idempotent(
+        idempotency_key, user_data['user_id'], "orders.create", order_data,
+        lambda: place_order(order_data, user_data)
+    )
+
+async def place_order(order_data: OrderCreate, user_data: dict):
+    # Ordering without a cart goes through the same pricing, stock reservation and outbox as a
+    # checkout; the client's prices and total are ignored
+    lines = [
+        {"restaurant_id": order_data.restaurant_id, "menu_item_id": item.menu_item_id, "variant_name": item.variant_name, "quantity": item.quantity}
+        for item in order_data.items
+    ]
+    if not lines:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    if any(line['quantity'] < 1 for line in lines):
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    
+    result = await create_checkout(user_data['user_id'], lines, order_data.delivery_address)
+    return {
+        "order_id": result['order_id'],
+        "checkout_id": result['checkout_id'],
+        "total_amount": result['total_amount'],
+        "message": "Order created successfully"
+    }
+
+@api_router.post("/orders/checkout")
+async def checkout(
+    checkout_data: CheckoutCreate,
+    user_data: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await run_idempotent(
+        idempotency_key, user_data['user_id'], "orders.checkout", checkout_data,
+        lambda: place_checkout(checkout_data, user_data)
+    )
+
+async def place_checkout(checkout_data: CheckoutCreate, user_data: dict):
+    user_id = user_data['user_id']
+    
+    cart_items = await db.cart_items.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+    if not cart_items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    
+    # Only consume the exact lines that were priced; a concurrent cart edit aborts the checkout
+    consumed_lines = [{"id": cart_item['id'], "quantity": cart_item['quantity']} for cart_item in cart_items]
+    return await create_checkout(user_id, cart_items, checkout_data.delivery_address, consumed_lines)
+
+async def create_checkout(user_id: str, cart_items: List[dict], delivery_address: str, consumed_lines: Optional[List[dict]] = None) -> dict:
+    restaurant_ids = list({cart_item['restaurant_id'] for cart_item in cart_items})
+    restaurants = await get_cached_restaurants(restaurant_ids)
+    for restaurant_id in restaurant_ids:
+        restaurant = restaurants.get(restaurant_id)
+        if not restaurant:
+            raise HTTPException(status_code=404, detail="Restaurant not found")
+        if restaurant['status'] != 'active':
+            raise HTTPException(status_code=400, detail=f"{restaurant['name']} is not accepting orders")
     
-    # Get restaurant to calculate commission
-    restaurant = await db.restaurants.find_one({"id": order_data.restaurant_id}, {"_id": 0})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="Restaurant not found")
+    # Totals are always computed server-side from current prices
+    order_items, tracked_stock = await price_cart_items(cart_items)
+    items_by_restaurant: Dict[str, List[OrderItem]] = {}
+    for cart_item, order_item in zip(cart_items, order_items):
+        items_by_restaurant.setdefault(cart_item['restaurant_id'], []).append(order_item)
     
-    commission_amount = order_data.total_amount * (restaurant['commission_rate'] / 100)
-    restaurant_amount = order_data.total_amount - commission_amount
+    await admit_orders(restaurants, {
+        restaurant_id: order_prep_minutes(items) for restaurant_id, items in items_by_restaurant.items()
+    })
     
-    order = Order(
+    # One order per restaurant, each with that restaurant's own commission rate
+    checkout_id = new_id()
+    orders = []
+    for restaurant_id, items in items_by_restaurant.items():
+        total_amount = sum(item.price * item.quantity for item in items)
+        orders.append(Order(
+            user_id=user_id,
+            restaurant_id=restaurant_id,
+            items=items,
+            **split_order_amount(total_amount, restaurants[restaurant_id]['commission_rate']),
+            reserved_stock=stock_lines(items, tracked_stock),
+            prep_minutes=order_prep_minutes(items),
+            delivery_address=delivery_address,
+            checkout_id=checkout_id,
+            status="pending",
+            payment_status="pending"
+        ))
+    
+    checkout_record = Checkout(
+        id=checkout_id,
         user_id=user_id,
-        restaurant_id=order_data.restaurant_id,
-        items=order_data.items,
-        total_amount=order_data.total_amount,
-        commission_amount=commission_amount,
-        restaurant_amount=restaurant_amount,
-        delivery_address=order_data.delivery_address,
-        status="pending",
-        payment_status="pending"
+        order_ids=[order.id for order in orders],
+        total_amount=sum(order.total_paise for order in orders) / 100,
+        total_paise=sum(order.total_paise for order in orders)
     )
     
-    order_doc = order.model_dump()
-    order_doc['created_at'] = order_doc['created_at'].isoformat()
-    order_doc['updated_at'] = order_doc['updated_at'].isoformat()
-    order_doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in order_doc['items']]
+    checkout_doc = checkout_record.model_dump()
     
-    await db.orders.insert_one(order_doc)
+    order_docs = [order_storage_doc(order) for order in orders]
     
-    return {"order_id": order.id, "message": "Order created successfully"}
-
-@api_router.get("/orders")
-async def get_orders(user_data: dict = Depends(get_current_user)):
-    user_id = user_data['user_id']
+    async def place_orders(session):
+        await db.checkouts.insert_one(checkout_doc, session=session)
+        await db.orders.insert_many(order_docs, session=session)
+        if consumed_lines:
+            result = await db.cart_items.delete_many(
+                {"user_id": user_id, "$or": consumed_lines},
+                session=session
+            )
+            if result.deleted_count != len(consumed_lines):
+                raise HTTPException(status_code=409, detail="Cart changed during checkout, please review and try again")
+        await record_daily_stats(
+            [daily_stats_update(order_doc, orders=1) for order_doc in order_docs],
+            session=session
+        )
+        await write_outbox("order.created", {"orders": [outbox_order(order_doc) for order_doc in order_docs]}, session=session)
+        await reserve_stock(stock_lines(order_items, tracked_stock), session=session)
     
-    orders = await db.orders.find(
-        {"user_id": user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    async with await client.start_session() as session:
+        await session.with_transaction(place_orders)
+    wake_outbox_dispatcher()
+    for order_doc in order_docs:
+        kitchen_queue.hold(order_doc)
+    for order_doc in order_docs:
+        if order_doc['reserved_stock']:
+            # A variant may have sold out; let the storefront see it now rather than after the TTL
+            invalidate_menu_cache(order_doc['restaurant_id'])
     
-    return orders
+    return {
+        "checkout_id": checkout_id,
+        "order_id": orders[0].id if len(orders) == 1 else None,
+        "order_ids": checkout_record.order_ids,
+        "total_amount": checkout_record.total_amount,
+        "message": "Order created successfully" if len(orders) == 1 else f"{len(orders)} orders created successfully"
+    }
+
+@api_router.get("/orders")
+async def get_orders(
+    response: Response,
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(ORDER_PAGE_DEFAULT_LIMIT, ge=1, le=ORDER_PAGE_MAX_LIMIT),
+    user_data: dict = Depends(get_current_user)
+):
+    query = build_order_filters({"user_id": user_data['user_id']}, status, payment_status, from_date, to_date)
+    orders = await find_orders_page(query, archive_owner("user", user_data['user_id']), cursor, limit, response)
+    return await with_order_etas(orders)
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, user_data: dict = Depends(get_current_user)):
     user_id = user_data['user_id']
     
-    order = await db.orders.find_one(
-        {"id": order_id, "user_id": user_id},
-        {"_id": 0}
-    )
+    order = await find_order({**order_id_query(order_id), "user_id": user_id}, order_id)
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    return order
+    orders = await with_order_etas([order_out(order)])
+    return orders[0]
+
+@api_router.get("/orders/{order_id}/events")
+async def stream_order(
+    order_id: str,
+    last_event_id: Optional[str] = Header(None),
+    user_data: dict = Depends(get_stream_user)
+):
+    order = await find_order({**order_id_query(order_id), "user_id": user_data['user_id']}, order_id, {"_id": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    return order_event_stream(f"order:{order_id}", last_event_id)
 
 @api_router.get("/restaurants/{restaurant_id}/orders")
-async def get_restaurant_orders(restaurant_id: str, user_data: dict = Depends(get_current_user)):
-    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+async def get_restaurant_orders(
+    restaurant_id: str,
+    response: Response,
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(ORDER_PAGE_DEFAULT_LIMIT, ge=1, le=ORDER_PAGE_MAX_LIMIT),
+    user_data: dict = Depends(get_current_user)
+):
+    restaurant = await get_cached_restaurant(restaurant_id)
     if not restaurant:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
     if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    orders = await db.orders.find(
-        {"restaurant_id": restaurant_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
+    query = build_order_filters({"restaurant_id": restaurant_id}, status, payment_status, from_date, to_date)
+    orders = await find_orders_page(query, archive_owner("restaurant", restaurant_id), cursor, limit, response)
+    return await with_order_etas(orders)
+
+@api_router.get("/restaurants/{restaurant_id}/orders/events")
+async def stream_restaurant_orders(
+    restaurant_id: str,
+    last_event_id: Optional[str] = Header(None),
+    user_data: dict = Depends(get_stream_user)
+):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
     
-    return orders
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return order_event_stream(f"restaurant:{restaurant_id}", last_event_id)
 
 @api_router.get("/restaurants/{restaurant_id}/analytics")
 async def get_restaurant_analytics(restaurant_id: str, user_data: dict = Depends(get_current_user)):
-    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+    restaurant = await get_cached_restaurant(restaurant_id)
     if not restaurant:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
     if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    total_orders = await db.orders.count_documents({"restaurant_id": restaurant_id})
-    completed_orders = await db.orders.count_documents({"restaurant_id": restaurant_id, "payment_status": "paid"})
-    
-    orders = await db.orders.find({"restaurant_id": restaurant_id, "payment_status": "paid"}, {"_id": 0}).to_list(10000)
-    total_revenue = sum(order.get('restaurant_amount', 0) for order in orders)
+    return await cached_analytics(
+        ("restaurant", restaurant_id), "restaurant",
+        lambda: compute_restaurant_analytics(restaurant_id)
+    )
+
+async def compute_restaurant_analytics(restaurant_id: str) -> dict:
+    # Sum the restaurant's daily rollups and count its menu items in one round trip
+    pipeline = [
+        {"$match": {"restaurant_id": restaurant_id}},
+        {"$unionWith": {"coll": "menu_items", "pipeline": [
+            {"$match": {"restaurant_id": restaurant_id}},
+            {"$count": "menu_items"}
+        ]}},
+        {"$group": {
+            "_id": None,
+            "total_orders": {"$sum": "$orders"},
+            "completed_orders": {"$sum": "$paid_orders"},
+            "restaurant_revenue_paise": {"$sum": {"$subtract": [
+                "$restaurant_revenue_paise", {"$ifNull": ["$restaurant_refunded_paise", 0]}
+            ]}},
+            "menu_items_count": {"$sum": "$menu_items"}
+        }}
+    ]
     
-    menu_items_count = await db.menu_items.count_documents({"restaurant_id": restaurant_id})
+    results = await analytics_db.daily_stats.aggregate(pipeline).to_list(1)
+    totals = results[0] if results else {}
     
     return {
-        "total_orders": total_orders,
-        "completed_orders": completed_orders,
-        "total_revenue": total_revenue,
-        "menu_items_count": menu_items_count
+        "total_orders": totals.get('total_orders', 0),
+        "completed_orders": totals.get('completed_orders', 0),
+        "total_revenue": totals.get('restaurant_revenue_paise', 0) / 100,
+        "menu_items_count": totals.get('menu_items_count', 0)
     }
 
+@api_router.get("/restaurants/{restaurant_id}/payouts")
+async def get_restaurant_payouts(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    entries = await db.settlement_ledger.find(
+        {"restaurant_id": restaurant_id},
+        {"_id": 0, "checkpoint": 0}
+    ).sort("period_start", -1).to_list(120)
+    
+    return [
+        {
+            **entry,
+            "gross_amount": entry['gross_paise'] / 100,
+            "commission_amount": entry['commission_paise'] / 100,
+            "payable_amount": entry['payable_paise'] / 100
+        }
+        for entry in entries
+    ]
+
+@api_router.get("/restaurants/{restaurant_id}/analytics/timeseries")
+async def get_restaurant_timeseries(
+    restaurant_id: str,
+    bucket: str = "day",
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    top: int = Query(10, ge=1, le=100),
+    user_data: dict = Depends(get_current_user)
+):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if bucket not in TIMESERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket must be one of hour, day, week")
+    
+    # Windows snap to bucket boundaries so repeated requests share a cache entry
+    _, step, default_window = TIMESERIES_BUCKETS[bucket]
+    end = bucket_floor(to_date, bucket) if to_date else bucket_floor(datetime.now(timezone.utc), bucket) + step
+    start = bucket_floor(from_date, bucket) if from_date else end - default_window
+    if start >= end:
+        raise HTTPException(status_code=400, detail="from must be before to")
+    if (end - start) / step > TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Time window has too many buckets")
+    
+    return await cached_analytics(
+        ("timeseries", restaurant_id, bucket, start, end, top), "timeseries",
+        lambda: aggregate_sales(restaurant_id, bucket, start, end, top)
+    )
+
 @api_router.put("/restaurants/{restaurant_id}/orders/{order_id}/status")
 async def update_order_status(
     restaurant_id: str,
@@ -765,103 +3194,910 @@ async def update_order_status(
     status: str,
     user_data: dict = Depends(get_current_user)
 ):
-    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0})
+    restaurant = await get_cached_restaurant(restaurant_id)
     if not restaurant:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
     if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    valid_statuses = ["pending", "confirmed", "preparing", "out_for_delivery", "delivered", "cancelled"]
-    if status not in valid_statuses:
+    if status not in ORDER_STATUS_TRANSITIONS:
         raise HTTPException(status_code=400, detail="Invalid status")
     
-    await db.orders.update_one(
-        {"id": order_id, "restaurant_id": restaurant_id},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    # Compare-and-set: only matches while the order is still in an allowed previous state
+    now = datetime.now(timezone.utc)
+    history_entry = {"status": status, "at": now, "by": user_data['user_id']}
+    
+    async def apply(session):
+        previous = await db.orders.find_one_and_update(
+            {**order_id_query(order_id), "restaurant_id": restaurant_id, "status": {"$in": ORDER_STATUS_PREDECESSORS[status]}},
+            {
+                "$set": {"status": status, "updated_at": now},
+                "$push": {"status_history": history_entry}
+            },
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        # The rollup commits with the status change, so a retry can't count a cancellation twice
+        if previous and status == "cancelled":
+            await record_daily_stats([daily_stats_update(previous, cancellations=1)], session=session)
+        return previous
+    
+    async with await client.start_session() as session:
+        previous = await session.with_transaction(apply)
+    
+    if not previous:
+        existing = await find_order({**order_id_query(order_id), "restaurant_id": restaurant_id}, order_id, {"status": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Order not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Cannot change order status from {existing['status']} to {status}"
+        )
+    
+    # The previous status tells whether the order entered or left the kitchen
+    await kitchen_queue.refresh([restaurant_id])
+    kitchen_queue.apply(previous, previous['status'], status, now)
+    stored_id = previous['_id']
+    order = order_out({
+        **previous,
+        "status": status,
+        "updated_at": now,
+        "status_history": (previous.get('status_history') or []) + [history_entry]
+    })
+    order['eta'] = kitchen_queue.eta(restaurant, order)
+    if status == "cancelled":
+        await release_order_stock([stored_id])
+    await order_events.publish("order.status_changed", order)
+    
+    return order
+
+
+# ==================== DELIVERY ENDPOINT ROUTES ====================
+
+def delivery_endpoint_out(endpoint: dict) -> dict:
+    # The signing secret is only shown once, when the endpoint is created
+    return {key: value for key, value in endpoint.items() if key not in ("_id", "secret")}
+
+@api_router.get("/restaurants/{restaurant_id}/delivery-endpoints")
+async def get_delivery_endpoints(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    endpoints = await db.delivery_endpoints.find({"restaurant_id": restaurant_id, "active": True}, {"_id": 0}).to_list(100)
+    return [delivery_endpoint_out(endpoint) for endpoint in endpoints]
+
+@api_router.post("/restaurants/{restaurant_id}/delivery-endpoints")
+async def create_delivery_endpoint(
+    restaurant_id: str,
+    endpoint_data: DeliveryEndpointCreate,
+    user_data: dict = Depends(get_current_user)
+):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if endpoint_data.kind not in DELIVERY_KINDS:
+        raise HTTPException(status_code=400, detail="kind must be one of webhook, sms, email")
+    if endpoint_data.kind == "webhook" and not (endpoint_data.url or "").startswith(("https://", "http://")):
+        raise HTTPException(status_code=400, detail="A webhook endpoint needs an http(s) url")
+    if endpoint_data.kind != "webhook" and not endpoint_data.recipient:
+        raise HTTPException(status_code=400, detail="SMS and email endpoints need a recipient")
+    if not endpoint_data.events or any(event not in DELIVERY_EVENTS for event in endpoint_data.events):
+        raise HTTPException(status_code=400, detail=f"events must be from {', '.join(DELIVERY_EVENTS)}")
+    
+    endpoint = DeliveryEndpoint(restaurant_id=restaurant_id, **endpoint_data.model_dump())
+    await db.delivery_endpoints.insert_one(endpoint.model_dump())
+    
+    return {**delivery_endpoint_out(endpoint.model_dump()), "secret": endpoint.secret}
+
+@api_router.delete("/restaurants/{restaurant_id}/delivery-endpoints/{endpoint_id}")
+async def delete_delivery_endpoint(restaurant_id: str, endpoint_id: str, user_data: dict = Depends(get_current_user)):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # Deactivated rather than deleted; queued deliveries for it are dropped by the dispatcher
+    result = await db.delivery_endpoints.update_one(
+        {"id": endpoint_id, "restaurant_id": restaurant_id, "active": True},
+        {"$set": {"active": False}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Delivery endpoint not found")
+    
+    return {"message": "Delivery endpoint removed"}
+
+@api_router.get("/restaurants/{restaurant_id}/delivery-endpoints/dead-letters")
+async def get_dead_letters(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    deliveries = await db.outbound_deliveries.find(
+        {"restaurant_id": restaurant_id, "status": "dead"},
+        {"body": 0, "locked_by": 0, "locked_until": 0}
+    ).sort("dead_at", -1).to_list(200)
+    return [{"id": delivery.pop('_id'), **delivery} for delivery in deliveries]
+
+@api_router.post("/restaurants/{restaurant_id}/delivery-endpoints/dead-letters/retry")
+async def retry_dead_letters(restaurant_id: str, user_data: dict = Depends(get_current_user)):
+    restaurant = await get_cached_restaurant(restaurant_id)
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    if user_data['role'] != 'super_admin' and restaurant['owner_id'] != user_data['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    result = await db.outbound_deliveries.update_many(
+        {"restaurant_id": restaurant_id, "status": "dead"},
+        {"$set": {"status": "pending", "attempts": 0, "available_at": datetime.now(timezone.utc)}}
     )
+    if _outbound_wakeup is not None:
+        _outbound_wakeup.set()
     
-    return {"message": "Order status updated successfully"}
+    return {"requeued": result.modified_count}
 
 
 # ==================== PAYMENT ROUTES (Razorpay) ====================
 
+# A stored gateway order is reused until it expires, as long as the amount still matches
+GATEWAY_ORDER_CURRENCY = "INR"
+GATEWAY_ORDER_TTL_MINUTES = int(os.environ.get('GATEWAY_ORDER_TTL_MINUTES', '60'))
+GATEWAY_ORDER_LOCK_SECONDS = 30
+GATEWAY_ORDER_LOCK_POLL_SECONDS = 0.2
+
 @api_router.post("/payments/create-order")
-async def create_payment_order(order_id: str, user_data: dict = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": user_data['user_id']}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
+async def create_payment_order(
+    order_id: Optional[str] = None,
+    checkout_id: Optional[str] = None,
+    user_data: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await run_idempotent(
+        idempotency_key, user_data['user_id'], "payments.create_order",
+        {"order_id": order_id, "checkout_id": checkout_id},
+        lambda: create_gateway_order(order_id, checkout_id, user_data)
+    )
+
+async def create_gateway_order(order_id: Optional[str], checkout_id: Optional[str], user_data: dict):
+    # A checkout covers all of its per-restaurant orders with one payment
+    if checkout_id:
+        payable = await db.checkouts.find_one({"id": checkout_id, "user_id": user_data['user_id']}, {"_id": 0})
+        if not payable:
+            raise HTTPException(status_code=404, detail="Checkout not found")
+    elif order_id:
+        payable = await db.orders.find_one({**order_id_query(order_id), "user_id": user_data['user_id']})
+        if not payable:
+            raise HTTPException(status_code=404, detail="Order not found")
+    else:
+        raise HTTPException(status_code=400, detail="order_id or checkout_id is required")
     
-    if order['payment_status'] == 'paid':
+    if payable['payment_status'] == 'paid':
         raise HTTPException(status_code=400, detail="Order already paid")
     
-    # Create Razorpay order
-    amount_in_paise = int(order['total_amount'] * 100)
+    if checkout_id:
+        # Orders of the checkout already paid on their own are not charged again
+        unpaid = await db.orders.find(
+            {"checkout_id": checkout_id, "payment_status": {"$nin": PAID_PAYMENT_STATUSES}},
+            {"total_paise": 1, "commission_paise": 1, "restaurant_paise": 1, "total_amount": 1, "commission_amount": 1}
+        ).to_list(100)
+        amount_in_paise = sum(order_paise(order)[0] for order in unpaid)
+        if not amount_in_paise:
+            raise HTTPException(status_code=400, detail="Order already paid")
+    else:
+        amount_in_paise = payable.get('total_paise')
+        if amount_in_paise is None:
+            amount_in_paise = to_paise(payable['total_amount'])
+    
+    collection, key = (db.checkouts, {"id": checkout_id}) if checkout_id else (db.orders, {"_id": payable['_id']})
     
     try:
-        razorpay_order = razorpay_client.order.create({
-            "amount": amount_in_paise,
-            "currency": "INR",
-            "payment_capture": 1
-        })
-        
-        # Update order with razorpay order ID
-        await db.orders.update_one(
-            {"id": order_id},
-            {"$set": {"razorpay_order_id": razorpay_order['id']}}
+        razorpay_order_id = await obtain_gateway_order(collection, key, payable, amount_in_paise, checkout_id or order_id)
+    except GatewayUnavailableError as e:
+        # Fail fast while the gateway is degraded instead of queueing behind it
+        raise HTTPException(
+            status_code=503,
+            detail="Payment gateway is temporarily unavailable, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
         )
-        
-        return {
-            "razorpay_order_id": razorpay_order['id'],
-            "amount": amount_in_paise,
-            "currency": "INR",
-            "key_id": RAZORPAY_KEY_ID
-        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Razorpay order creation failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Payment order creation failed")
+    
+    if checkout_id:
+        # Orders follow their checkout's gateway order; a no-op when it was reused
+        await db.orders.update_many(
+            {"checkout_id": checkout_id, "razorpay_order_id": {"$ne": razorpay_order_id}, "payment_status": {"$nin": PAID_PAYMENT_STATUSES}},
+            {"$set": {"razorpay_order_id": razorpay_order_id}, "$addToSet": {"gateway_order_ids": razorpay_order_id}}
+        )
+    
+    return {
+        "razorpay_order_id": razorpay_order_id,
+        "amount": amount_in_paise,
+        "currency": GATEWAY_ORDER_CURRENCY,
+        "key_id": RAZORPAY_KEY_ID
+    }
+
+def reusable_gateway_order(payable: dict, amount_in_paise: int, now: datetime) -> Optional[str]:
+    if not payable.get('razorpay_order_id') or payable.get('payment_status') == 'paid':
+        return None
+    if payable.get('razorpay_order_amount') != amount_in_paise or payable.get('razorpay_order_currency') != GATEWAY_ORDER_CURRENCY:
+        return None
+    if not payable.get('razorpay_order_expires_at') or payable['razorpay_order_expires_at'] <= now:
+        return None
+    return payable['razorpay_order_id']
+
+async def obtain_gateway_order(collection, key: dict, payable: dict, amount_in_paise: int, receipt: str) -> str:
+    # Returns the payable's stored gateway order when it is still usable, otherwise creates one.
+    # Creation is guarded by a lease on the payable document so concurrent calls create at most one.
+    deadline = time.monotonic() + GATEWAY_ORDER_LOCK_SECONDS
+    while True:
+        now = datetime.now(timezone.utc)
+        reusable = reusable_gateway_order(payable, amount_in_paise, now)
+        if reusable:
+            return reusable
+        if payable.get('payment_status') == 'paid':
+            raise HTTPException(status_code=400, detail="Order already paid")
+        
+        lock_owner = new_id()
+        locked = await collection.find_one_and_update(
+            {
+                **key,
+                "payment_status": {"$ne": "paid"},
+                # Only lock the version we looked at; a gateway order stored meanwhile wins
+                "razorpay_order_id": payable.get('razorpay_order_id'),
+                "$or": [{"gateway_order_lock_until": None}, {"gateway_order_lock_until": {"$lt": now}}]
+            },
+            {"$set": {
+                "gateway_order_lock_owner": lock_owner,
+                "gateway_order_lock_until": now + timedelta(seconds=GATEWAY_ORDER_LOCK_SECONDS)
+            }}
+        )
+        if locked:
+            break
+        
+        # Another request is creating the gateway order; wait for it to be stored
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=409, detail="Payment order is being created, please retry")
+        await asyncio.sleep(GATEWAY_ORDER_LOCK_POLL_SECONDS)
+        payable = await collection.find_one(key)
+        if not payable:
+            raise HTTPException(status_code=404, detail="Order not found")
+    
+    try:
+        razorpay_order = await razorpay_gateway.create_order(amount_in_paise, GATEWAY_ORDER_CURRENCY, receipt=receipt)
+    except Exception:
+        await collection.update_one(
+            {**key, "gateway_order_lock_owner": lock_owner},
+            {"$unset": {"gateway_order_lock_owner": "", "gateway_order_lock_until": ""}}
+        )
+        raise
+    
+    created_at = datetime.now(timezone.utc)
+    await collection.update_one(
+        {**key, "gateway_order_lock_owner": lock_owner},
+        {
+            "$set": {
+                "razorpay_order_id": razorpay_order['id'],
+                "razorpay_order_amount": amount_in_paise,
+                "razorpay_order_currency": GATEWAY_ORDER_CURRENCY,
+                "razorpay_order_expires_at": created_at + timedelta(minutes=GATEWAY_ORDER_TTL_MINUTES),
+                "updated_at": created_at
+            },
+            # Replaced gateway orders stay resolvable, so a late capture against one still finds the order
+            "$addToSet": {"gateway_order_ids": razorpay_order['id']},
+            "$unset": {"gateway_order_lock_owner": "", "gateway_order_lock_until": ""}
+        }
+    )
+    return razorpay_order['id']
+
+async def settle_payment(razorpay_order_id: str, razorpay_payment_id: str) -> tuple:
+    # Marks every order behind a gateway order as paid and returns (all orders, orders paid by this call).
+    # Runs as one transaction so concurrent confirmations cannot both count the same payment.
+    now = datetime.now(timezone.utc)
+    confirmable = {"$in": ["$status", ORDER_STATUS_PREDECESSORS["confirmed"]]}
+    
+    async def apply(session):
+        # The gateway order may be one that was since replaced by a newer one
+        orders = await db.orders.find(
+            {"$or": [{"razorpay_order_id": razorpay_order_id}, {"gateway_order_ids": razorpay_order_id}]},
+            {
+                "id": 1, "user_id": 1, "restaurant_id": 1, "status": 1, "payment_status": 1, "checkout_id": 1,
+                "total_amount": 1, "commission_amount": 1, "restaurant_amount": 1,
+                "total_paise": 1, "commission_paise": 1, "restaurant_paise": 1, "prep_minutes": 1, "items.prep_time": 1,
+                "created_at": 1
+            },
+            session=session
+        ).to_list(100)
+        unpaid_ids = [order['_id'] for order in orders if order['payment_status'] != 'paid']
+        orders = [order_out(order) for order in orders]
+        unpaid = [order for order in orders if order['payment_status'] != 'paid']
+        if not unpaid:
+            return orders, [], []
+        
+        await db.orders.update_many(
+            {"_id": {"$in": unpaid_ids}, "payment_status": {"$ne": "paid"}},
+            [{"$set": {
+                "payment_status": "paid",
+                "razorpay_order_id": razorpay_order_id,
+                "razorpay_payment_id": razorpay_payment_id,
+                "paid_at": now,
+                "updated_at": now,
+                # Payment confirms the order only through a legal transition
+                "status": {"$cond": [confirmable, "confirmed", "$status"]},
+                "status_history": {"$cond": [
+                    confirmable,
+                    {"$concatArrays": [
+                        {"$ifNull": ["$status_history", []]},
+                        [{"status": "confirmed", "at": now, "by": "payment"}]
+                    ]},
+                    "$status_history"
+                ]}
+            }}],
+            session=session
+        )
+        
+        for checkout_id in {order['checkout_id'] for order in unpaid if order.get('checkout_id')}:
+            # An order paid on its own leaves its checkout open for the others
+            if await db.orders.count_documents(
+                {"checkout_id": checkout_id, "payment_status": {"$nin": PAID_PAYMENT_STATUSES}},
+                session=session
+            ):
+                continue
+            await db.checkouts.update_one(
+                {"id": checkout_id},
+                {"$set": {
+                    "payment_status": "paid",
+                    "razorpay_order_id": razorpay_order_id,
+                    "razorpay_payment_id": razorpay_payment_id,
+                    "updated_at": now
+                }},
+                session=session
+            )
+        
+        await record_daily_stats([paid_order_stats_update(order) for order in unpaid], session=session)
+        
+        confirmed = []
+        for order in unpaid:
+            if order['status'] in ORDER_STATUS_PREDECESSORS["confirmed"]:
+                confirmed.append((order['status'], order))
+                order['status'] = "confirmed"
+            order['payment_status'] = "paid"
+        
+        # Notifications happen after commit, exactly for the orders paid here
+        await write_outbox(
+            "order.paid",
+            {"user_id": unpaid[0]['user_id'], "orders": [outbox_order(order) for order in unpaid]},
+            session=session
+        )
+        return orders, unpaid, confirmed
+    
+    async with await client.start_session() as session:
+        orders, newly_paid, confirmed = await session.with_transaction(apply)
+    if newly_paid:
+        wake_outbox_dispatcher()
+    for previous_status, order in confirmed:
+        kitchen_queue.apply(order, previous_status, "confirmed", now)
+    return orders, newly_paid
 
 @api_router.post("/payments/verify")
 async def verify_payment(
     razorpay_order_id: str,
     razorpay_payment_id: str,
     razorpay_signature: str,
-    user_data: dict = Depends(get_current_user)
+    user_data: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await run_idempotent(
+        idempotency_key, user_data['user_id'], "payments.verify",
+        {"razorpay_order_id": razorpay_order_id, "razorpay_payment_id": razorpay_payment_id, "razorpay_signature": razorpay_signature},
+        lambda: confirm_payment(razorpay_order_id, razorpay_payment_id, razorpay_signature, user_data)
+    )
+
+async def confirm_payment(
+    razorpay_order_id: str,
+    razorpay_payment_id: str,
+    razorpay_signature: str,
+    user_data: dict
+):
+    # Verify payment signature
+    if not razorpay_gateway.verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature):
+        raise HTTPException(status_code=400, detail="Invalid payment signature")
+    
+    # Update order(s) - a checkout payment covers several orders
+    orders, _ = await settle_payment(razorpay_order_id, razorpay_payment_id)
+    if not orders:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    return {
+        "status": "success",
+        "order_id": orders[0]['id'],
+        "order_ids": [order['id'] for order in orders]
+    }
+
+
+# ==================== PAYMENT WEBHOOKS ====================
+
+# Webhook deliveries are stored in payment_events keyed by event id, acknowledged immediately
+# and processed by a per-worker pool. Unfinished events are picked up again at startup and by a
+# periodic requeue job, so payment state converges even if a worker dies mid-event.
+RAZORPAY_WEBHOOK_SECRET = os.environ.get('RAZORPAY_WEBHOOK_SECRET', '')
+PAYMENT_EVENT_WORKERS = int(os.environ.get('PAYMENT_EVENT_WORKERS', '4'))
+PAYMENT_EVENT_QUEUE_SIZE = 1000
+PAYMENT_EVENT_MAX_ATTEMPTS = 8
+PAYMENT_EVENT_LOCK_SECONDS = 60
+PAYMENT_EVENT_REQUEUE_INTERVAL_SECONDS = 60
+PAYMENT_EVENT_PENDING_STATUSES = ["received", "processing", "failed"]
+payment_event_queue: Optional[asyncio.Queue] = None
+
+@api_router.post("/webhooks/razorpay")
+async def razorpay_webhook(
+    request: Request,
+    x_razorpay_signature: Optional[str] = Header(None),
+    x_razorpay_event_id: Optional[str] = Header(None)
 ):
+    if not RAZORPAY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks are not configured")
+    
+    body = await request.body()
+    expected = hmac.new(RAZORPAY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    if not x_razorpay_signature or not hmac.compare_digest(expected, x_razorpay_signature):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    
+    # Razorpay retries a delivery with the same event id; the body hash covers deliveries without one
+    event_id = x_razorpay_event_id or hashlib.sha256(body).hexdigest()
+    try:
+        await db.payment_events.insert_one({
+            "_id": event_id,
+            "event": payload.get('event'),
+            "payload": payload,
+            "status": "received",
+            "attempts": 0,
+            "locked_until": None,
+            "received_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        return {"status": "duplicate"}
+    
+    metrics.inc("payment_events_received_total", "Webhook events received", event=payload.get('event') or "unknown")
+    enqueue_payment_event(event_id)
+    return {"status": "accepted"}
+
+def enqueue_payment_event(event_id: str) -> bool:
+    # A full queue only delays the event; the requeue job will find it in payment_events
+    if payment_event_queue is None:
+        return False
+    try:
+        payment_event_queue.put_nowait(event_id)
+        return True
+    except asyncio.QueueFull:
+        return False
+
+async def handle_payment_captured(payload: dict):
+    payment = payload['payload']['payment']['entity']
+    orders, _ = await settle_payment(payment['order_id'], payment['id'])
+    if not orders:
+        raise ValueError(f"No orders for gateway order {payment['order_id']}")
+
+async def handle_payment_failed(payload: dict):
+    payment = payload['payload']['payment']['entity']
+    now = datetime.now(timezone.utc)
+    # The user can retry on the same gateway order, so a later capture still settles these orders
+    orders = await db.orders.find(
+        {"razorpay_order_id": payment['order_id'], "payment_status": "pending"}
+    ).to_list(100)
+    if not orders:
+        return
+    
+    await db.orders.update_many(
+        {"_id": {"$in": [order['_id'] for order in orders]}, "payment_status": "pending"},
+        {"$set": {"payment_status": "failed", "updated_at": now}}
+    )
+    await db.checkouts.update_one(
+        {"razorpay_order_id": payment['order_id'], "payment_status": "pending"},
+        {"$set": {"payment_status": "failed", "updated_at": now}}
+    )
+    for order in orders:
+        order['payment_status'] = "failed"
+        await order_events.publish("order.payment_failed", order)
+
+def allocate_refunds(orders: List[dict], refunds: List[dict]) -> Dict[str, int]:
+    # Refunds that name an order (notes.order_id) go to it; the rest of the payment's refunds are
+    # spread over its orders in proportion to what each still has unrefunded
+    totals = {order['id']: order_paise(order)[0] for order in orders}
+    refunded = {order_id: 0 for order_id in totals}
+    unassigned = 0
+    for refund in refunds:
+        target = refund.get('order_id')
+        if target in refunded:
+            taken = min(refund['amount'], totals[target] - refunded[target])
+            refunded[target] += taken
+            unassigned += refund['amount'] - taken
+        else:
+            unassigned += refund['amount']
+    
+    room = {order_id: totals[order_id] - refunded[order_id] for order_id in totals}
+    room_total = sum(room.values())
+    unassigned = min(unassigned, room_total)
+    if unassigned:
+        shares = {order_id: unassigned * room[order_id] // room_total for order_id in room}
+        # Largest remainder keeps the shares summing to the refunded amount
+        leftover = unassigned - sum(shares.values())
+        for order_id in sorted(room, key=lambda order_id: (unassigned * room[order_id]) % room_total, reverse=True)[:leftover]:
+            shares[order_id] += 1
+        for order_id, share in shares.items():
+            refunded[order_id] += share
+    return refunded
+
+async def handle_refund_processed(payload: dict):
+    refund = payload['payload']['refund']['entity']
+    notes = refund.get('notes') if isinstance(refund.get('notes'), dict) else {}
+    # Refunds are recorded once by id; the totals below are recomputed from them, so replays converge
     try:
-        # Verify payment signature
-        razorpay_client.utility.verify_payment_signature({
-            'razorpay_order_id': razorpay_order_id,
-            'razorpay_payment_id': razorpay_payment_id,
-            'razorpay_signature': razorpay_signature
+        await db.payment_refunds.insert_one({
+            "_id": refund['id'],
+            "payment_id": refund['payment_id'],
+            "amount": refund['amount'],
+            "order_id": notes.get('order_id'),
+            "created_at": datetime.now(timezone.utc)
         })
+    except DuplicateKeyError:
+        pass
+    
+    now = datetime.now(timezone.utc)
+    
+    async def apply(session):
+        refunds = await db.payment_refunds.find({"payment_id": refund['payment_id']}, session=session).to_list(1000)
+        # The payment's orders may have been archived since
+        located = []
+        for collection in await order_collections():
+            async for order in collection.find({"razorpay_payment_id": refund['payment_id']}, session=session):
+                located.append((collection, order['_id'], order_out(order)))
+        if not located:
+            raise ValueError(f"No orders for payment {refund['payment_id']}")
         
-        # Update order
-        order = await db.orders.find_one({"razorpay_order_id": razorpay_order_id}, {"_id": 0})
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
+        refunded = allocate_refunds([order for _, _, order in located], refunds)
+        changed = []
+        stats = []
+        for collection, stored_id, order in located:
+            previous_refunded_paise = order.get('refunded_paise') or 0
+            refunded_paise = refunded[order['id']]
+            if refunded_paise == previous_refunded_paise:
+                continue
+            payment_status = "refunded" if refunded_paise >= order_paise(order)[0] else "partially_refunded"
+            await collection.update_one(
+                {"_id": stored_id},
+                {"$set": {"payment_status": payment_status, "refunded_paise": refunded_paise, "updated_at": now}},
+                session=session
+            )
+            stats.append(refund_stats_update(order, previous_refunded_paise, refunded_paise))
+            changed.append({**order, "payment_status": payment_status, "refunded_paise": refunded_paise})
+        await record_daily_stats(stats, session=session)
         
-        await db.orders.update_one(
-            {"id": order['id']},
+        refunded_total = sum(refunded.values())
+        paid_total = sum(order_paise(order)[0] for _, _, order in located)
+        await db.checkouts.update_one(
+            {"razorpay_payment_id": refund['payment_id']},
             {"$set": {
-                "payment_status": "paid",
-                "razorpay_payment_id": razorpay_payment_id,
-                "status": "confirmed",
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
+                "payment_status": "refunded" if refunded_total >= paid_total else "partially_refunded",
+                "refunded_paise": refunded_total,
+                "updated_at": now
+            }},
+            session=session
+        )
+        return changed
+    
+    async with await client.start_session() as session:
+        changed = await session.with_transaction(apply)
+    for order in changed:
+        await order_events.publish("order.refunded", order)
+
+PAYMENT_EVENT_HANDLERS = {
+    "payment.captured": handle_payment_captured,
+    "payment.failed": handle_payment_failed,
+    "refund.processed": handle_refund_processed
+}
+
+async def process_payment_event(event_id: str):
+    now = datetime.now(timezone.utc)
+    # Claim the event so a requeued copy on another worker does not process it concurrently
+    event = await db.payment_events.find_one_and_update(
+        {
+            "_id": event_id,
+            "status": {"$in": PAYMENT_EVENT_PENDING_STATUSES},
+            "attempts": {"$lt": PAYMENT_EVENT_MAX_ATTEMPTS},
+            "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+        },
+        {
+            "$set": {"status": "processing", "locked_until": now + timedelta(seconds=PAYMENT_EVENT_LOCK_SECONDS)},
+            "$inc": {"attempts": 1}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    if not event:
+        return
+    
+    handler = PAYMENT_EVENT_HANDLERS.get(event['event'])
+    try:
+        if handler:
+            await handler(event['payload'])
+    except Exception as e:
+        # Back off exponentially before the requeue job offers the event again
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=min(2 ** event['attempts'] * 5, 3600))
+        await db.payment_events.update_one(
+            {"_id": event_id},
+            {"$set": {"status": "failed", "locked_until": retry_at, "last_error": str(e)}}
         )
+        metrics.inc("payment_events_processed_total", "Webhook events processed", event=event['event'], outcome="failed")
+        logger.error(f"Payment event {event_id} ({event['event']}) failed: {str(e)}")
+        return
+    
+    await db.payment_events.update_one(
+        {"_id": event_id},
+        {"$set": {
+            "status": "processed" if handler else "ignored",
+            "locked_until": None,
+            "processed_at": datetime.now(timezone.utc)
+        }}
+    )
+    metrics.inc("payment_events_processed_total", "Webhook events processed",
+                event=event['event'], outcome="processed" if handler else "ignored")
+
+async def payment_event_worker():
+    while True:
+        event_id = await payment_event_queue.get()
+        try:
+            await process_payment_event(event_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Payment event worker failed on {event_id}: {str(e)}")
+        finally:
+            payment_event_queue.task_done()
+            metrics.set("payment_event_queue_depth", "Webhook events waiting for a worker", payment_event_queue.qsize())
+
+async def requeue_payment_events() -> int:
+    now = datetime.now(timezone.utc)
+    events = await db.payment_events.find(
+        {
+            "status": {"$in": PAYMENT_EVENT_PENDING_STATUSES},
+            "attempts": {"$lt": PAYMENT_EVENT_MAX_ATTEMPTS},
+            "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+        },
+        {"_id": 1}
+    ).sort("received_at", 1).limit(PAYMENT_EVENT_QUEUE_SIZE).to_list(PAYMENT_EVENT_QUEUE_SIZE)
+    
+    requeued = 0
+    for event in events:
+        if not enqueue_payment_event(event['_id']):
+            break
+        requeued += 1
+    if requeued:
+        logger.info(f"Requeued {requeued} unprocessed payment events")
+    return requeued
+
+def start_payment_event_workers():
+    global payment_event_queue
+    payment_event_queue = asyncio.Queue(maxsize=PAYMENT_EVENT_QUEUE_SIZE)
+    for _ in range(PAYMENT_EVENT_WORKERS):
+        background_tasks.append(asyncio.create_task(payment_event_worker()))
+    start_background_job("payment_event_requeue", PAYMENT_EVENT_REQUEUE_INTERVAL_SECONDS, requeue_payment_events)
+
+
+# ==================== PAYMENT RECONCILIATION ====================
+
+# Orders whose payment outcome was never reported (no verify call, no webhook) are checked
+# against the gateway. The sweep walks stale unpaid orders in (updated_at, _id) order from a
+# checkpoint in job_leases, so each run continues where the previous one stopped.
+PAYMENT_RECONCILE_ENABLED = os.environ.get('PAYMENT_RECONCILE_ENABLED', 'true').lower() == 'true'
+PAYMENT_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_INTERVAL_SECONDS', '300'))
+PAYMENT_RECONCILE_AFTER_MINUTES = int(os.environ.get('PAYMENT_RECONCILE_AFTER_MINUTES', '15'))
+PAYMENT_EXPIRE_AFTER_HOURS = int(os.environ.get('PAYMENT_EXPIRE_AFTER_HOURS', '24'))
+PAYMENT_RECONCILE_BATCH_SIZE = 200
+PAYMENT_RECONCILE_MAX_BATCHES = 10
+PAYMENT_RECONCILE_CONCURRENCY = int(os.environ.get('PAYMENT_RECONCILE_CONCURRENCY', '5'))
+PAYMENT_RECONCILE_RATE_PER_SECOND = float(os.environ.get('PAYMENT_RECONCILE_RATE_PER_SECOND', '10'))
+# Failed orders stay candidates because the user can retry on the same gateway order, until they expire
+PAYMENT_RECONCILE_STATUSES = ["pending", "failed"]
+
+class RateLimiter:
+    # Spaces calls evenly at a fixed rate across all tasks sharing the limiter
+    def __init__(self, rate_per_second: float):
+        self.interval = 1 / rate_per_second
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def check_gateway_order(razorpay_order_id: str, limiter: RateLimiter, slots: asyncio.Semaphore) -> Optional[dict]:
+    # Returns the captured payment, {} when the gateway has no capture, or None when the order is unknown to it
+    async with slots:
+        await limiter.wait()
+        try:
+            payments = await razorpay_gateway.fetch_order_payments(razorpay_order_id)
+        except PaymentGatewayError as e:
+            if e.status_code in (400, 404):
+                return None
+            raise
+    captured = [payment for payment in payments if payment.get('status') == 'captured']
+    if captured:
+        return captured[0]
+    if payments and all(payment.get('status') == 'failed' for payment in payments):
+        return {"status": "failed"}
+    return {}
+
+def expire_order_update(order: dict, now: datetime) -> UpdateOne:
+    # Only matches while the payment status is the one the sweep looked at
+    return UpdateOne(
+        {"_id": order['_id'], "payment_status": order['payment_status']},
+        [{"$set": {
+            "payment_status": "expired",
+            "updated_at": now,
+            "status": {"$cond": [{"$eq": ["$status", "pending"]}, "cancelled", "$status"]},
+            "status_history": {"$cond": [
+                {"$eq": ["$status", "pending"]},
+                {"$concatArrays": [
+                    {"$ifNull": ["$status_history", []]},
+                    [{"status": "cancelled", "at": now, "by": "payment_expiry"}]
+                ]},
+                "$status_history"
+            ]}
+        }}]
+    )
+
+async def apply_expiry(operations: List[UpdateOne], cancelled: List[dict]):
+    if operations:
+        await db.orders.bulk_write(operations, ordered=False)
+    await record_daily_stats([daily_stats_update(order, cancellations=1) for order in cancelled])
+    if cancelled:
+        # Cancelled orders give back the stock reserved at checkout
+        await release_order_stock([order['_id'] for order in cancelled])
+    for order in cancelled:
+        order.update(status="cancelled", payment_status="expired")
+        await order_events.publish("order.status_changed", order)
+
+async def expire_orders_without_gateway_order(now: datetime, expire_before: datetime, outcomes: dict):
+    # Checkouts abandoned before a gateway order was created (or whose creation failed) have nothing
+    # to ask the gateway about; they expire once old enough and release their stock
+    while True:
+        batch = await db.orders.find(
+            {
+                "payment_status": {"$in": PAYMENT_RECONCILE_STATUSES},
+                "razorpay_order_id": None,
+                "created_at": {"$lt": expire_before}
+            },
+            {"id": 1, "user_id": 1, "restaurant_id": 1, "status": 1, "payment_status": 1, "created_at": 1}
+        ).limit(PAYMENT_RECONCILE_BATCH_SIZE).to_list(PAYMENT_RECONCILE_BATCH_SIZE)
+        if not batch:
+            return
+        cancelled = [order for order in batch if order['status'] == "pending"]
+        await apply_expiry([expire_order_update(order, now) for order in batch], cancelled)
+        outcomes['expired'] += len(batch)
+
+async def reconcile_payments() -> dict:
+    started = time.monotonic()
+    now = datetime.now(timezone.utc)
+    stale_before = now - timedelta(minutes=PAYMENT_RECONCILE_AFTER_MINUTES)
+    expire_before = now - timedelta(hours=PAYMENT_EXPIRE_AFTER_HOURS)
+    limiter = RateLimiter(PAYMENT_RECONCILE_RATE_PER_SECOND)
+    slots = asyncio.Semaphore(PAYMENT_RECONCILE_CONCURRENCY)
+    outcomes = {"paid": 0, "failed": 0, "expired": 0, "unchanged": 0}
+    
+    lease = await db.job_leases.find_one({"_id": "payment_reconciler"}, {"checkpoint": 1}) or {}
+    checkpoint = lease.get('checkpoint')
+    
+    for _ in range(PAYMENT_RECONCILE_MAX_BATCHES):
+        query = {
+            "payment_status": {"$in": PAYMENT_RECONCILE_STATUSES},
+            "razorpay_order_id": {"$type": "string"},
+            "updated_at": {"$lt": stale_before}
+        }
+        if checkpoint:
+            query["$or"] = [
+                {"updated_at": {"$gt": checkpoint['updated_at']}},
+                {"updated_at": checkpoint['updated_at'], "_id": {"$gt": checkpoint['order_id']}}
+            ]
+        batch = await db.orders.find(query, {
+            "id": 1, "user_id": 1, "restaurant_id": 1, "status": 1, "payment_status": 1,
+            "razorpay_order_id": 1, "created_at": 1, "updated_at": 1
+        }).sort([("updated_at", 1), ("_id", 1)]).limit(PAYMENT_RECONCILE_BATCH_SIZE).to_list(PAYMENT_RECONCILE_BATCH_SIZE)
+        if not batch:
+            # Reached the stale cutoff; the next run starts over from the oldest unpaid order
+            checkpoint = None
+            break
         
-        # Clear user's cart
-        await db.cart_items.delete_many({"user_id": user_data['user_id']})
+        # One gateway query per gateway order; a checkout's orders share one
+        orders_by_gateway_order: Dict[str, List[dict]] = {}
+        for order in batch:
+            orders_by_gateway_order.setdefault(order['razorpay_order_id'], []).append(order)
+        gateway_order_ids = list(orders_by_gateway_order)
+        try:
+            results = await asyncio.gather(*[
+                check_gateway_order(gateway_order_id, limiter, slots) for gateway_order_id in gateway_order_ids
+            ])
+        except PaymentGatewayError as e:
+            # Leave the checkpoint before this batch so it is retried once the gateway recovers
+            logger.warning(f"Payment reconciliation paused: {str(e)}")
+            break
         
-        return {"status": "success", "order_id": order['id']}
+        operations = []
+        cancelled = []
+        for gateway_order_id, result in zip(gateway_order_ids, results):
+            orders = orders_by_gateway_order[gateway_order_id]
+            if result and result.get('id'):
+                _, newly_paid = await settle_payment(gateway_order_id, result['id'])
+                outcomes['paid'] += len(newly_paid)
+                continue
+            
+            for order in orders:
+                if order['created_at'] < expire_before:
+                    # Nothing captured within the window, including orders whose attempts all failed:
+                    # expiry is final, so they leave the sweep for good
+                    operations.append(expire_order_update(order, now))
+                    outcomes['expired'] += 1
+                    if order['status'] == "pending":
+                        cancelled.append(order)
+                elif result and result.get('status') == 'failed' and order['payment_status'] != 'failed':
+                    operations.append(UpdateOne(
+                        {"_id": order['_id'], "payment_status": order['payment_status']},
+                        {"$set": {"payment_status": "failed", "updated_at": now}}
+                    ))
+                    outcomes['failed'] += 1
+                else:
+                    outcomes['unchanged'] += 1
         
-    except razorpay.errors.SignatureVerificationError:
-        raise HTTPException(status_code=400, detail="Invalid payment signature")
+        await apply_expiry(operations, cancelled)
+        
+        last = batch[-1]
+        checkpoint = {"updated_at": last['updated_at'], "order_id": last['_id']}
+        await db.job_leases.update_one({"_id": "payment_reconciler"}, {"$set": {"checkpoint": checkpoint}})
+    
+    if checkpoint is None:
+        await db.job_leases.update_one({"_id": "payment_reconciler"}, {"$set": {"checkpoint": None}})
+    await expire_orders_without_gateway_order(now, expire_before, outcomes)
+    
+    for outcome, count in outcomes.items():
+        if count:
+            metrics.inc("payment_reconciliation_orders_total", "Orders checked by the reconciliation sweep", count, outcome=outcome)
+    metrics.set("payment_reconciliation_last_run_seconds", "Duration of the last reconciliation sweep", time.monotonic() - started)
+    metrics.set("payment_reconciliation_last_run_timestamp", "Unix time the last reconciliation sweep finished", time.time())
+    if outcomes['paid'] or outcomes['failed'] or outcomes['expired']:
+        logger.info(f"Payment reconciliation: {outcomes}")
+    return outcomes
 
 
 # ==================== ROOT ROUTE ====================
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
 @api_router.get("/")
 async def root():
     return {
@@ -879,10 +4115,75 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(api_router)
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Order history: keyset pagination on (created_at, id) with optional status filters
+    await db.orders.create_index([("restaurant_id", 1), ("status", 1), ("created_at", -1), ("_id", -1)])
+    await db.orders.create_index([("restaurant_id", 1), ("created_at", -1), ("_id", -1)])
+    await db.orders.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+    # Only orders from before ids moved into _id carry a separate id field
+    await db.orders.create_index("id", partialFilterExpression={"id": {"$exists": True}})
+    # Archiver scan for finished orders
+    await db.orders.create_index([("status", 1), ("updated_at", 1)])
+    # Checkout payment looks up the checkout and all of its orders
+    await db.checkouts.create_index("id", unique=True)
+    await db.orders.create_index("checkout_id", sparse=True)
+    await db.menu_items.create_index("restaurant_id")
+    await db.daily_stats.create_index([("restaurant_id", 1), ("date", 1)], unique=True)
+    await db.settlement_ledger.create_index([("restaurant_id", 1), ("period_start", -1)])
+    # Settlement reads each restaurant's orders by when they were paid
+    await db.orders.create_index([("restaurant_id", 1), ("paid_at", 1), ("_id", 1)], sparse=True)
+    # Payment confirmation, webhooks and refunds look orders up by their gateway ids
+    await db.orders.create_index("razorpay_order_id", sparse=True)
+    await db.orders.create_index("razorpay_payment_id", sparse=True)
+    await db.checkouts.create_index("razorpay_order_id", sparse=True)
+    await db.orders.create_index("gateway_order_ids", sparse=True)
+    await db.payment_events.create_index([("status", 1), ("received_at", 1)])
+    await db.payment_refunds.create_index("payment_id")
+    await db.outbox.create_index([("status", 1), ("available_at", 1)])
+    await db.outbox.create_index("completed_at", expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+    await db.delivery_endpoints.create_index([("restaurant_id", 1), ("active", 1)])
+    await db.outbound_deliveries.create_index([("status", 1), ("available_at", 1)])
+    await db.outbound_deliveries.create_index([("restaurant_id", 1), ("status", 1), ("dead_at", -1)])
+    await db.outbound_deliveries.create_index("finished_at", expireAfterSeconds=OUTBOUND_RETENTION_SECONDS)
+    # Reconciliation sweep over unpaid orders that have a gateway order, and expiry of those that never got one
+    await db.orders.create_index(
+        [("payment_status", 1), ("updated_at", 1), ("_id", 1)],
+        partialFilterExpression={"razorpay_order_id": {"$type": "string"}}
+    )
+    await db.orders.create_index([("payment_status", 1), ("razorpay_order_id", 1), ("created_at", 1)])
+    
+    if ORDER_EVENTS_BACKEND == 'mongo':
+        await db.order_events.create_index("created_at", expireAfterSeconds=ORDER_EVENTS_RETENTION_SECONDS)
+        await db.order_events.create_index([("channels", 1), ("_id", 1)])
+
+@app.on_event("startup")
+async def start_order_events():
+    await order_events.start()
+
+@app.on_event("startup")
+async def start_background_jobs():
+    if ORDER_ARCHIVE_ENABLED:
+        start_background_job("order_archiver", ORDER_ARCHIVE_INTERVAL_SECONDS, archive_orders)
+    # The requeue job runs once at startup, which picks up events left behind by a restart
+    start_outbox_dispatcher()
+    start_outbound_dispatcher()
+    start_payment_event_workers()
+    if PAYMENT_RECONCILE_ENABLED:
+        start_background_job("payment_reconciler", PAYMENT_RECONCILE_INTERVAL_SECONDS, reconcile_payments)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await order_events.stop()
+    await razorpay_gateway.close()
+    await stop_outbound_dispatcher()
     client.close()
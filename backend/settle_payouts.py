@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from server import client, run_settlement, SETTLEMENT_CONCURRENCY
+
+
+def parse_month(value):
+    return datetime.strptime(value, "%Y-%m").replace(tzinfo=timezone.utc)
+
+
+def month_bounds(month):
+    end = datetime(month.year + 1, 1, 1, tzinfo=timezone.utc) if month.month == 12 else datetime(month.year, month.month + 1, 1, tzinfo=timezone.utc)
+    return month, end
+
+
+def previous_month():
+    today = datetime.now(timezone.utc)
+    first = datetime(today.year, today.month, 1, tzinfo=timezone.utc)
+    return datetime(first.year - 1, 12, 1, tzinfo=timezone.utc) if first.month == 1 else datetime(first.year, first.month - 1, 1, tzinfo=timezone.utc)
+
+
+async def settle(month, concurrency):
+    period_start, period_end = month_bounds(month)
+    print(f"Settling orders from {period_start:%Y-%m-%d} to {period_end:%Y-%m-%d} ({concurrency} restaurants at a time)...")
+    run = await run_settlement(period_start, period_end, concurrency)
+    print(f"Settlement {run['_id']}: {run['restaurants']} restaurants, {run['orders']} orders paid in the month")
+    print(f"  Gross:      ₹{run['gross_paise'] / 100:,.2f} (after ₹{run.get('refunded_paise', 0) / 100:,.2f} refunded)")
+    print(f"  Commission: ₹{run['commission_paise'] / 100:,.2f}")
+    print(f"  Payable:    ₹{run['payable_paise'] / 100:,.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute per-restaurant payouts for the orders paid in a month")
+    parser.add_argument("--month", type=parse_month, help="Month to settle (YYYY-MM, UTC), defaults to last month")
+    parser.add_argument("--concurrency", type=int, default=SETTLEMENT_CONCURRENCY, help="Restaurants settled in parallel")
+    args = parser.parse_args()
+
+    # Re-running a month resumes an interrupted run; a completed run is reported as-is
+    asyncio.run(settle(args.month or previous_month(), args.concurrency))
+    client.close()
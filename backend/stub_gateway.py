@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import random
+import secrets
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+import uvicorn
+
+# A local stand-in for the Razorpay orders API, for tests and load runs.
+# Point the backend at it with RAZORPAY_API_URL=http://localhost:9100/v1
+app = FastAPI(title="Stub Payment Gateway")
+
+settings = {
+    "latency_ms": 50,
+    "jitter_ms": 20,
+    "failure_rate": 0.0,
+    "timeout_rate": 0.0,
+    "timeout_ms": 30000,
+    "key_secret": "rzp_test_secret",
+}
+orders = {}
+payments = {}
+
+
+def new_gateway_id(prefix):
+    return f"{prefix}_{secrets.token_hex(7)}"
+
+
+async def simulate_network():
+    if random.random() < settings["timeout_rate"]:
+        # Hang long enough for the client's read timeout to fire
+        await asyncio.sleep(settings["timeout_ms"] / 1000)
+    delay = settings["latency_ms"] + random.uniform(-settings["jitter_ms"], settings["jitter_ms"])
+    await asyncio.sleep(max(delay, 0) / 1000)
+    if random.random() < settings["failure_rate"]:
+        raise HTTPException(status_code=503, detail="Simulated gateway failure")
+
+
+@app.post("/v1/orders")
+async def create_order(request: Request):
+    await simulate_network()
+    payload = await request.json()
+    if not isinstance(payload.get("amount"), int) or payload["amount"] < 100:
+        raise HTTPException(status_code=400, detail="amount must be an integer of at least 100 paise")
+
+    order = {
+        "id": new_gateway_id("order"),
+        "entity": "order",
+        "amount": payload["amount"],
+        "amount_paid": 0,
+        "amount_due": payload["amount"],
+        "currency": payload.get("currency", "INR"),
+        "receipt": payload.get("receipt"),
+        "status": "created",
+        "attempts": 0,
+        "created_at": int(time.time()),
+    }
+    orders[order["id"]] = order
+    return order
+
+
+@app.get("/v1/orders/{order_id}")
+async def fetch_order(order_id: str):
+    await simulate_network()
+    if order_id not in orders:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return orders[order_id]
+
+
+@app.get("/v1/orders/{order_id}/payments")
+async def fetch_order_payments(order_id: str):
+    await simulate_network()
+    if order_id not in orders:
+        raise HTTPException(status_code=404, detail="Order not found")
+    items = [payment for payment in payments.values() if payment["order_id"] == order_id]
+    return {"entity": "collection", "count": len(items), "items": items}
+
+
+# Test helper: capture a payment for an order and return what the checkout widget would hand back
+@app.post("/v1/orders/{order_id}/pay")
+async def pay_order(order_id: str):
+    if order_id not in orders:
+        raise HTTPException(status_code=404, detail="Order not found")
+    order = orders[order_id]
+    payment = {
+        "id": new_gateway_id("pay"),
+        "entity": "payment",
+        "order_id": order_id,
+        "amount": order["amount"],
+        "currency": order["currency"],
+        "status": "captured",
+        "created_at": int(time.time()),
+    }
+    payments[payment["id"]] = payment
+    order.update(status="paid", amount_paid=order["amount"], amount_due=0, attempts=order["attempts"] + 1)
+
+    signature = hmac.new(
+        settings["key_secret"].encode(),
+        f"{order_id}|{payment['id']}".encode(),
+        hashlib.sha256
+    ).hexdigest()
+    return {
+        "razorpay_order_id": order_id,
+        "razorpay_payment_id": payment["id"],
+        "razorpay_signature": signature,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Razorpay orders API with simulated latency and failures")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=int, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=int, default=settings["jitter_ms"])
+    parser.add_argument("--failure-rate", type=float, default=settings["failure_rate"], help="Fraction of calls answered with 503")
+    parser.add_argument("--timeout-rate", type=float, default=settings["timeout_rate"], help="Fraction of calls that hang")
+    parser.add_argument("--key-secret", default=settings["key_secret"], help="Secret used to sign payments (RAZORPAY_KEY_SECRET)")
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        timeout_rate=args.timeout_rate,
+        key_secret=args.key_secret,
+    )
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import time
+from collections import deque
+
+from fastapi import FastAPI, HTTPException, Request
+import uvicorn
+
+# A local receiver for outbound order deliveries (POS webhooks and the notification gateway),
+# for load-testing the dispatcher. Register an endpoint with url http://localhost:9200/hooks/<name>
+# and pass the secret returned at creation with --secret to verify signatures.
+app = FastAPI(title="Stub Delivery Receiver")
+
+settings = {
+    "latency_ms": 20,
+    "jitter_ms": 10,
+    "failure_rate": 0.0,
+    "secret": None,
+    "max_skew_seconds": 300,
+}
+stats = {
+    "requests": 0,
+    "events": 0,
+    "rejected": 0,
+    "failed": 0,
+    "delivery_ids": set(),
+    "duplicates": 0,
+    "recent": deque(maxlen=100000),
+}
+
+
+@app.post("/hooks/{name}")
+async def receive(name: str, request: Request):
+    body = await request.body()
+    if settings["secret"]:
+        timestamp = request.headers.get("x-signature-timestamp", "")
+        expected = "sha256=" + hmac.new(settings["secret"].encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+        fresh = timestamp.isdigit() and abs(time.time() - int(timestamp)) <= settings["max_skew_seconds"]
+        if not fresh or not hmac.compare_digest(expected, request.headers.get("x-signature", "")):
+            stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Bad signature")
+
+    delay = settings["latency_ms"] + random.uniform(-settings["jitter_ms"], settings["jitter_ms"])
+    await asyncio.sleep(max(delay, 0) / 1000)
+    if random.random() < settings["failure_rate"]:
+        stats["failed"] += 1
+        raise HTTPException(status_code=503, detail="Simulated receiver failure")
+
+    payload = json.loads(body)
+    count = len(payload.get("events") or payload.get("messages") or [])
+    delivery_id = request.headers.get("x-delivery-id")
+    if delivery_id in stats["delivery_ids"]:
+        stats["duplicates"] += 1
+    stats["delivery_ids"].add(delivery_id)
+    stats["requests"] += 1
+    stats["events"] += count
+    now = time.monotonic()
+    stats["recent"].extend([now] * count)
+    return {"received": count}
+
+
+@app.get("/stats")
+async def get_stats():
+    cutoff = time.monotonic() - 60
+    while stats["recent"] and stats["recent"][0] < cutoff:
+        stats["recent"].popleft()
+    return {
+        "requests": stats["requests"],
+        "events": stats["events"],
+        "events_last_minute": len(stats["recent"]),
+        "duplicate_batches": stats["duplicates"],
+        "rejected": stats["rejected"],
+        "failed": stats["failed"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub receiver for outbound order deliveries")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency-ms", type=int, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=int, default=settings["jitter_ms"])
+    parser.add_argument("--failure-rate", type=float, default=settings["failure_rate"], help="Fraction of requests answered with 503")
+    parser.add_argument("--secret", help="Endpoint secret used to verify X-Signature")
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        secret=args.secret,
+    )
+    uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="warning")
@@ -115,6 +115,13 @@ const MarketplacePage = () => {
                       />
                     </div>
                   )}
+
+                  {/* Kitchen at capacity */}
+                  {restaurant.busy && (
+                    <div className="absolute top-4 right-4 bg-white/90 text-[#F05A28] px-3 py-1 rounded-full text-xs font-semibold" data-testid={`restaurant-busy-${restaurant.id}`}>
+                      Busy · ~{restaurant.suggested_wait_minutes} min wait
+                    </div>
+                  )}
                 </div>
 
                 {/* Content */}
@@ -113,6 +113,11 @@ const OrdersPage = () => {
                     <p className="text-sm text-muted-foreground">
                       {new Date(order.created_at).toLocaleString()}
                     </p>
+                    {order.eta && (
+                      <p className="text-sm font-medium text-primary mt-1" data-testid={`order-eta-${order.id}`}>
+                        Ready by about {new Date(order.eta).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })}
+                      </p>
+                    )}
                   </div>
                   <div className={`flex items-center gap-2 px-4 py-2 rounded-full border ${getStatusColor(order.status)}`}>
                     {getStatusIcon(order.status)}
@@ -180,6 +180,11 @@ const RestaurantStorefrontPage = () => {
               ))}
             </div>
             <p className="text-white/90 text-lg max-w-2xl">{restaurant.description}</p>
+            {restaurant.busy && (
+              <p className="mt-3 inline-block bg-white/90 text-[#F05A28] px-4 py-1.5 rounded-full text-sm font-semibold" data-testid="restaurant-busy-notice">
+                The kitchen is very busy right now. New orders may have to wait about {restaurant.suggested_wait_minutes} minutes.
+              </p>
+            )}
             
             <div className="flex flex-wrap gap-6 mt-4 text-white/90">
               <div className="flex items-center gap-2">
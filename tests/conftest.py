@@ -0,0 +1,217 @@
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+import mongomock.aggregate
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "restaurant_saas_test")
+os.environ.setdefault("JWT_SECRET", "restaurant-saas-test-secret-0123456789")
+
+import server  # noqa: E402
+import stub_gateway  # noqa: E402
+
+
+# ==================== MONGOMOCK GAPS ====================
+
+# mongomock does not evaluate $type or $mergeObjects, which the stock updates rely on
+BSON_TYPE_NAMES = [(bool, "bool"), (int, "long"), (float, "double"), (str, "string"), (dict, "object"), (list, "array"), (datetime, "date")]
+_parse_expression = mongomock.aggregate._Parser.parse
+
+def parse_expression(self, expression):
+    if isinstance(expression, dict) and len(expression) == 1:
+        operator, values = next(iter(expression.items()))
+        if operator == "$mergeObjects":
+            merged = {}
+            for value in self.parse_many(values):
+                merged.update(value or {})
+            return merged
+        if operator == "$type":
+            try:
+                value = self.parse(values)
+            except KeyError:
+                return "missing"
+            if value is None:
+                return "null"
+            return next(name for kind, name in BSON_TYPE_NAMES if isinstance(value, kind))
+    return _parse_expression(self, expression)
+
+mongomock.aggregate._Parser.parse = parse_expression
+
+
+# Nor the $unionWith stage the analytics pipelines use to read rollups alongside other collections
+def union_with_stage(in_collection, database, options):
+    return in_collection + list(database.get_collection(options['coll']).aggregate(options.get('pipeline', [])))
+
+mongomock.aggregate._PIPELINE_HANDLERS['$unionWith'] = union_with_stage
+
+
+class FakeSession:
+    # mongomock rejects any truthy session, so this one is falsy; the callback runs without isolation
+    def __bool__(self):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def with_transaction(self, callback):
+        return await callback(self)
+
+
+class FakeClient:
+    def __init__(self):
+        self.mongo = AsyncMongoMockClient(tz_aware=True)
+
+    async def start_session(self):
+        return FakeSession()
+
+
+# ==================== FIXTURES ====================
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake_client = FakeClient()
+    database = fake_client.mongo.get_database(os.environ["DB_NAME"])
+    monkeypatch.setattr(server, "client", fake_client)
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "analytics_db", database)
+    monkeypatch.setattr(server, "kitchen_queue", server.KitchenQueue())
+    monkeypatch.setattr(server, "order_events", server.OrderEventBus("memory"))
+    monkeypatch.setattr(server, "analytics_cache", server.AnalyticsCache())
+    monkeypatch.setattr(server, "metrics", server.MetricsRegistry())
+    for cache in (server._restaurant_cache, server._menu_cache, server._idempotency_inflight, server._archive_collections_cache):
+        cache.clear()
+    return database
+
+
+@pytest.fixture
+async def gateway(monkeypatch):
+    # The backend talks to the stub gateway in-process
+    monkeypatch.setitem(stub_gateway.settings, "latency_ms", 0)
+    monkeypatch.setitem(stub_gateway.settings, "jitter_ms", 0)
+    monkeypatch.setitem(stub_gateway.settings, "key_secret", server.RAZORPAY_KEY_SECRET)
+    stub_gateway.orders.clear()
+    stub_gateway.payments.clear()
+
+    razorpay_gateway = server.RazorpayGateway(server.RAZORPAY_KEY_ID, server.RAZORPAY_KEY_SECRET, "http://gateway/v1")
+    razorpay_gateway._client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=stub_gateway.app),
+        base_url="http://gateway/v1",
+        auth=(server.RAZORPAY_KEY_ID, server.RAZORPAY_KEY_SECRET)
+    )
+    monkeypatch.setattr(server, "razorpay_gateway", razorpay_gateway)
+    yield razorpay_gateway
+    await razorpay_gateway.close()
+
+
+@pytest.fixture
+async def api(db):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test/api") as http:
+        yield http
+
+
+async def pay(gateway, razorpay_order_id: str) -> dict:
+    response = await gateway.client.post(f"/orders/{razorpay_order_id}/pay")
+    response.raise_for_status()
+    return response.json()
+
+
+def auth_headers(user_id: str, role: str = "customer") -> dict:
+    return {"Authorization": f"Bearer {server.create_jwt_token(user_id, f'{user_id}@example.com', role)}"}
+
+
+@pytest.fixture
+def owner_headers():
+    return auth_headers("owner-1", "restaurant_owner")
+
+
+@pytest.fixture
+def customer_headers():
+    return auth_headers("customer-1")
+
+
+@pytest.fixture
+async def restaurant(db):
+    restaurant = server.Restaurant(
+        owner_id="owner-1", name="Spice Route", slug="spice-route", description="North Indian",
+        cuisine_types=["North Indian"], address="MG Road", phone="9800000000", status="active", commission_rate=10.0
+    ).model_dump()
+    await db.restaurants.insert_one(dict(restaurant))
+    return restaurant
+
+
+@pytest.fixture
+async def menu_item(db, restaurant):
+    menu_item = server.MenuItem(
+        restaurant_id=restaurant['id'], name="Paneer Tikka", description="Grilled paneer", category_id="starters",
+        category_name="Starters", image="", is_veg=True, spice_level=2, prep_time=15,
+        variants=[
+            server.MenuItemVariant(name="Full", price=250.0, stock=5),
+            server.MenuItemVariant(name="Half", price=150.0)
+        ]
+    ).model_dump()
+    await db.menu_items.insert_one(dict(menu_item))
+    return menu_item
+
+
+@pytest.fixture
+async def other_menu_item(db):
+    # A second restaurant, with its own commission rate
+    restaurant = server.Restaurant(
+        owner_id="owner-2", name="Dosa Corner", slug="dosa-corner", description="South Indian",
+        cuisine_types=["South Indian"], address="Brigade Road", phone="9800000001", status="active", commission_rate=15.0
+    ).model_dump()
+    await db.restaurants.insert_one(dict(restaurant))
+    menu_item = server.MenuItem(
+        restaurant_id=restaurant['id'], name="Masala Dosa", description="Crisp dosa", category_id="mains",
+        category_name="Mains", image="", is_veg=True, spice_level=1,
+        variants=[server.MenuItemVariant(name="Regular", price=120.0)]
+    ).model_dump()
+    await db.menu_items.insert_one(dict(menu_item))
+    return menu_item
+
+
+async def add_to_cart(api, headers: dict, menu_item: dict, variant_name: str = "Full", quantity: int = 1):
+    response = await api.post("/cart/add", json={"menu_item_id": menu_item['id'], "variant_name": variant_name, "quantity": quantity}, headers=headers)
+    assert response.status_code == 200, response.text
+
+
+async def variant_stock(db, menu_item: dict, variant_name: str = "Full") -> dict:
+    stored = await db.menu_items.find_one({"id": menu_item['id']})
+    return next(variant for variant in stored['variants'] if variant['name'] == variant_name)
+
+
+async def checkout_cart(api, headers: dict, menu_item: dict, variant_name: str = "Full", quantity: int = 1) -> dict:
+    await add_to_cart(api, headers, menu_item, variant_name, quantity)
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def insert_order(collection, restaurant_id: str, user_id: str = "customer-1", total_amount: float = 250.0, **fields) -> dict:
+    order = server.Order(
+        user_id=user_id,
+        restaurant_id=restaurant_id,
+        items=[server.OrderItem(menu_item_id="item-1", menu_item_name="Paneer Tikka", variant_name="Full", quantity=1, price=total_amount, prep_time=15)],
+        **server.split_order_amount(total_amount, 10.0),
+        delivery_address="12 Park Street",
+        prep_minutes=15,
+        **fields
+    )
+    order_doc = server.order_storage_doc(order)
+    await collection.insert_one(dict(order_doc))
+    return order_doc
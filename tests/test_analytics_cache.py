@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def compute(self):
+        self.calls += 1
+        await self.release.wait()
+        return {"total_orders": self.calls}
+
+
+def expire(key: tuple, fresh: bool = True, stale: bool = False):
+    entry = server.analytics_cache._entries[key]
+    if fresh:
+        entry['fresh_until'] = 0
+    if stale:
+        entry['stale_until'] = 0
+
+
+async def test_fresh_results_are_served_from_the_cache(db):
+    counter = Counter()
+
+    first = await server.cached_analytics(("restaurant", "r-1"), "restaurant", counter.compute)
+    second = await server.cached_analytics(("restaurant", "r-1"), "restaurant", counter.compute)
+
+    assert first == second
+    assert first['total_orders'] == 1
+    assert "as_of" in first
+    assert counter.calls == 1
+
+
+async def test_windows_are_cached_separately(db):
+    counter = Counter()
+
+    await server.cached_analytics(("timeseries", "r-1", "day", "2026-03"), "timeseries", counter.compute)
+    await server.cached_analytics(("timeseries", "r-1", "day", "2026-04"), "timeseries", counter.compute)
+
+    assert counter.calls == 2
+
+
+async def test_concurrent_misses_share_one_computation(db):
+    counter = Counter()
+    counter.release.clear()
+
+    waiting = [asyncio.create_task(server.cached_analytics(("admin",), "admin", counter.compute)) for _ in range(3)]
+    await asyncio.sleep(0)
+    counter.release.set()
+    results = await asyncio.gather(*waiting)
+
+    assert counter.calls == 1
+    assert all(result == results[0] for result in results)
+
+
+async def test_stale_result_is_served_while_it_refreshes(db):
+    counter = Counter()
+    key = ("restaurant", "r-1")
+    await server.cached_analytics(key, "restaurant", counter.compute)
+    expire(key)
+
+    stale = await server.cached_analytics(key, "restaurant", counter.compute)
+    await asyncio.sleep(0)
+    refreshed = await server.cached_analytics(key, "restaurant", counter.compute)
+
+    assert stale['total_orders'] == 1
+    assert refreshed['total_orders'] == 2
+
+
+async def test_expired_result_is_recomputed_before_answering(db):
+    counter = Counter()
+    key = ("restaurant", "r-1")
+    await server.cached_analytics(key, "restaurant", counter.compute)
+    expire(key, stale=True)
+
+    result = await server.cached_analytics(key, "restaurant", counter.compute)
+
+    assert result['total_orders'] == 2
@@ -0,0 +1,142 @@
+import pytest
+
+import server
+from tests.conftest import add_to_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_checkout_prices_cart_server_side_and_clears_it(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item, "Full", 2)
+    await add_to_cart(api, customer_headers, menu_item, "Half", 1)
+    # A price change after the item went into the cart is what the order is charged
+    await db.menu_items.update_one({"id": menu_item['id'], "variants.name": "Half"}, {"$set": {"variants.$.price": 175.0}})
+
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['total_amount'] == 675.0
+    order = await db.orders.find_one({"_id": body['order_id']})
+    assert order['user_id'] == "customer-1"
+    assert order['status'] == "pending" and order['payment_status'] == "pending"
+    assert [(item['variant_name'], item['quantity'], item['price']) for item in order['items']] == [("Full", 2, 250.0), ("Half", 1, 175.0)]
+    assert await db.cart_items.count_documents({"user_id": "customer-1"}) == 0
+
+
+async def test_checkout_rejects_empty_cart(api, db, customer_headers):
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 400
+    assert await db.orders.count_documents({}) == 0
+
+
+async def test_checkout_rejects_unavailable_items_and_keeps_cart(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await db.menu_items.update_one({"id": menu_item['id']}, {"$set": {"is_available": False}})
+
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 400
+    assert await db.orders.count_documents({}) == 0
+    assert await db.cart_items.count_documents({"user_id": "customer-1"}) == 1
+
+
+async def test_checkout_rejects_inactive_restaurant(api, db, restaurant, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await db.restaurants.update_one({"id": restaurant['id']}, {"$set": {"status": "suspended"}})
+
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 400
+    assert await db.orders.count_documents({}) == 0
+
+
+async def test_checkout_requires_authentication(api, menu_item):
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"})
+
+    assert response.status_code == 401
+
+
+def test_split_order_amount_is_exact_in_paise():
+    split = server.split_order_amount(333.33, 12.5)
+
+    assert split['total_paise'] == 33333
+    assert split['commission_paise'] == 4167
+    assert split['commission_paise'] + split['restaurant_paise'] == split['total_paise']
+
+
+async def test_multi_restaurant_cart_becomes_one_order_per_restaurant(api, db, menu_item, other_menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item, "Full", 1)
+    await add_to_cart(api, customer_headers, other_menu_item, "Regular", 2)
+
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['order_id'] is None
+    assert len(body['order_ids']) == 2
+    assert body['total_amount'] == 490.0
+
+    orders = {order['restaurant_id']: order for order in await db.orders.find({"checkout_id": body['checkout_id']}).to_list(None)}
+    assert orders[menu_item['restaurant_id']]['total_paise'] == 25000
+    assert orders[menu_item['restaurant_id']]['commission_paise'] == 2500
+    # Each order carries its own restaurant's commission rate
+    assert orders[other_menu_item['restaurant_id']]['total_paise'] == 24000
+    assert orders[other_menu_item['restaurant_id']]['commission_paise'] == 3600
+
+    checkout = await db.checkouts.find_one({"id": body['checkout_id']})
+    assert sorted(checkout['order_ids']) == sorted(body['order_ids'])
+    assert checkout['total_paise'] == 49000
+
+
+async def test_checkout_payment_covers_every_order(api, db, gateway, menu_item, other_menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await add_to_cart(api, customer_headers, other_menu_item, "Regular")
+    checkout = (await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)).json()
+
+    response = await api.post("/payments/create-order", params={"checkout_id": checkout['checkout_id']}, headers=customer_headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()['amount'] == 37000
+    razorpay_order_id = response.json()['razorpay_order_id']
+    orders = await db.orders.find({"checkout_id": checkout['checkout_id']}).to_list(None)
+    assert {order['razorpay_order_id'] for order in orders} == {razorpay_order_id}
+
+    orders, newly_paid = await server.settle_payment(razorpay_order_id, "pay_test")
+
+    assert len(newly_paid) == 2
+    assert all(order['payment_status'] == "paid" for order in await db.orders.find({}).to_list(None))
+    assert (await db.checkouts.find_one({"id": checkout['checkout_id']}))['payment_status'] == "paid"
+
+
+async def test_checkout_lookups_are_indexed(db):
+    await server.create_indexes()
+
+    checkout_indexes = await db.checkouts.index_information()
+    order_indexes = await db.orders.index_information()
+    assert checkout_indexes['id_1']['unique'] is True
+    assert order_indexes['checkout_id_1']['key'] == [("checkout_id", 1)]
+
+
+async def test_paying_one_order_alone_leaves_the_checkout_payable_for_the_rest(api, db, gateway, menu_item, other_menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await add_to_cart(api, customer_headers, other_menu_item, "Regular")
+    checkout = (await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)).json()
+    paid_alone = await db.orders.find_one({"checkout_id": checkout['checkout_id'], "restaurant_id": menu_item['restaurant_id']})
+
+    single = await api.post("/payments/create-order", params={"order_id": paid_alone['_id']}, headers=customer_headers)
+    await server.settle_payment(single.json()['razorpay_order_id'], "pay_single")
+
+    assert (await db.checkouts.find_one({"id": checkout['checkout_id']}))['payment_status'] == "pending"
+
+    rest = await api.post("/payments/create-order", params={"checkout_id": checkout['checkout_id']}, headers=customer_headers)
+
+    assert rest.status_code == 200, rest.text
+    assert rest.json()['amount'] == 12000
+    assert (await db.orders.find_one({"_id": paid_alone['_id']}))['razorpay_order_id'] == single.json()['razorpay_order_id']
+
+    _, newly_paid = await server.settle_payment(rest.json()['razorpay_order_id'], "pay_rest")
+
+    assert [order['restaurant_id'] for order in newly_paid] == [other_menu_item['restaurant_id']]
+    assert (await db.checkouts.find_one({"id": checkout['checkout_id']}))['payment_status'] == "paid"
@@ -0,0 +1,110 @@
+import pytest
+
+import server
+from tests.conftest import add_to_cart, auth_headers, checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def day_stats(db, restaurant_id: str) -> dict:
+    stats = await db.daily_stats.find({"restaurant_id": restaurant_id}, {"_id": 0, "restaurant_id": 0, "date": 0}).to_list(None)
+    assert len(stats) == 1
+    return stats[0]
+
+
+async def test_checkout_and_payment_are_rolled_up(api, db, gateway, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item, "Full", 2)
+    created = await api.post("/payments/create-order", params={"checkout_id": placed['checkout_id']}, headers=customer_headers)
+
+    await server.settle_payment(created.json()['razorpay_order_id'], "pay_1")
+
+    assert await day_stats(db, menu_item['restaurant_id']) == {
+        "orders": 1,
+        "paid_orders": 1,
+        "revenue_paise": 50000,
+        "restaurant_revenue_paise": 45000,
+        "commission_paise": 5000
+    }
+
+
+async def test_cancellation_is_counted_once(api, db, menu_item, customer_headers, owner_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    url = f"/restaurants/{menu_item['restaurant_id']}/orders/{placed['order_id']}/status"
+
+    first = await api.put(url, params={"status": "cancelled"}, headers=owner_headers)
+    retry = await api.put(url, params={"status": "cancelled"}, headers=owner_headers)
+
+    assert (first.status_code, retry.status_code) == (200, 409)
+    assert (await day_stats(db, menu_item['restaurant_id']))['cancellations'] == 1
+
+
+
+def paid(order_id: str, total_paise: int) -> dict:
+    return {"id": order_id, **server.split_order_amount(total_paise / 100, 10.0)}
+
+
+def test_named_refunds_go_to_their_order_and_the_rest_is_spread():
+    orders = [paid("order-1", 30000), paid("order-2", 10000)]
+    named = {"amount": 5000, "order_id": "order-2"}
+
+    assert server.allocate_refunds(orders, [named]) == {"order-1": 0, "order-2": 5000}
+    # Spread over what each order has left (30000 and 5000); the odd paisa goes to the larger remainder
+    assert server.allocate_refunds(orders, [named, {"amount": 1000}]) == {"order-1": 857, "order-2": 5143}
+    # Never more than was paid
+    assert server.allocate_refunds(orders, [{"amount": 90000, "order_id": "order-1"}]) == {"order-1": 30000, "order-2": 10000}
+
+
+def refund_event(refund_id: str, payment_id: str, amount: int, order_id=None) -> dict:
+    notes = {"order_id": order_id} if order_id else {}
+    return {"event": "refund.processed", "payload": {"refund": {"entity": {"id": refund_id, "payment_id": payment_id, "amount": amount, "notes": notes}}}}
+
+
+@pytest.fixture
+async def paid_checkout(api, db, gateway, menu_item, other_menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await add_to_cart(api, customer_headers, other_menu_item, "Regular")
+    placed = (await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)).json()
+    created = await api.post("/payments/create-order", params={"checkout_id": placed['checkout_id']}, headers=customer_headers)
+    await server.settle_payment(created.json()['razorpay_order_id'], "pay_1")
+    return {order['restaurant_id']: order for order in await db.orders.find({}).to_list(None)}
+
+
+async def test_refund_is_attributed_to_its_order_and_netted_in_the_rollup(db, paid_checkout, menu_item):
+    order = paid_checkout[menu_item['restaurant_id']]
+
+    await server.handle_refund_processed(refund_event("rfnd_1", "pay_1", 10000, order['_id']))
+    # A redelivered webhook changes nothing
+    await server.handle_refund_processed(refund_event("rfnd_1", "pay_1", 10000, order['_id']))
+
+    stored = await db.orders.find_one({"_id": order['_id']})
+    assert (stored['payment_status'], stored['refunded_paise']) == ("partially_refunded", 10000)
+    assert (await db.checkouts.find_one({}))['payment_status'] == "partially_refunded"
+    stats = await day_stats(db, menu_item['restaurant_id'])
+    # 10% commission: 1000 of the 10000 refunded comes back out of commission
+    assert (stats['refunded_paise'], stats['commission_refunded_paise'], stats['restaurant_refunded_paise']) == (10000, 1000, 9000)
+
+
+async def test_refund_without_an_order_is_spread_over_the_payment(db, paid_checkout, menu_item, other_menu_item):
+    await server.handle_refund_processed(refund_event("rfnd_1", "pay_1", 37000))
+
+    for restaurant_id, order in paid_checkout.items():
+        stored = await db.orders.find_one({"_id": order['_id']})
+        assert (stored['payment_status'], stored['refunded_paise']) == ("refunded", order['total_paise'])
+        assert (await day_stats(db, restaurant_id))['refunded_paise'] == order['total_paise']
+    assert (await db.checkouts.find_one({}))['payment_status'] == "refunded"
+
+
+async def test_analytics_report_revenue_net_of_refunds(api, db, paid_checkout, menu_item, owner_headers):
+    await server.handle_refund_processed(refund_event("rfnd_1", "pay_1", 10000, paid_checkout[menu_item['restaurant_id']]['_id']))
+
+    restaurant = await api.get(f"/restaurants/{menu_item['restaurant_id']}/analytics", headers=owner_headers)
+    admin = await api.get("/admin/analytics", headers=auth_headers("admin-1", "super_admin"))
+
+    assert restaurant.status_code == 200, restaurant.text
+    # 22500 restaurant share, less the 9000 share of the refund
+    assert restaurant.json()['total_revenue'] == 135.0
+    assert restaurant.json()['completed_orders'] == 1
+    assert admin.status_code == 200, admin.text
+    assert admin.json()['total_revenue'] == 270.0
+    # 2500 + 1800 commission, less 1000 given back
+    assert admin.json()['total_commission'] == 33.0
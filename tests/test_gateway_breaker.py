@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import server
+import stub_gateway
+from tests.conftest import checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def succeed():
+    return {"ok": True}
+
+
+async def fail():
+    raise server.PaymentGatewayError("gateway returned 503", 503)
+
+
+async def reject_client_error():
+    raise server.PaymentGatewayError("gateway returned 400", 400)
+
+
+@pytest.fixture
+def breaker(db, monkeypatch):
+    monkeypatch.setattr(server, "GATEWAY_CIRCUIT_MIN_CALLS", 4)
+    return server.CircuitBreaker("test")
+
+
+async def trip(breaker):
+    for _ in range(4):
+        with pytest.raises(server.PaymentGatewayError):
+            await breaker.call("test", fail)
+
+
+def let_open_period_pass(breaker):
+    breaker.opened_at -= server.GATEWAY_CIRCUIT_OPEN_SECONDS
+
+
+async def test_breaker_opens_when_most_calls_fail_and_then_rejects_without_calling(breaker):
+    calls = []
+
+    async def counted():
+        calls.append(1)
+        return await succeed()
+
+    await breaker.call("test", counted)
+    await trip(breaker)
+
+    assert breaker.state == "open"
+    with pytest.raises(server.GatewayUnavailableError) as rejected:
+        await breaker.call("test", counted)
+    assert rejected.value.status_code == 503
+    assert 1 <= rejected.value.retry_after <= server.GATEWAY_CIRCUIT_OPEN_SECONDS + 1
+    assert len(calls) == 1
+
+
+async def test_client_errors_do_not_trip_the_breaker(breaker):
+    for _ in range(6):
+        with pytest.raises(server.PaymentGatewayError):
+            await breaker.call("test", reject_client_error)
+
+    assert breaker.state == "closed"
+
+
+async def test_half_open_probes_close_the_breaker_once_they_succeed(breaker):
+    await trip(breaker)
+    let_open_period_pass(breaker)
+
+    for _ in range(server.GATEWAY_CIRCUIT_HALF_OPEN_CALLS):
+        await breaker.call("test", succeed)
+
+    assert breaker.state == "closed"
+
+
+async def test_failed_probe_reopens_the_breaker(breaker):
+    await trip(breaker)
+    let_open_period_pass(breaker)
+
+    with pytest.raises(server.PaymentGatewayError):
+        await breaker.call("test", fail)
+
+    assert breaker.state == "open"
+    with pytest.raises(server.GatewayUnavailableError):
+        await breaker.call("test", succeed)
+
+
+async def test_half_open_admits_only_a_few_probes_at_once(breaker):
+    await trip(breaker)
+    let_open_period_pass(breaker)
+    release = asyncio.Event()
+
+    async def slow_probe():
+        await release.wait()
+        return {"ok": True}
+
+    probes = [asyncio.create_task(breaker.call("test", slow_probe)) for _ in range(server.GATEWAY_CIRCUIT_HALF_OPEN_CALLS)]
+    await asyncio.sleep(0)
+
+    assert breaker.state == "half_open"
+    with pytest.raises(server.GatewayUnavailableError):
+        await breaker.call("test", succeed)
+    release.set()
+    await asyncio.gather(*probes)
+    assert breaker.state == "closed"
+
+
+async def test_bulkhead_rejects_calls_beyond_its_slots(db, monkeypatch):
+    monkeypatch.setattr(server, "GATEWAY_MAX_CONCURRENT_CALLS", 1)
+    monkeypatch.setattr(server, "GATEWAY_BULKHEAD_WAIT_SECONDS", 0.05)
+    breaker = server.CircuitBreaker("test")
+    release = asyncio.Event()
+
+    async def hold_slot():
+        await release.wait()
+        return {"ok": True}
+
+    holder = asyncio.create_task(breaker.call("test", hold_slot))
+    await asyncio.sleep(0)
+
+    with pytest.raises(server.GatewayUnavailableError, match="bulkhead_full"):
+        await breaker.call("test", succeed)
+    release.set()
+    assert await holder == {"ok": True}
+    # Rejections never reached the gateway, so they do not count against it
+    assert breaker.state == "closed"
+    assert await breaker.call("test", succeed) == {"ok": True}
+
+
+async def test_open_breaker_fails_payment_creation_fast(api, db, gateway, menu_item, customer_headers, monkeypatch):
+    monkeypatch.setattr(server, "GATEWAY_CIRCUIT_MIN_CALLS", 2)
+    monkeypatch.setattr(server, "RAZORPAY_RETRY_BASE_DELAY", 0)
+    monkeypatch.setitem(stub_gateway.settings, "failure_rate", 1.0)
+    placed = await checkout_cart(api, customer_headers, menu_item)
+
+    failures = [await api.post("/payments/create-order", params={"order_id": placed['order_id']}, headers=customer_headers) for _ in range(2)]
+    rejected = await api.post("/payments/create-order", params={"order_id": placed['order_id']}, headers=customer_headers)
+
+    assert [response.status_code for response in failures] == [500, 500]
+    assert rejected.status_code == 503
+    assert int(rejected.headers["Retry-After"]) >= 1
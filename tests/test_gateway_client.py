@@ -0,0 +1,63 @@
+import pytest
+
+import server
+import stub_gateway
+from tests.conftest import pay
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def attempts(gateway, monkeypatch):
+    monkeypatch.setattr(server, "RAZORPAY_RETRY_BASE_DELAY", 0)
+    sent = []
+
+    async def count(request):
+        sent.append(request.url.path)
+
+    gateway.client.event_hooks['request'].append(count)
+    return sent
+
+
+async def test_orders_are_created_and_fetched_through_the_pool(gateway):
+    created = await gateway.create_order(25000, receipt="order-1")
+    fetched = await gateway.fetch_order(created['id'])
+
+    assert (fetched['id'], fetched['amount'], fetched['receipt']) == (created['id'], 25000, "order-1")
+    assert await gateway.fetch_order_payments(created['id']) == []
+
+
+async def test_reads_are_retried_on_gateway_errors(gateway, attempts, monkeypatch):
+    monkeypatch.setitem(stub_gateway.settings, "failure_rate", 1.0)
+
+    with pytest.raises(server.PaymentGatewayError) as failure:
+        await gateway.fetch_order("order_missing")
+
+    assert failure.value.status_code == 503
+    assert len(attempts) == server.RAZORPAY_MAX_RETRIES + 1
+
+
+async def test_writes_are_not_retried_once_sent(gateway, attempts, monkeypatch):
+    monkeypatch.setitem(stub_gateway.settings, "failure_rate", 1.0)
+
+    with pytest.raises(server.PaymentGatewayError):
+        await gateway.create_order(25000)
+
+    assert len(attempts) == 1
+
+
+async def test_client_errors_are_not_retried(gateway, attempts):
+    with pytest.raises(server.PaymentGatewayError) as failure:
+        await gateway.fetch_order("order_missing")
+
+    assert failure.value.status_code == 404
+    assert len(attempts) == 1
+
+
+async def test_payment_signature_matches_the_gateway_s(gateway):
+    created = await gateway.create_order(25000)
+    paid = await pay(gateway, created['id'])
+
+    assert gateway.verify_payment_signature(paid['razorpay_order_id'], paid['razorpay_payment_id'], paid['razorpay_signature'])
+    assert not gateway.verify_payment_signature(paid['razorpay_order_id'], "pay_other", paid['razorpay_signature'])
+
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+import stub_gateway
+from tests.conftest import checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def placed(api, menu_item, customer_headers):
+    return await checkout_cart(api, customer_headers, menu_item)
+
+
+async def create_gateway_order(api, headers: dict, order_id: str):
+    response = await api.post("/payments/create-order", params={"order_id": order_id}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()['razorpay_order_id']
+
+
+async def test_stored_gateway_order_is_reused(api, db, gateway, placed, customer_headers):
+    first = await create_gateway_order(api, customer_headers, placed['order_id'])
+    second = await create_gateway_order(api, customer_headers, placed['order_id'])
+
+    assert first == second
+    assert len(stub_gateway.orders) == 1
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert (order['razorpay_order_amount'], order['razorpay_order_currency']) == (25000, "INR")
+
+
+async def test_concurrent_requests_create_one_gateway_order(api, gateway, placed, customer_headers):
+    ids = await asyncio.gather(*[create_gateway_order(api, customer_headers, placed['order_id']) for _ in range(3)])
+
+    assert len(set(ids)) == 1
+    assert len(stub_gateway.orders) == 1
+
+
+async def test_expired_gateway_order_is_replaced(api, db, gateway, placed, customer_headers):
+    first = await create_gateway_order(api, customer_headers, placed['order_id'])
+    await db.orders.update_one({"_id": placed['order_id']}, {"$set": {"razorpay_order_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+    second = await create_gateway_order(api, customer_headers, placed['order_id'])
+
+    assert second != first
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert order['razorpay_order_id'] == second
+    assert order['gateway_order_ids'] == [first, second]
+
+
+async def test_gateway_order_for_another_amount_is_replaced(api, db, gateway, placed, customer_headers):
+    first = await create_gateway_order(api, customer_headers, placed['order_id'])
+    await db.orders.update_one({"_id": placed['order_id']}, {"$set": {"razorpay_order_amount": 20000}})
+
+    second = await create_gateway_order(api, customer_headers, placed['order_id'])
+
+    assert second != first
+    assert (await db.orders.find_one({"_id": placed['order_id']}))['razorpay_order_amount'] == 25000
+
+
+async def test_late_capture_on_a_replaced_gateway_order_still_pays(api, db, gateway, placed, customer_headers):
+    first = await create_gateway_order(api, customer_headers, placed['order_id'])
+    await db.orders.update_one({"_id": placed['order_id']}, {"$set": {"razorpay_order_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    await create_gateway_order(api, customer_headers, placed['order_id'])
+
+    _, newly_paid = await server.settle_payment(first, "pay_late")
+
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert [paid['id'] for paid in newly_paid] == [placed['order_id']]
+    assert (order['payment_status'], order['razorpay_order_id']) == ("paid", first)
+
+
+async def test_lock_left_by_a_dead_request_is_taken_over(api, db, gateway, placed, customer_headers):
+    await db.orders.update_one({"_id": placed['order_id']}, {"$set": {
+        "gateway_order_lock_owner": "dead-request",
+        "gateway_order_lock_until": datetime.now(timezone.utc) - timedelta(seconds=1)
+    }})
+
+    razorpay_order_id = await create_gateway_order(api, customer_headers, placed['order_id'])
+
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert order['razorpay_order_id'] == razorpay_order_id
+    assert "gateway_order_lock_owner" not in order
+
+
+async def test_failed_creation_releases_the_lock(api, db, gateway, placed, customer_headers, monkeypatch):
+    monkeypatch.setitem(stub_gateway.settings, "failure_rate", 1.0)
+
+    response = await api.post("/payments/create-order", params={"order_id": placed['order_id']}, headers=customer_headers)
+
+    assert response.status_code == 500
+    assert "gateway_order_lock_owner" not in await db.orders.find_one({"_id": placed['order_id']})
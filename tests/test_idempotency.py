@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import add_to_cart, auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def checkout(api, headers: dict, key: str, address: str = "12 Park Street"):
+    return await api.post("/orders/checkout", json={"delivery_address": address}, headers={**headers, "Idempotency-Key": key})
+
+
+async def test_retried_checkout_replays_the_first_response(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+
+    first = await checkout(api, customer_headers, "key-1")
+    retry = await checkout(api, customer_headers, "key-1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert await db.orders.count_documents({}) == 1
+
+
+async def test_concurrent_duplicates_create_one_order(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+
+    responses = await asyncio.gather(*[checkout(api, customer_headers, "key-1") for _ in range(3)])
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert len({response.json()['checkout_id'] for response in responses}) == 1
+    assert await db.orders.count_documents({}) == 1
+
+
+async def test_key_reused_for_a_different_request_is_rejected(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item)
+    await checkout(api, customer_headers, "key-1")
+
+    response = await checkout(api, customer_headers, "key-1", address="99 Other Road")
+
+    assert response.status_code == 422
+    assert await db.orders.count_documents({}) == 1
+
+
+async def test_keys_are_scoped_per_user(api, db, menu_item, customer_headers):
+    other_headers = auth_headers("customer-2")
+    await add_to_cart(api, customer_headers, menu_item)
+    await add_to_cart(api, other_headers, menu_item)
+
+    first = await checkout(api, customer_headers, "key-1")
+    second = await checkout(api, other_headers, "key-1")
+
+    assert first.json()['checkout_id'] != second.json()['checkout_id']
+    assert await db.orders.count_documents({}) == 2
+
+
+async def test_failed_request_frees_its_key_for_a_retry(api, db, menu_item, customer_headers):
+    failed = await checkout(api, customer_headers, "key-1")
+    await add_to_cart(api, customer_headers, menu_item)
+
+    retry = await checkout(api, customer_headers, "key-1")
+
+    assert failed.status_code == 400
+    assert retry.status_code == 200
+    assert await db.orders.count_documents({}) == 1
+
+
+async def test_key_abandoned_by_a_dead_request_is_taken_over(db):
+    record_id = "orders.checkout:customer-1:key-1"
+    request = {"delivery_address": "12 Park Street"}
+    await db.idempotency_keys.insert_one({
+        "_id": record_id,
+        "status": "in_progress",
+        "fingerprint": server.request_fingerprint(request),
+        "owner": "dead-worker",
+        "locked_until": datetime.now(timezone.utc) - timedelta(seconds=1),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=1)
+    })
+
+    async def handler():
+        return {"checkout_id": "checkout-1"}
+
+    response = await server.run_idempotent("key-1", "customer-1", "orders.checkout", request, handler)
+
+    record = await db.idempotency_keys.find_one({"_id": record_id})
+    assert response == {"checkout_id": "checkout-1"}
+    assert record['status'] == "completed"
+    assert record['owner'] != "dead-worker"
+
+
+async def test_lock_is_renewed_while_the_handler_runs(db, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    record_id = "orders.checkout:customer-1:key-1"
+    seen = []
+
+    async def handler():
+        for _ in range(3):
+            await asyncio.sleep(0.15)
+            seen.append((await db.idempotency_keys.find_one({"_id": record_id}))['locked_until'])
+        return {"ok": True}
+
+    started = datetime.now(timezone.utc)
+    await server.run_idempotent("key-1", "customer-1", "orders.checkout", {}, handler)
+
+    # Without renewal the lock would have lapsed 0.3s after the request started
+    assert seen[-1] > started + timedelta(seconds=0.4)
+
+
+async def test_request_that_lost_its_key_does_not_overwrite_the_new_owner(db, caplog):
+    record_id = "orders.checkout:customer-1:key-1"
+
+    async def handler():
+        # Another worker took the key over while this handler was stuck
+        await db.idempotency_keys.update_one({"_id": record_id}, {"$set": {"owner": "other-worker"}})
+        return {"checkout_id": "stale"}
+
+    await server.run_idempotent("key-1", "customer-1", "orders.checkout", {}, handler)
+
+    record = await db.idempotency_keys.find_one({"_id": record_id})
+    assert record['status'] == "in_progress"
+    assert "response" not in record
+    assert "taken over" in caplog.text
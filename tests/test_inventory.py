@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import add_to_cart, auth_headers, checkout_cart, variant_stock
+
+pytestmark = pytest.mark.anyio
+
+
+async def age_orders(db, **age):
+    then = datetime.now(timezone.utc) - timedelta(**age)
+    await db.orders.update_many({}, {"$set": {"created_at": then, "updated_at": then}})
+
+
+async def test_checkout_reserves_stock_and_sells_out_at_zero(api, db, menu_item, customer_headers):
+    await checkout_cart(api, customer_headers, menu_item, "Full", 5)
+
+    full = await variant_stock(db, menu_item)
+    assert (full['stock'], full['available'], full['sold_out']) == (0, False, True)
+    # Untracked variants are never reserved
+    assert (await variant_stock(db, menu_item, "Half")).get('stock') is None
+    order = await db.orders.find_one({})
+    assert order['reserved_stock'] == [{"menu_item_id": menu_item['id'], "menu_item_name": "Paneer Tikka", "variant_name": "Full", "quantity": 5}]
+
+
+async def test_checkout_for_more_than_is_left_is_rejected(api, db, menu_item, customer_headers):
+    await add_to_cart(api, customer_headers, menu_item, "Full", 6)
+
+    response = await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers)
+
+    assert response.status_code == 409
+    # The test session cannot roll back the rest of the checkout transaction, so only stock is checked
+    assert (await variant_stock(db, menu_item))['stock'] == 5
+
+
+async def test_concurrent_checkouts_cannot_oversell(api, db, menu_item):
+    headers = [auth_headers(f"customer-{index}") for index in range(2)]
+    for customer_headers in headers:
+        await add_to_cart(api, customer_headers, menu_item, "Full", 3)
+
+    responses = await asyncio.gather(*[
+        api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=customer_headers) for customer_headers in headers
+    ])
+
+    assert sorted(response.status_code for response in responses) == [200, 409]
+    assert (await variant_stock(db, menu_item))['stock'] == 2
+
+
+async def test_cancelled_order_gives_its_stock_back_once(api, db, menu_item, customer_headers, owner_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item, "Full", 5)
+
+    await api.put(f"/restaurants/{menu_item['restaurant_id']}/orders/{placed['order_id']}/status", params={"status": "cancelled"}, headers=owner_headers)
+    await server.release_order_stock([placed['order_id']])
+
+    full = await variant_stock(db, menu_item)
+    assert (full['stock'], full['available'], full['sold_out']) == (5, True, False)
+
+
+async def test_owner_switching_a_variant_off_is_not_overridden_by_a_release(api, db, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item, "Full", 2)
+    await db.menu_items.update_one({"id": menu_item['id'], "variants.name": "Full"}, {"$set": {"variants.$.available": False}})
+
+    await server.release_order_stock([placed['order_id']])
+
+    full = await variant_stock(db, menu_item)
+    assert (full['stock'], full['available']) == (5, False)
+
+
+async def test_abandoned_payment_releases_stock_when_it_expires(api, db, gateway, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item, "Full", 2)
+    created = await api.post("/payments/create-order", params={"order_id": placed['order_id']}, headers=customer_headers)
+    await server.handle_payment_failed({"payload": {"payment": {"entity": {"id": "pay_1", "order_id": created.json()['razorpay_order_id']}}}})
+    await age_orders(db, hours=25)
+
+    await server.reconcile_payments()
+
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert (order['payment_status'], order['status'], order['stock_released']) == ("expired", "cancelled", True)
+    assert (await variant_stock(db, menu_item))['stock'] == 5
+
+
+async def test_checkout_abandoned_before_payment_releases_stock(api, db, menu_item, customer_headers):
+    await checkout_cart(api, customer_headers, menu_item, "Full", 2)
+    await age_orders(db, hours=25)
+
+    await server.reconcile_payments()
+
+    assert (await variant_stock(db, menu_item))['stock'] == 5
+
+
+async def test_direct_order_is_priced_and_reserved_like_a_checkout(api, db, menu_item, customer_headers):
+    response = await api.post("/orders/create", json={
+        "restaurant_id": menu_item['restaurant_id'],
+        "delivery_address": "12 Park Street",
+        "items": [{"menu_item_id": menu_item['id'], "menu_item_name": "Paneer Tikka", "variant_name": "Full", "quantity": 2, "price": 1.0}],
+        "total_amount": 2.0
+    }, headers=customer_headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()['total_amount'] == 500.0
+    assert (await variant_stock(db, menu_item))['stock'] == 3
+    assert await db.outbox.count_documents({"topic": "order.created"}) == 1
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import add_to_cart, auth_headers, checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def limit_kitchen(db, restaurant: dict, **limits):
+    await db.restaurants.update_one({"id": restaurant['id']}, {"$set": limits})
+    server.invalidate_restaurant_cache(restaurant['id'])
+    return {**restaurant, **limits}
+
+
+async def try_checkout(api, menu_item, customer_id: str):
+    headers = auth_headers(customer_id)
+    await add_to_cart(api, headers, menu_item)
+    return await api.post("/orders/checkout", json={"delivery_address": "12 Park Street"}, headers=headers)
+
+
+async def confirm(api, owner_headers, restaurant_id: str, order_id: str):
+    response = await api.put(f"/restaurants/{restaurant_id}/orders/{order_id}/status", params={"status": "confirmed"}, headers=owner_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_full_kitchen_turns_orders_away_with_a_wait(api, db, restaurant, menu_item, owner_headers):
+    await limit_kitchen(db, restaurant, max_active_orders=1)
+    first = await try_checkout(api, menu_item, "customer-1")
+    await confirm(api, owner_headers, restaurant['id'], first.json()['order_id'])
+
+    rejected = await try_checkout(api, menu_item, "customer-2")
+
+    assert rejected.status_code == 503
+    detail = rejected.json()['detail']
+    assert (detail['code'], detail['restaurant_id']) == ("restaurant_busy", restaurant['id'])
+    # The confirmed order needs 15 minutes on a free station
+    assert detail['suggested_wait_minutes'] == 15
+    assert rejected.headers["Retry-After"] == "900"
+
+
+async def test_unpaid_orders_hold_their_slot(api, db, restaurant, menu_item):
+    await limit_kitchen(db, restaurant, max_active_orders=1)
+
+    first = await try_checkout(api, menu_item, "customer-1")
+    second = await try_checkout(api, menu_item, "customer-2")
+
+    assert (first.status_code, second.status_code) == (200, 503)
+    assert second.json()['detail']['suggested_wait_minutes'] == server.KITCHEN_PENDING_HOLD_MINUTES
+
+
+async def test_lapsed_hold_frees_the_slot(api, db, restaurant, menu_item):
+    await limit_kitchen(db, restaurant, max_active_orders=1)
+    await try_checkout(api, menu_item, "customer-1")
+    # The unpaid order was placed long enough ago for its hold to lapse
+    await db.orders.update_many({}, {"$set": {"created_at": datetime.now(timezone.utc) - timedelta(minutes=server.KITCHEN_PENDING_HOLD_MINUTES + 1)}})
+    server.kitchen_queue._kitchens.clear()
+
+    response = await try_checkout(api, menu_item, "customer-2")
+
+    assert response.status_code == 200, response.text
+
+
+async def test_cancelling_frees_the_slot(api, db, restaurant, menu_item, owner_headers):
+    await limit_kitchen(db, restaurant, max_active_orders=1)
+    first = await try_checkout(api, menu_item, "customer-1")
+    await api.put(f"/restaurants/{restaurant['id']}/orders/{first.json()['order_id']}/status", params={"status": "cancelled"}, headers=owner_headers)
+
+    response = await try_checkout(api, menu_item, "customer-2")
+
+    assert response.status_code == 200, response.text
+
+
+async def test_queued_prep_time_limits_the_kitchen(api, db, restaurant, menu_item, owner_headers):
+    limited = await limit_kitchen(db, restaurant, max_queue_prep_minutes=20)
+    first = await try_checkout(api, menu_item, "customer-1")
+    await confirm(api, owner_headers, restaurant['id'], first.json()['order_id'])
+
+    rejected = await try_checkout(api, menu_item, "customer-2")
+
+    assert rejected.status_code == 503
+    # 15 queued + 15 incoming is 10 over the limit, worked off by 2 stations
+    assert rejected.json()['detail']['suggested_wait_minutes'] == 5
+    status = server.kitchen_queue.status(limited)
+    assert (status['active_orders'], status['pending_orders'], status['queued_prep_minutes']) == (1, 0, 15)
+
+
+async def test_confirmed_order_gets_an_eta(api, db, restaurant, menu_item, customer_headers, owner_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+
+    confirmed = await confirm(api, owner_headers, restaurant['id'], placed['order_id'])
+    fetched = await api.get(f"/orders/{placed['order_id']}", headers=customer_headers)
+
+    eta = datetime.fromisoformat(confirmed['eta'])
+    assert timedelta(minutes=14) < eta - datetime.now(timezone.utc) <= timedelta(minutes=15)
+    assert fetched.json()['eta'] == confirmed['eta']
+
+
+async def test_eta_does_not_change_the_queue(api, db, restaurant, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    await server.kitchen_queue.refresh([restaurant['id']])
+    # Confirmed by another worker: this worker has not seen it yet
+    order = server.order_out({**await db.orders.find_one({"_id": placed['order_id']}), "status": "confirmed"})
+    kitchen = server.kitchen_queue._kitchens[restaurant['id']]
+    before = (dict(kitchen['orders']), dict(kitchen['held']))
+
+    assert server.kitchen_queue.eta(restaurant, order) is None
+    assert server.kitchen_queue.eta(restaurant, {**order, "status": "pending"}) is None
+    assert (dict(kitchen['orders']), dict(kitchen['held'])) == before
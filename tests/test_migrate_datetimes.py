@@ -0,0 +1,65 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import migrate_datetimes
+
+pytestmark = pytest.mark.anyio
+
+PLACED_AT = datetime(2025, 11, 3, 9, 30, tzinfo=timezone.utc)
+
+
+def legacy_order(order_id: str) -> dict:
+    return {
+        "_id": order_id,
+        "created_at": "2025-11-03T09:30:00",
+        "updated_at": "2025-11-03T15:00:00+05:30",
+        "status_history": [{"status": "confirmed", "at": "2025-11-03T09:35:00Z"}]
+    }
+
+
+@pytest.fixture
+def migration_db(db, monkeypatch):
+    monkeypatch.setattr(migrate_datetimes, "db", db)
+    return db
+
+
+async def test_orders_and_their_archives_are_converted(migration_db):
+    await migration_db.orders.insert_one(legacy_order("order-1"))
+    await migration_db.orders_archive_202511.insert_one(legacy_order("order-2"))
+    await migration_db.orders_archive_notes.insert_one(legacy_order("order-3"))
+
+    await migrate_datetimes.migrate(["orders"], batch_size=10, dry_run=False)
+
+    for collection in (migration_db.orders, migration_db.orders_archive_202511):
+        order = await collection.find_one({})
+        assert order['created_at'] == PLACED_AT
+        assert order['updated_at'] == PLACED_AT.replace(hour=9, minute=30)
+        assert order['status_history'][0]['at'] == PLACED_AT.replace(minute=35)
+    # Only monthly archives are orders
+    assert (await migration_db.orders_archive_notes.find_one({}))['created_at'] == "2025-11-03T09:30:00"
+    checkpoint = await migration_db.migrations.find_one({"_id": "datetimes:orders_archive_202511"})
+    assert checkpoint['completed'] is True
+
+
+async def test_dry_run_leaves_archives_untouched(migration_db):
+    await migration_db.orders_archive_202511.insert_one(legacy_order("order-1"))
+
+    await migrate_datetimes.migrate(["orders"], batch_size=10, dry_run=True)
+
+    assert (await migration_db.orders_archive_202511.find_one({}))['created_at'] == "2025-11-03T09:30:00"
+    assert await migration_db.migrations.count_documents({}) == 0
+
+
+async def test_interrupted_run_resumes_after_its_checkpoint(migration_db):
+    await migration_db.orders.insert_many([legacy_order(f"order-{index}") for index in range(3)])
+    # A previous run converted order-0 and stopped
+    await migration_db.orders.update_one({"_id": "order-0"}, {"$set": {"created_at": PLACED_AT}})
+    await migration_db.migrations.insert_one({"_id": "datetimes:orders", "last_id": "order-0", "converted": 1})
+
+    await migrate_datetimes.migrate_collection("orders", migrate_datetimes.DATETIME_FIELDS["orders"], batch_size=1, dry_run=False)
+
+    orders = await migration_db.orders.find({}).sort("_id", 1).to_list(None)
+    assert [order['created_at'] for order in orders[1:]] == [PLACED_AT, PLACED_AT]
+    # order-0 was skipped, so its other string fields are left for the next full pass
+    assert orders[0]['updated_at'] == "2025-11-03T15:00:00+05:30"
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import insert_order
+
+pytestmark = pytest.mark.anyio
+
+
+def days_ago(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+async def test_old_finished_orders_move_to_their_month(db, restaurant):
+    old = await insert_order(db.orders, restaurant['id'], status="delivered", updated_at=days_ago(100))
+    recent = await insert_order(db.orders, restaurant['id'], status="delivered", updated_at=days_ago(1))
+    open_order = await insert_order(db.orders, restaurant['id'], status="preparing", updated_at=days_ago(100))
+
+    assert await server.archive_orders() == 1
+
+    month = server.archive_collection_name(old['created_at'])
+    assert [order['_id'] for order in await db[month].find({}).to_list(None)] == [old['_id']]
+    assert sorted(order['_id'] for order in await db.orders.find({}).to_list(None)) == sorted([recent['_id'], open_order['_id']])
+    assert await server.archived_order_months("user:customer-1") == {month}
+    assert await server.archived_order_months(f"restaurant:{restaurant['id']}") == {month}
+
+
+async def test_archived_orders_are_still_found(api, db, restaurant, customer_headers):
+    old = await insert_order(db.orders, restaurant['id'], status="delivered", updated_at=days_ago(100))
+    await server.archive_orders()
+
+    response = await api.get(f"/orders/{old['_id']}", headers=customer_headers)
+    history = await api.get("/orders", headers=customer_headers)
+
+    assert response.status_code == 200
+    assert response.json()['id'] == old['_id']
+    assert [order['id'] for order in history.json()] == [old['_id']]
+
+
+async def test_history_only_searches_the_owner_s_months(api, db, restaurant, customer_headers):
+    # An indexed month that does not list this customer is never read, even if it holds their order
+    await server.ensure_archive_collection("orders_archive_202001")
+    await insert_order(db.orders_archive_202001, restaurant['id'], created_at=datetime(2020, 1, 5, tzinfo=timezone.utc))
+    # A month archived before the index existed is searched until the archiver indexes it
+    legacy = await insert_order(db.orders_archive_201912, restaurant['id'], created_at=datetime(2019, 12, 5, tzinfo=timezone.utc))
+    server._archive_collections_cache.clear()
+
+    response = await api.get("/orders", headers=customer_headers)
+
+    assert [order['id'] for order in response.json()] == [legacy['_id']]
+
+
+async def test_archiver_indexes_one_legacy_month_per_run(db, restaurant):
+    await insert_order(db.orders_archive_201911, restaurant['id'], created_at=datetime(2019, 11, 5, tzinfo=timezone.utc))
+    await insert_order(db.orders_archive_201912, restaurant['id'], user_id="customer-2", created_at=datetime(2019, 12, 5, tzinfo=timezone.utc))
+
+    await server.archive_orders()
+
+    assert await server.list_indexed_archives() == {"orders_archive_201912"}
+    assert await server.archived_order_months("user:customer-2") == {"orders_archive_201912"}
+
+    await server.archive_orders()
+
+    assert await server.list_indexed_archives() == {"orders_archive_201911", "orders_archive_201912"}
+    assert await server.archived_order_months("user:customer-1") == {"orders_archive_201911"}
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import server
+from tests.conftest import checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+def event_order(order_id: str, status: str) -> dict:
+    return {"id": order_id, "restaurant_id": "restaurant-1", "status": status, "payment_status": "pending"}
+
+
+def parse_frame(frame: str) -> tuple:
+    fields = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return fields['id'], json.loads(fields['data'])['status']
+
+
+async def test_stream_replays_events_after_last_event_id_then_goes_live(db):
+    for status in ["confirmed", "preparing", "out_for_delivery"]:
+        await server.order_events.publish("order.status_changed", event_order("order-1", status))
+    body = server.order_event_stream("order:order-1", "1").body_iterator
+
+    replayed = [parse_frame(await anext(body)) for _ in range(2)]
+    await server.order_events.publish("order.status_changed", event_order("order-1", "delivered"))
+    live = parse_frame(await anext(body))
+    await body.aclose()
+
+    assert replayed == [("2", "preparing"), ("3", "out_for_delivery")]
+    assert live == ("4", "delivered")
+
+
+async def test_replay_only_returns_the_channel_s_events(db):
+    await server.order_events.publish("order.status_changed", event_order("order-1", "confirmed"))
+    await server.order_events.publish("order.status_changed", event_order("order-2", "confirmed"))
+
+    replayed = await server.order_events.replay("order:order-2", "0")
+
+    assert [event['order_id'] for _, event in replayed] == ["order-2"]
+    assert [event_id for event_id, _ in await server.order_events.replay("restaurant:restaurant-1", "0")] == ["1", "2"]
+    assert await server.order_events.replay("order:order-2", "not-an-id") == []
+
+
+async def test_mongo_backend_replays_from_the_stored_events(db):
+    bus = server.OrderEventBus("mongo")
+    await bus.publish("order.status_changed", event_order("order-1", "confirmed"))
+    await bus.publish("order.status_changed", event_order("order-1", "preparing"))
+    first_id = str((await db.order_events.find_one({}, sort=[("_id", 1)]))['_id'])
+
+    replayed = await bus.replay("order:order-1", first_id)
+
+    assert [event['status'] for _, event in replayed] == ["preparing"]
+    assert await bus.replay("order:order-1", "42") == []
+
+
+async def test_overflowed_subscriber_is_disconnected(db, monkeypatch):
+    monkeypatch.setattr(server, "ORDER_EVENTS_SUBSCRIBER_QUEUE", 1)
+    body = server.order_event_stream("order:order-1", None).body_iterator
+    await server.order_events.publish("order.status_changed", event_order("order-1", "confirmed"))
+    await server.order_events.publish("order.status_changed", event_order("order-1", "preparing"))
+
+    frames = [frame async for frame in body]
+
+    # The client reconnects with the last id it saw and the rest is replayed
+    assert [parse_frame(frame) for frame in frames] == [("1", "confirmed")]
+    assert not server.order_events._subscribers
+
+
+async def test_customers_cannot_stream_someone_else_s_order(api, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    other_token = server.create_jwt_token("customer-2", "customer-2@example.com", "customer")
+
+    response = await api.get(f"/orders/{placed['order_id']}/events", params={"token": other_token})
+
+    assert response.status_code == 404
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import insert_order
+
+pytestmark = pytest.mark.anyio
+
+
+MAX_PAGES = 20
+
+
+async def read_all_pages(api, path: str, headers: dict, **params) -> list:
+    pages = []
+    cursors = set()
+    cursor = None
+    for _ in range(MAX_PAGES):
+        response = await api.get(path, params={**params, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200, response.text
+        pages.append([order['id'] for order in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+        assert cursor not in cursors, f"cursor {cursor} was handed out twice"
+        cursors.add(cursor)
+    pytest.fail(f"history did not end within {MAX_PAGES} pages")
+
+
+@pytest.fixture
+async def history(db, restaurant):
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    orders = []
+    for day in range(7):
+        status = "delivered" if day % 2 else "cancelled"
+        orders.append(await insert_order(db.orders, restaurant['id'], created_at=start + timedelta(days=day), status=status))
+    # Someone else's order never shows up in this customer's history
+    await insert_order(db.orders, restaurant['id'], user_id="customer-2", created_at=start)
+    return orders
+
+
+async def test_pages_walk_the_history_newest_first_without_gaps(api, history, customer_headers):
+    pages = await read_all_pages(api, "/orders", customer_headers, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [order_id for page in pages for order_id in page] == [order['_id'] for order in reversed(history)]
+
+
+async def test_status_and_date_filters_narrow_the_page(api, history, customer_headers):
+    response = await api.get("/orders", params={
+        "status": "delivered", "from": "2026-03-02T00:00:00Z", "to": "2026-03-06T00:00:00Z"
+    }, headers=customer_headers)
+
+    assert response.status_code == 200
+    assert [order['id'] for order in response.json()] == [history[3]['_id'], history[1]['_id']]
+
+
+async def test_restaurant_history_includes_every_customer(api, history, restaurant, owner_headers):
+    pages = await read_all_pages(api, f"/restaurants/{restaurant['id']}/orders", owner_headers, limit=5)
+
+    assert sum(len(page) for page in pages) == 8
+
+
+async def test_orders_with_the_same_timestamp_page_by_id(api, db, restaurant, customer_headers):
+    at = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    orders = [await insert_order(db.orders, restaurant['id'], created_at=at) for _ in range(5)]
+
+    pages = await read_all_pages(api, "/orders", customer_headers, limit=2)
+
+    assert sorted(order_id for page in pages for order_id in page) == sorted(order['_id'] for order in orders)
+
+
+async def test_legacy_order_id_works_as_a_cursor(api, db, restaurant, customer_headers):
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    newer = await insert_order(db.orders, restaurant['id'], created_at=start + timedelta(days=1))
+    legacy_id = "6a2f41a0-1b2c-4d3e-8f40-123456789abc"
+    await db.orders.insert_one({**newer, "_id": "legacy-object-id", "id": legacy_id, "created_at": start})
+    older = await insert_order(db.orders, restaurant['id'], created_at=start - timedelta(days=1))
+
+    response = await api.get("/orders", params={"cursor": legacy_id}, headers=customer_headers)
+
+    assert [order['id'] for order in response.json()] == [older['_id']]
+
+
+async def test_unknown_cursor_is_rejected(api, history, customer_headers):
+    response = await api.get("/orders", params={"cursor": "not-an-order"}, headers=customer_headers)
+
+    assert response.status_code == 400
+
+
+def test_naive_filter_times_are_taken_as_utc():
+    assert server.storage_time(datetime(2026, 3, 1, 5, 30)) == datetime(2026, 3, 1, 5, 30, tzinfo=timezone.utc)
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.conftest import auth_headers, checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def set_status(api, headers: dict, order: dict, status: str):
+    return await api.put(f"/restaurants/{order['restaurant_id']}/orders/{order['id']}/status", params={"status": status}, headers=headers)
+
+
+@pytest.fixture
+async def order(api, db, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    return server.order_out(await db.orders.find_one({"_id": placed['order_id']}))
+
+
+async def test_order_moves_through_the_lifecycle(api, db, order, owner_headers):
+    for status in ["confirmed", "preparing", "out_for_delivery", "delivered"]:
+        response = await set_status(api, owner_headers, order, status)
+        assert response.status_code == 200, response.text
+        assert response.json()['status'] == status
+
+    stored = await db.orders.find_one({"_id": order['id']})
+    assert [entry['status'] for entry in stored['status_history']] == ["confirmed", "preparing", "out_for_delivery", "delivered"]
+    assert all(entry['by'] == "owner-1" for entry in stored['status_history'])
+
+
+async def test_illegal_transition_is_rejected_and_leaves_the_order_alone(api, db, order, owner_headers):
+    response = await set_status(api, owner_headers, order, "delivered")
+
+    assert response.status_code == 409
+    assert "pending" in response.json()['detail']
+    stored = await db.orders.find_one({"_id": order['id']})
+    assert stored['status'] == "pending"
+    assert stored['status_history'] == []
+
+
+async def test_finished_orders_cannot_be_reopened(api, order, owner_headers):
+    await set_status(api, owner_headers, order, "cancelled")
+
+    response = await set_status(api, owner_headers, order, "confirmed")
+
+    assert response.status_code == 409
+
+
+async def test_concurrent_updates_apply_exactly_once(api, db, order, owner_headers):
+    await set_status(api, owner_headers, order, "confirmed")
+
+    responses = await asyncio.gather(*[set_status(api, owner_headers, order, "preparing") for _ in range(2)])
+
+    assert sorted(response.status_code for response in responses) == [200, 409]
+    stored = await db.orders.find_one({"_id": order['id']})
+    assert [entry['status'] for entry in stored['status_history']] == ["confirmed", "preparing"]
+
+
+async def test_unknown_status_is_rejected(api, order, owner_headers):
+    response = await set_status(api, owner_headers, order, "eaten")
+
+    assert response.status_code == 400
+
+
+async def test_unknown_order_is_not_found(api, order, owner_headers):
+    response = await set_status(api, owner_headers, {**order, "id": server.new_id()}, "confirmed")
+
+    assert response.status_code == 404
+
+
+async def test_only_the_owner_can_change_the_status(api, db, order):
+    response = await set_status(api, auth_headers("owner-2", "restaurant_owner"), order, "confirmed")
+
+    assert response.status_code == 403
+    assert (await db.orders.find_one({"_id": order['id']}))['status'] == "pending"
+
+
+def test_predecessors_mirror_the_transition_table():
+    assert server.ORDER_STATUS_PREDECESSORS["confirmed"] == ["pending"]
+    assert sorted(server.ORDER_STATUS_PREDECESSORS["cancelled"]) == ["confirmed", "pending", "preparing"]
+    assert server.ORDER_STATUS_PREDECESSORS["pending"] == []
@@ -0,0 +1,124 @@
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+from tests.conftest import checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+class Receiver:
+    def __init__(self):
+        self.status_code = 200
+        self.requests = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return httpx.Response(self.status_code)
+
+
+@pytest.fixture
+async def receiver(db, monkeypatch):
+    receiver = Receiver()
+    outbound = httpx.AsyncClient(transport=httpx.MockTransport(receiver.handle))
+    monkeypatch.setattr(server, "_outbound_client", outbound)
+    monkeypatch.setattr(server, "_destination_slots", {})
+    yield receiver
+    await outbound.aclose()
+
+
+@pytest.fixture
+async def endpoint(api, restaurant, owner_headers):
+    response = await api.post(
+        f"/restaurants/{restaurant['id']}/delivery-endpoints",
+        json={"kind": "webhook", "url": "https://pos.example.com/orders", "events": ["order.created"]},
+        headers=owner_headers
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def place_and_dispatch(api, menu_item, customer_headers) -> dict:
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    await server.dispatch_outbox()
+    await server.dispatch_outbound()
+    return placed
+
+
+async def make_due(db):
+    await db.outbound_deliveries.update_many({"status": "pending"}, {"$set": {"available_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+
+async def test_order_is_delivered_signed_with_the_endpoint_secret(api, db, menu_item, customer_headers, endpoint, receiver):
+    placed = await place_and_dispatch(api, menu_item, customer_headers)
+
+    [request] = receiver.requests
+    timestamp = request.headers["X-Signature-Timestamp"]
+    expected = hmac.new(endpoint['secret'].encode(), timestamp.encode() + b"." + request.content, hashlib.sha256).hexdigest()
+    assert request.headers["X-Signature"] == f"sha256={expected}"
+    events = json.loads(request.content)['events']
+    assert [(event['type'], event['order']['id']) for event in events] == [("order.created", placed['order_id'])]
+    assert (await db.outbound_deliveries.find_one({}))['status'] == "delivered"
+
+
+async def test_replayed_outbox_event_is_delivered_once(api, db, menu_item, customer_headers, endpoint, receiver):
+    await checkout_cart(api, customer_headers, menu_item)
+    event = await db.outbox.find_one({"topic": "order.created"})
+
+    await server.enqueue_outbound_deliveries(event)
+    await server.enqueue_outbound_deliveries(event)
+    await server.dispatch_outbound()
+
+    assert await db.outbound_deliveries.count_documents({}) == 1
+    assert len(receiver.requests) == 1
+
+
+async def test_failed_delivery_is_retried_then_dead_lettered(api, db, menu_item, customer_headers, endpoint, receiver, owner_headers, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOUND_MAX_ATTEMPTS", 2)
+    receiver.status_code = 503
+    await place_and_dispatch(api, menu_item, customer_headers)
+
+    delivery = await db.outbound_deliveries.find_one({})
+    assert (delivery['status'], delivery['attempts'], delivery['last_error']) == ("pending", 1, "HTTP 503")
+    assert delivery['available_at'] > datetime.now(timezone.utc)
+    # Backing off until it is due again
+    assert await server.dispatch_outbound() == 0
+
+    await make_due(db)
+    await server.dispatch_outbound()
+
+    assert (await db.outbound_deliveries.find_one({}))['status'] == "dead"
+    dead_letters = await api.get(f"/restaurants/{endpoint['restaurant_id']}/delivery-endpoints/dead-letters", headers=owner_headers)
+    assert [letter['attempts'] for letter in dead_letters.json()] == [2]
+
+    receiver.status_code = 200
+    retried = await api.post(f"/restaurants/{endpoint['restaurant_id']}/delivery-endpoints/dead-letters/retry", headers=owner_headers)
+    await server.dispatch_outbound()
+
+    assert retried.json() == {"requeued": 1}
+    assert (await db.outbound_deliveries.find_one({}))['status'] == "delivered"
+    assert len(receiver.requests) == 3
+
+
+async def test_rejected_delivery_is_dead_lettered_without_retrying(api, db, menu_item, customer_headers, endpoint, receiver):
+    receiver.status_code = 410
+    await place_and_dispatch(api, menu_item, customer_headers)
+
+    delivery = await db.outbound_deliveries.find_one({})
+    assert (delivery['status'], delivery['attempts']) == ("dead", 1)
+
+
+async def test_deliveries_for_a_removed_endpoint_are_dropped(api, db, menu_item, customer_headers, endpoint, receiver, owner_headers):
+    await checkout_cart(api, customer_headers, menu_item)
+    await server.dispatch_outbox()
+    await api.delete(f"/restaurants/{endpoint['restaurant_id']}/delivery-endpoints/{endpoint['id']}", headers=owner_headers)
+
+    await server.dispatch_outbound()
+
+    assert (await db.outbound_deliveries.find_one({}))['status'] == "cancelled"
+    assert receiver.requests == []
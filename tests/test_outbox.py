@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import add_to_cart, checkout_cart
+
+pytestmark = pytest.mark.anyio
+
+
+async def make_due(db):
+    # Skip the backoff so the next dispatch retries straight away
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    for event in await db.outbox.find({"status": "pending"}).to_list(None):
+        handlers = {name: {**state, "next_attempt_at": past} if "next_attempt_at" in state else state for name, state in event['handlers'].items()}
+        await db.outbox.update_one({"_id": event['_id']}, {"$set": {"handlers": handlers, "available_at": past}})
+
+
+async def test_checkout_writes_its_event_with_the_orders(api, db, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+
+    event = await db.outbox.find_one({"topic": "order.created"})
+    assert [order['id'] for order in event['payload']['orders']] == [placed['order_id']]
+    assert event['status'] == "pending"
+    assert set(event['handlers']) == {"publish_events", "deliver_outbound"}
+
+
+async def test_failing_handler_is_retried_without_rerunning_the_others(api, db, menu_item, customer_headers, monkeypatch):
+    calls = {"publish_events": 0, "deliver_outbound": 0}
+
+    async def flaky_publish(event):
+        calls['publish_events'] += 1
+        if calls['publish_events'] == 1:
+            raise RuntimeError("event bus down")
+
+    async def deliver(event):
+        calls['deliver_outbound'] += 1
+
+    monkeypatch.setitem(server.OUTBOX_HANDLERS["order.created"], "publish_events", flaky_publish)
+    monkeypatch.setitem(server.OUTBOX_HANDLERS["order.created"], "deliver_outbound", deliver)
+    await checkout_cart(api, customer_headers, menu_item)
+
+    await server.dispatch_outbox()
+
+    event = await db.outbox.find_one({"topic": "order.created"})
+    assert event['status'] == "pending"
+    assert event['handlers']['publish_events']['attempts'] == 1
+    assert event['handlers']['publish_events']['last_error'] == "event bus down"
+    assert event['handlers']['deliver_outbound']['status'] == "done"
+    # Backing off: nothing is due yet
+    assert await server.dispatch_outbox() == 0
+
+    await make_due(db)
+    await server.dispatch_outbox()
+    await make_due(db)
+    await server.dispatch_outbox()
+
+    event = await db.outbox.find_one({"topic": "order.created"})
+    assert event['status'] == "done"
+    assert calls == {"publish_events": 2, "deliver_outbound": 1}
+
+
+async def test_handler_gives_up_after_max_attempts(api, db, menu_item, customer_headers, monkeypatch):
+    async def broken(event):
+        raise RuntimeError("still down")
+
+    monkeypatch.setattr(server, "OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setitem(server.OUTBOX_HANDLERS["order.created"], "publish_events", broken)
+    await checkout_cart(api, customer_headers, menu_item)
+
+    for _ in range(3):
+        await make_due(db)
+        await server.dispatch_outbox()
+
+    event = await db.outbox.find_one({"topic": "order.created"})
+    assert event['status'] == "done"
+    assert event['handlers']['publish_events']['status'] == "dead"
+    assert event['handlers']['publish_events']['attempts'] == 2
+
+
+async def test_event_locked_by_another_worker_is_skipped(api, db, menu_item, customer_headers):
+    await checkout_cart(api, customer_headers, menu_item)
+    await db.outbox.update_many({}, {"$set": {"locked_by": "other-worker", "locked_until": datetime.now(timezone.utc) + timedelta(seconds=60)}})
+
+    assert await server.dispatch_outbox() == 0
+
+
+async def test_payment_publishes_paid_events_once(api, db, gateway, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    created = await api.post("/payments/create-order", params={"checkout_id": placed['checkout_id']}, headers=customer_headers)
+    razorpay_order_id = created.json()['razorpay_order_id']
+    subscriber = server.order_events.subscribe(f"order:{placed['order_id']}")
+
+    await server.settle_payment(razorpay_order_id, "pay_1")
+    # A second confirmation of the same payment pays nothing and writes no event
+    await server.settle_payment(razorpay_order_id, "pay_1")
+    await server.dispatch_outbox()
+
+    assert await db.outbox.count_documents({"topic": "order.paid"}) == 1
+    events = [subscriber.queue.get_nowait()[1]['type'] for _ in range(subscriber.queue.qsize())]
+    assert events.count("order.paid") == 1
+
+
+async def test_payment_leaves_items_added_after_checkout_in_the_cart(api, db, gateway, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    await add_to_cart(api, customer_headers, menu_item, "Half")
+    created = await api.post("/payments/create-order", params={"checkout_id": placed['checkout_id']}, headers=customer_headers)
+
+    await server.settle_payment(created.json()['razorpay_order_id'], "pay_1")
+    await server.dispatch_outbox()
+
+    cart = await db.cart_items.find({"user_id": "customer-1"}).to_list(None)
+    assert [line['variant_name'] for line in cart] == ["Half"]
+
+
+async def test_events_for_retired_handlers_still_complete(db):
+    now = datetime.now(timezone.utc)
+    await db.outbox.insert_one({
+        "_id": server.new_id(),
+        "topic": "order.paid",
+        "payload": {"user_id": "customer-1", "orders": []},
+        "status": "pending",
+        "handlers": {name: {"status": "pending", "attempts": 0} for name in ["clear_cart", "publish_events", "deliver_outbound"]},
+        "available_at": now,
+        "locked_until": None,
+        "created_at": now
+    })
+
+    await server.dispatch_outbox()
+
+    event = await db.outbox.find_one({})
+    assert event['status'] == "done"
+    assert event['handlers']['clear_cart']['status'] == "done"
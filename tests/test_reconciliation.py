@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+import stub_gateway
+from tests.conftest import checkout_cart, pay
+
+pytestmark = pytest.mark.anyio
+
+
+async def age_orders(db, **age):
+    then = datetime.now(timezone.utc) - timedelta(**age)
+    await db.orders.update_many({}, {"$set": {"created_at": then, "updated_at": then}})
+
+
+@pytest.fixture
+async def placed(api, gateway, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    created = await api.post("/payments/create-order", params={"order_id": placed['order_id']}, headers=customer_headers)
+    return {**placed, "razorpay_order_id": created.json()['razorpay_order_id']}
+
+
+def fail_payment(razorpay_order_id: str):
+    stub_gateway.payments["pay_failed"] = {"id": "pay_failed", "order_id": razorpay_order_id, "status": "failed"}
+
+
+async def test_capture_nobody_reported_is_settled(db, gateway, placed):
+    await pay(gateway, placed['razorpay_order_id'])
+    await age_orders(db, minutes=30)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes['paid'] == 1
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert (order['payment_status'], order['status']) == ("paid", "confirmed")
+
+
+async def test_failed_attempts_mark_the_order_failed_but_keep_it_payable(db, gateway, placed):
+    fail_payment(placed['razorpay_order_id'])
+    await age_orders(db, minutes=30)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes['failed'] == 1
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert (order['payment_status'], order['status']) == ("failed", "pending")
+
+
+async def test_failed_orders_expire_once_past_the_window(db, gateway, placed, menu_item):
+    fail_payment(placed['razorpay_order_id'])
+    await db.orders.update_many({}, {"$set": {"payment_status": "failed"}})
+    await age_orders(db, hours=25)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes['expired'] == 1
+    order = await db.orders.find_one({"_id": placed['order_id']})
+    assert (order['payment_status'], order['status']) == ("expired", "cancelled")
+    assert order['status_history'][-1]['by'] == "payment_expiry"
+    # Counted on the day the order was placed
+    assert await db.daily_stats.count_documents({"restaurant_id": menu_item['restaurant_id'], "date": server.stats_day(order['created_at']), "cancellations": 1}) == 1
+    # Expiry is final: the next sweep does not look at the order again
+    assert await server.reconcile_payments() == {"paid": 0, "failed": 0, "expired": 0, "unchanged": 0}
+
+
+async def test_recent_orders_without_a_capture_are_left_alone(db, gateway, placed):
+    await age_orders(db, minutes=30)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes['unchanged'] == 1
+    assert (await db.orders.find_one({"_id": placed['order_id']}))['payment_status'] == "pending"
+
+
+async def test_checkouts_abandoned_before_a_gateway_order_expire(api, db, menu_item, customer_headers):
+    placed = await checkout_cart(api, customer_headers, menu_item)
+    await age_orders(db, hours=25)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes['expired'] == 1
+    assert (await db.orders.find_one({"_id": placed['order_id']}))['status'] == "cancelled"
+
+
+async def test_sweep_pauses_while_the_gateway_is_down(db, gateway, placed, monkeypatch):
+    monkeypatch.setattr(server, "RAZORPAY_RETRY_BASE_DELAY", 0)
+    monkeypatch.setitem(stub_gateway.settings, "failure_rate", 1.0)
+    await age_orders(db, minutes=30)
+
+    outcomes = await server.reconcile_payments()
+
+    assert outcomes == {"paid": 0, "failed": 0, "expired": 0, "unchanged": 0}
+    assert not (await db.job_leases.find_one({"_id": "payment_reconciler"}) or {}).get('checkpoint')
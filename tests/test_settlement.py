@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from tests.conftest import insert_order
+
+pytestmark = pytest.mark.anyio
+
+PERIOD_START = datetime(2026, 3, 1, tzinfo=timezone.utc)
+PERIOD_END = datetime(2026, 4, 1, tzinfo=timezone.utc)
+
+
+async def paid_order(db, restaurant_id: str, total_amount: float, paid_at, **fields) -> dict:
+    order = await insert_order(db.orders, restaurant_id, total_amount=total_amount, payment_status="paid", created_at=datetime(2026, 3, 10, tzinfo=timezone.utc))
+    # paid_at and refunds are written by payment handling, not the Order model
+    extra = {**({"paid_at": paid_at} if paid_at else {}), **fields}
+    if extra:
+        await db.orders.update_one({"_id": order['_id']}, {"$set": extra})
+    return {**order, **extra}
+
+
+@pytest.fixture
+async def paid_orders(db, restaurant):
+    return [
+        await paid_order(db, restaurant['id'], 333.33, datetime(2026, 3, 2, tzinfo=timezone.utc)),
+        await paid_order(db, restaurant['id'], 100.01, datetime(2026, 3, 3, tzinfo=timezone.utc)),
+        await paid_order(db, restaurant['id'], 200.0, datetime(2026, 3, 4, tzinfo=timezone.utc), payment_status="partially_refunded", refunded_paise=5000),
+        # Paid before paid_at was recorded: selected by created_at
+        await paid_order(db, restaurant['id'], 50.0, None)
+    ]
+
+
+async def test_run_totals_each_restaurant_in_paise(db, restaurant, paid_orders):
+    # Not settled: paid in the next period, fully refunded, or never paid
+    await paid_order(db, restaurant['id'], 400.0, datetime(2026, 4, 1, tzinfo=timezone.utc))
+    await paid_order(db, restaurant['id'], 80.0, datetime(2026, 3, 5, tzinfo=timezone.utc), payment_status="refunded")
+    await insert_order(db.orders, restaurant['id'], created_at=datetime(2026, 3, 6, tzinfo=timezone.utc))
+
+    run = await server.run_settlement(PERIOD_START, PERIOD_END)
+
+    entry = await db.settlement_ledger.find_one({"restaurant_id": restaurant['id']})
+    assert entry['status'] == "settled"
+    assert entry['orders'] == 4
+    assert entry['gross_paise'] == 33333 + 10001 + 15000 + 5000
+    assert entry['refunded_paise'] == 5000
+    # 10% commission, rounded half up per order; the refund gives back its share
+    assert entry['commission_paise'] == 3333 + 1000 + 1500 + 500
+    assert entry['payable_paise'] == entry['gross_paise'] - entry['commission_paise']
+    assert (run['status'], run['orders'], run['payable_paise']) == ("completed", 4, entry['payable_paise'])
+
+
+async def test_interrupted_run_resumes_from_its_checkpoint(db, restaurant, paid_orders):
+    first = paid_orders[0]
+    run_id = server.settlement_run_id(PERIOD_START, PERIOD_END)
+    # The crashed run had counted the first order before it stopped
+    await db.settlement_ledger.insert_one({
+        "_id": f"{run_id}:{restaurant['id']}",
+        "run_id": run_id,
+        "restaurant_id": restaurant['id'],
+        "period_start": PERIOD_START,
+        "period_end": PERIOD_END,
+        "status": "in_progress",
+        "orders": 1,
+        "gross_paise": 33333,
+        "refunded_paise": 0,
+        "commission_paise": 3333,
+        "payable_paise": 30000,
+        "checkpoint": {"collection": "orders", "field": "paid_at", "at": first['paid_at'], "order_id": first['_id']}
+    })
+
+    await server.run_settlement(PERIOD_START, PERIOD_END)
+
+    entry = await db.settlement_ledger.find_one({"restaurant_id": restaurant['id']})
+    assert entry['orders'] == 4
+    assert entry['gross_paise'] == 63334
+
+
+async def test_completed_run_is_not_recounted(db, restaurant, paid_orders):
+    first = await server.run_settlement(PERIOD_START, PERIOD_END)
+    await paid_order(db, restaurant['id'], 999.0, datetime(2026, 3, 20, tzinfo=timezone.utc))
+
+    again = await server.run_settlement(PERIOD_START, PERIOD_END)
+
+    assert again['payable_paise'] == first['payable_paise']
+    assert await db.settlement_ledger.count_documents({}) == 1
+
+
+async def test_orders_paid_in_the_period_are_settled_from_the_archive(db, restaurant):
+    await server.ensure_archive_collection("orders_archive_202602")
+    archived = await insert_order(db.orders_archive_202602, restaurant['id'], payment_status="paid", created_at=datetime(2026, 2, 27, tzinfo=timezone.utc))
+    await db.orders_archive_202602.update_one({"_id": archived['_id']}, {"$set": {"paid_at": datetime(2026, 3, 1, 1, tzinfo=timezone.utc)}})
+
+    run = await server.run_settlement(PERIOD_START, PERIOD_END)
+
+    assert (run['orders'], run['gross_paise']) == (1, 25000)